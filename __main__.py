@@ -7,6 +7,9 @@ import xarray as xr
 import netCDF4 as nc
 from netCDF4 import Dataset
 import p_optimisation_designer as optimisation_designer
+import p_optimisation_operator as optimisation_operator
+import p_sweep as sweep
+import p_scenarios as scenarios
 import time
 from pathos.multiprocessing import ProcessPool
 import os
@@ -19,7 +22,7 @@ def main():
     #Read netcdf file
     weather_input = input("Weather Data Filename: ")
     weather_file = "~/Desktop/4YP/Model_for_Luke-main/Equipment Data/" + weather_input
-    weather_data = [xr.open_dataset(weather_file)]
+    weather_data = xr.open_dataset(weather_file) #Every grid cell in the file is designed - see p_sweep.py
 
 
 
@@ -27,48 +30,75 @@ def main():
     #weather_data = ['52.99_0.68_renewable_energy data2021.csv']
 
 
-    #Class for storing data
-    stored_data = d_store.Data_store()
+    #Class for storing data - results go into this file as each location finishes, so a run that stops part way can be
+    #picked up again with Resume = True (locations already in the file are skipped)
+    Resume = False
+    stored_data = d_store.Result_store('Basic_run.sqlite', resume = Resume, series_file = 'Basic_run_series.nc') #Hourly series go to the NetCDF file
     
     #Modify this for scale adjustments
     Target_Productions = [1E6]
     if len(Target_Productions) ==1:
         Target_Production = Target_Productions[0]
     
+    #Years each designed plant is then operated over (all must be in the weather file), run in parallel after the
+    #designs; leave empty to only design
+    Operating_years = []
+    
+    #Set to True to run every cost sensitivity (Production x Storage x Finance, from Equipment Data/) for each target
+    #production at the first location in the file, rather than the Base costs at every location - see p_scenarios.py
+    Sensitivity_run = False
+
+    #Set to True to run the locations along a Hilbert curve over the grid, starting each from the solution of its nearest
+    #solved neighbour (see p_solution_cache.py); the time saved against cold starts is printed after the designs
+    Warm_start = False
+
+    #Set to a directory to keep every location's result there, so running the sweep again only solves the locations
+    #whose profile, costs or settings have changed (see p_result_cache.py); None keeps nothing
+    Result_cache = None
+    
     #Modify this to adjust the parallelism (i.e. how many cores in your computer are used)
-    Processes = 3 #Higher number means more cores - but you will run into RAM limits so don't make it too high
-    pool = ProcessPool(nodes=Processes)
+    Processes = None #None sizes the pool (and solver threads) to fit Memory_budget - see p_memory.py; or set a number of cores
+    Memory_budget = None #In MB; None uses 80% of the memory available when the sweep starts
     
-    #Modify this to adjust any data aggregation you'd like to do
+    #Modify this to adjust any data aggregation you'd like to do - see p_aggregation.AGGREGATION_MODES for the options
+    #('aggregate', 'optimal_cluster', 'duration_curve'); results report how much variance each keeps.
+    #'duration_curve' doesn't keep the chronology storage needs, so only use it for screening
     aggregation_mode = 'aggregate'
     aggregation_variable = 1 #This aggregates the data on your behalf into smaller timesteps; Luke - I would leave set to 1
 
     #This builds sets of years over which the analysis will be done - #Luke - only modify this if you want to design using >1 year of data; I wouldn't to start.
     year_cases = []
     period = 1 #Number of years of analysis
+    Design_backend = 'pyomo' #'benders' designs over monthly periods instead of one LP (see p_benders.py) - use it for period > 1
     for year in range(2019, 2020, period):
         lst = [year+i for i in range(0,period)]
         year_cases.append(lst)
     if len(year_cases) ==1:
         design_years = year_cases[0]
     
+    if Sensitivity_run:
+        optimal_design = optimisation_designer.location_optimise_design(Target_Productions[0], backend = Design_backend)
+        stored_data.get_active_components(optimal_design)
+        scenarios.scenario_sweep(weather_data, optimal_design, design_years, Target_Productions, aggregation_variable,
+                                 aggregation_mode, output_file_name = 'Sensitivity_run.csv', processes = Processes,
+                                 memory_budget = Memory_budget, stored_data = stored_data)
+        Target_Productions = []
+    
     #Now, iterate over the relevant cases to do the optimisation
     for Target_Production in Target_Productions: #Here the model iterates over target productions, but you can change this to iterate over something else (e.g. A model input parameter)
         start_time = time.time()
         
         #Set up case
-        optimal_design = optimisation_designer.location_optimise_design(Target_Production)
+        optimal_design = optimisation_designer.location_optimise_design(Target_Production, backend = Design_backend)
         stored_data.get_active_components(optimal_design)
+        operating_class = optimisation_operator.location_optimise_operation(Target_Production) if Operating_years else None
 
-        #Run case - goes through the driver to implement parallelism
-        TASKS = [(driver.driver, (datum, optimal_design, design_years, aggregation_variable, aggregation_mode))\
-                                            for datum in weather_data]
-        imap_it = pool.imap(driver.calculatestar, TASKS)
-
-        #Calculate and store results
-        for result in imap_it:
-            if not isinstance(result, str):
-                stored_data.add_location(result, design_years, scale = Target_Production)
+        #Run case - one driver task per grid cell, spread over the pool; results are written to file as they arrive
+        sweep.sweep(weather_data, optimal_design, design_years, aggregation_variable, aggregation_mode,
+                    output_file_name = 'Target_Production_{a}_sweep.csv'.format(a = Target_Production),
+                    processes = Processes, memory_budget = Memory_budget, stored_data = stored_data, resume = Resume,
+                    operating_class = operating_class, operating_years = Operating_years, warm_start = Warm_start,
+                    cache_directory = Result_cache)
 
         # Uncomment the lines below if you'd like each run to be stored in a separate file (And comment the section outside the loop)
         # df = pd.DataFrame.from_dict(stored_data.collated_results, orient="index")
@@ -77,12 +107,9 @@ def main():
         # stored_data = d_store.Data_store() #If this line is uncommented, be sure to output the csv for every run, because the results will be deleted
 
     # Comment the lines below if you don't want all the data to be stored in a single file
-    df = pd.DataFrame.from_dict(stored_data.collated_results, orient="index")
     output_file_name = 'Basic_run_2061_2063.csv'.format(a = design_years[0])
-    df.to_csv(output_file_name)
-
-    pool.close()    
-    pool.join()
+    stored_data.to_csv(output_file_name)
+    stored_data.close()
 
 if __name__ == '__main__':
     # Set up the class in which data will be stored
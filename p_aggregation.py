@@ -0,0 +1,192 @@
+"""Methods for reducing an hourly renewable profile to fewer, weighted time periods before it is optimised.
+Every method takes a dictionary of hourly column arrays, the year of each row, its aggregation variable and the columns
+used to judge similarity, and returns (aggregated columns, rows, labels). Aggregated columns are sums over the hours in
+each period, with Weights holding the number of hours; rows gives the hourly row each period takes its year and start time
+from; labels gives the aggregated row each hourly row ended up in, which aggregation_report uses to measure how much of
+the original profile survives."""
+import heapq
+import numpy as np
+
+
+def fixed_blocks(columns, years, aggregation_count, columns_to_sum = None, ragged_tail = False):
+    """Merges consecutive blocks of aggregation_count rows by summing each column. aggregation_count can be any positive
+    integer; if it does not divide evenly into the number of rows, the leftover rows form a shorter final block when
+    ragged_tail is True, and a TypeError is raised otherwise"""
+    if aggregation_count < 1 or aggregation_count != int(aggregation_count):
+        raise TypeError("Aggregation counter must be a positive integer")
+    aggregation_count = int(aggregation_count)
+    size = len(years)
+    full_blocks, tail = divmod(size, aggregation_count)
+    if tail != 0 and not ragged_tail:
+        raise TypeError("Aggregation counter must divide evenly into the total number of data points")
+
+    full_rows = full_blocks*aggregation_count
+    aggregated = {}
+    for name, values in dict(columns, Weights = np.ones(size)).items():
+        blocks = values[:full_rows].reshape(full_blocks, aggregation_count).sum(axis=1)
+        if tail != 0:
+            blocks = np.append(blocks, values[full_rows:].sum())
+        aggregated[name] = blocks
+    # Each block is dated by its first row
+    return aggregated, np.arange(0, size, aggregation_count), np.arange(size)//aggregation_count
+
+
+def chronological_cluster(columns, years, data_reduction_factor, columns_to_sum):
+    """Reduces the data size by repeatedly merging the most similar pair of adjacent periods until it has reduced in size
+    by data_reduction_factor. Chronology is kept, so storage still links each period to the next"""
+    if data_reduction_factor<1:
+        raise TypeError("Data reduction factor must be greater than 1")
+
+    # Work on a single (rows, columns) table. Rows are never moved: merged rows are marked dead and skipped using
+    # following, a linked list giving the next live row (-1 at the end)
+    columns = dict(columns, Weights = np.ones(len(years)))
+    names = list(columns)
+    table = np.column_stack([columns[name] for name in names])
+    sum_columns = [names.index(element) for element in columns_to_sum]
+    weights = names.index('Weights')
+    size = table.shape[0]
+    alive = np.ones(size, dtype=bool)
+    following = np.append(np.arange(1, size), -1)
+
+    differences = np.abs(np.diff(table[:, sum_columns], axis=0)).sum(axis=1)
+    proximity = np.append(2*differences*table[:-1, weights]*table[1:, weights]/(table[:-1, weights] + table[1:, weights]), 1E6)
+
+    # Priority queue of (proximity, row, version); entries whose version is out of date are skipped when popped.
+    # Ties go to the earliest row, matching the idxmin used previously, so results are unchanged
+    versions = np.zeros(size, dtype=int)
+    queue = [(proximity[row], row, 0) for row in range(size)]
+    heapq.heapify(queue)
+
+    target_size = size//data_reduction_factor
+    while size > target_size and queue:
+        _, keep_index, version = heapq.heappop(queue)
+        drop_index = following[keep_index]
+        if not alive[keep_index] or version != versions[keep_index] or drop_index == -1:
+            continue
+        table[keep_index] += table[drop_index]
+        proximity[keep_index] += proximity[drop_index]
+        alive[drop_index] = False
+        following[keep_index] = following[drop_index]
+        size -= 1
+        next_index = following[keep_index]
+        if next_index != -1:
+            differences = sum(abs(table[keep_index, element]/table[keep_index, weights]\
+                                  - table[next_index, element]/table[next_index, weights]) for element in sum_columns)
+            proximity[keep_index] = 2*differences*table[keep_index, weights]*table[next_index, weights]\
+                                            /(table[keep_index, weights] + table[next_index, weights])
+        versions[keep_index] += 1
+        heapq.heappush(queue, (proximity[keep_index], keep_index, versions[keep_index]))
+    # Rows only ever merge into the live row before them, so each hour belongs to the last live row at or before it
+    return {name: table[alive, count] for count, name in enumerate(names)}, np.flatnonzero(alive), np.cumsum(alive) - 1
+
+
+def representative_days(columns, years, data_reduction_factor, columns_to_sum, hours_per_day = 24, seed = 0,
+                        max_iterations = 100):
+    """Groups whole days into total_days//data_reduction_factor clusters with k-medoids, and represents each cluster by its
+    medoid day's own hourly profile, weighted by the number of member days, and dated by the medoid day. Representative
+    days follow the order of their medoids, and storage and ramping link each one to the next, wrapping round from the
+    last to the first as the full profile does. Each hour of a representative day stands for that hour of every member
+    day, so storage also swings as many times over; not in AGGREGATION_MODES until storage is linked between days"""
+    if data_reduction_factor<1:
+        raise TypeError("Data reduction factor must be greater than 1")
+    total_days, tail = divmod(len(years), hours_per_day)
+    if tail != 0:
+        raise TypeError("Representative days need the data to contain whole days")
+    points = np.hstack([columns[element].reshape(total_days, hours_per_day) for element in columns_to_sum])
+    medoids, day_labels = _k_medoids(points, max(1, int(total_days//data_reduction_factor)), seed, max_iterations)
+
+    # Keep clusters in the order their medoids appear; a cluster can only be empty if two medoids are identical days
+    sizes = np.bincount(day_labels, minlength = len(medoids))
+    order = [cluster for cluster in np.argsort(medoids) if sizes[cluster] > 0]
+    positions = np.empty(len(medoids), dtype=int)
+    positions[order] = np.arange(len(order))
+
+    # Columns are sums over the hours each period stands for, so the medoid's profile is scaled by its cluster's size
+    aggregated = {name: (values.reshape(total_days, hours_per_day)[medoids[order]]*sizes[order][:, None]).ravel()
+                  for name, values in dict(columns, Weights = np.ones(len(years))).items()}
+    rows = (medoids[order][:, None]*hours_per_day + np.arange(hours_per_day)[None, :]).ravel()
+    labels = (positions[day_labels][:, None]*hours_per_day + np.arange(hours_per_day)[None, :]).ravel()
+    return aggregated, rows, labels
+
+
+def duration_curve(columns, years, data_reduction_factor, columns_to_sum):
+    """Sorts the hours by total renewable output and merges them into len//data_reduction_factor equally sized bins, which
+    keeps the shape of the combined duration curve. Chronology is lost entirely, so this bounds what storage can achieve
+    rather than modelling it; use it for screening rather than final designs"""
+    if data_reduction_factor<1:
+        raise TypeError("Data reduction factor must be greater than 1")
+    size = len(years)
+    total = sum(columns[element] for element in columns_to_sum)
+    order = np.argsort(-total, kind='stable')
+    bins = np.array_split(np.arange(size), max(1, int(size//data_reduction_factor)))
+    starts = np.array([bin_[0] for bin_ in bins])
+
+    aggregated = {name: np.add.reduceat(values[order], starts)
+                  for name, values in dict(columns, Weights = np.ones(size)).items()}
+    labels = np.empty(size, dtype=int)
+    labels[order] = np.repeat(np.arange(len(bins)), [len(bin_) for bin_ in bins])
+    return aggregated, order[starts], labels
+
+
+def _distances(points, centres):
+    """Euclidean distances between each row of points and each row of centres"""
+    squared = (points**2).sum(axis=1)[:, None] + (centres**2).sum(axis=1)[None, :] - 2*points @ centres.T
+    return np.sqrt(np.maximum(squared, 0))
+
+
+def _k_medoids(points, clusters, seed, max_iterations, chunk_size = 1024):
+    """Alternating k-medoids with k-means++ seeding. Returns the index of each medoid and the cluster of each point"""
+    rng = np.random.default_rng(seed)
+    medoids = [int(rng.integers(len(points)))]
+    closest = _distances(points, points[medoids])[:, 0]
+    for _ in range(1, clusters):
+        probabilities = closest**2
+        if probabilities.sum() > 0:
+            medoids.append(int(rng.choice(len(points), p = probabilities/probabilities.sum())))
+        else:
+            medoids.append(int(np.setdiff1d(np.arange(len(points)), medoids)[0]))
+        closest = np.minimum(closest, _distances(points, points[medoids[-1:]])[:, 0])
+    medoids = np.array(medoids)
+
+    for _ in range(max_iterations):
+        labels = np.argmin(_distances(points, points[medoids]), axis=1)
+        new_medoids = medoids.copy()
+        for cluster in range(clusters):
+            members = np.flatnonzero(labels == cluster)
+            if len(members) == 0:
+                continue
+            member_points = points[members]
+            costs = np.concatenate([_distances(member_points[start:start+chunk_size], member_points).sum(axis=1)
+                                    for start in range(0, len(members), chunk_size)])
+            new_medoids[cluster] = members[np.argmin(costs)]
+        if np.array_equal(new_medoids, medoids):
+            break
+        medoids = new_medoids
+    return medoids, np.argmin(_distances(points, points[medoids]), axis=1)
+
+
+def aggregation_report(hourly, aggregated, labels, columns_to_report):
+    """Measures how well an aggregated profile represents the hourly one. Each hour is reconstructed as the mean of the
+    period it was merged into. 'Variance retained' is 1 - (squared reconstruction error / total variance), pooled over the
+    columns, and 'Duration curve error' is the root mean square difference between the sorted hourly and reconstructed values"""
+    error = variance = curve_error = 0
+    count = 0
+    for column in columns_to_report:
+        values = hourly[column]
+        reconstructed = (aggregated[column]/aggregated['Weights'])[labels]
+        error += np.sum((values - reconstructed)**2)
+        variance += np.sum((values - values.mean())**2)
+        curve_error += np.sum((np.sort(values) - np.sort(reconstructed))**2)
+        count += len(values)
+    return {'Periods': len(aggregated['Weights']),
+            'Variance retained': float(1 - error/variance) if variance > 0 else 1.0,
+            'Duration curve error': float(np.sqrt(curve_error/count)) if count > 0 else 0.0}
+
+
+# Aggregation modes available to renewable_data, by the name used for aggregation_mode. 'optimal_cluster' is the
+# chronological clustering; new methods only need to follow the signature described at the top of this file.
+# representative_days is left out: scaling each medoid day by its cluster size scales every storage and ramp swing too,
+# which put the WindWales 2019 LCOA at 652.2 USD/t against 470.73 for daily blocks
+AGGREGATION_MODES = {'aggregate': fixed_blocks,
+                     'optimal_cluster': chronological_cluster,
+                     'duration_curve': duration_curve}
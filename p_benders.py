@@ -0,0 +1,334 @@
+"""Solves the design LP of location_optimise_design (without a grid connection) by Benders decomposition. A small master
+LP chooses the capacities, how much ammonia each period (a month by default) makes, and the storage and ammonia
+production rate at the boundaries between periods. Each period is then a dispatch LP (see period_subproblem) that can be
+solved on its own - in parallel across a pool - and returns a cut on the master from its duals. Dispatch is never built
+for the whole horizon at once, so designing on several years of data stays tractable. location_optimise_design(...,
+backend = 'benders') solves the periods in turn, or on benders_workers processes at once if it is given"""
+import numpy as np
+from scipy.optimize import linprog
+import p_constraints as cons
+import p_matrix_model as matrix_model
+
+
+# Cost of each unit of slack in a period (a shortfall against HBCap_min, the ramp limits, the ammonia the master asked
+# for, or the state it asked the period to end in), per unit of LCOA; high enough that no slack is left at the optimum
+PENALTY = 1E5
+
+# Default stopping point: the relative gap between the best design found and the master's lower bound
+TOLERANCE = 1E-5
+MAX_ITERATIONS = 500
+
+
+class period_subproblem(matrix_model.matrix_design_model):
+    """The dispatch of timesteps start to stop - 1 of the design problem, for capacities, production and boundary states
+    given by the master. These are copies (columns self.linked) fixed by equality rows, so the marginals of those rows
+    are the gradient of the cost of slack with respect to the master's values"""
+
+    # Values the period takes from the master, in the order of self.linked
+    LINKED = ('C_power', 'C_components', 'C_storage', 'C_FC', 'Production', 'Initial state', 'Final state')
+
+    def __init__(self, design_class, start, stop):
+        """Reads the period's profile from design_class (after specific_model_features) and assembles the matrices"""
+        self.design_class = design_class
+        self.renewables = list(design_class._renewables)
+        self.components = list(design_class._components)
+        self.storage_components = list(design_class._storage_components)
+        times = list(design_class._times)
+        self.weights = np.array([design_class._t_weights[t] for t in times[start:stop]], dtype=float)
+        self.previous_weight = design_class._t_weights[times[start - 1]] # The first period follows the last one
+        self.power_supply = np.array([[design_class._powers[(renewable, t)] for t in times[start:stop]]
+                                      for renewable in self.renewables], dtype=float)
+        self.total_days = design_class.location.total_days
+        self.grid_on = False
+        self.size = len(self.weights)
+        self.start = start
+        self.converged = False
+
+        self._variables = {}
+        self._columns = 0
+        self._lower = []
+        self._upper = []
+        self._integer = []
+        self._rows = {'eq': {'rows': [], 'columns': [], 'values': [], 'rhs': [], 'count': 0},
+                      'ub': {'rows': [], 'columns': [], 'values': [], 'rhs': [], 'count': 0}}
+        self.add_variables()
+        self.add_constraints()
+        self.add_objective()
+        self.A_eq, self.b_eq = self._assemble('eq')
+        self.A_ub, self.b_ub = self._assemble('ub')
+        del self.design_class, self._rows # Only the matrices are needed from here on, and they are sent with every solve
+
+    def add_variables(self):
+        """Creates the dispatch variables of the design model for the period, the copies of the master's values and
+        the slacks"""
+        super().add_variables()
+        T = self.size
+        states = len(self.storage_components) + 1 # Storage, then the ammonia production rate per hour
+        self.production = self._add_variable('Production', (1,), 0, np.inf)[0]
+        self.initial_state = self._add_variable('Initial state', (states,), 0, np.inf)
+        self.final_state = self._add_variable('Final state', (states,), 0, np.inf)
+        self.linked = np.concatenate([np.atleast_1d(self._variables[name]).ravel() for name in self.LINKED])
+        self.slacks = np.concatenate([self._add_variable('HB slack', (T,), 0, np.inf),
+                                      self._add_variable('Ramp slack', (2, T), 0, np.inf).ravel(),
+                                      self._add_variable('Production slack', (2,), 0, np.inf),
+                                      self._add_variable('State slack', (2, states), 0, np.inf).ravel()])
+
+    def add_constraints(self):
+        """Adds the constraint families of p_constraints.py for the period. The storage balances and ramp limits of the
+        first timestep start from the initial state instead of wrapping round; _AmmoniaBalance becomes the period's
+        production, and the state at the last timestep must equal the final state"""
+        design_class = self.design_class
+        CF = design_class._CF
+        T = self.size
+        weights = self.weights
+        elec, hb, battery = (self.components.index(name) for name in ('Elec', 'HB+ASU', 'Battery'))
+        hydrogen_store, battery_store = (self.storage_components.index(name) for name in ('Hydrogen', 'Battery'))
+        hb_flows = [self.pi[hb], self.beta[hb], self.gamma[hb]]
+        supply = [(np.full(T, self.C_power[count]), self.power_supply[count]) for count in range(len(self.renewables))]
+        first, rest = np.array([0]), np.arange(1, T)
+
+        # _PowerBalance
+        self._add_rows('eq', supply + [(self.curtailed, -1)]
+                       + [(self.pi[count], -1) for count in range(len(self.components))], np.zeros(T))
+        # _CurtailedLimit
+        self._add_rows('ub', [(self.curtailed, 1)] + [(columns, -values) for columns, values in supply], np.zeros(T))
+        # _HydrogenBalance and _BatteryBalance
+        for store, retention, inflows, outflows in (
+                (hydrogen_store, 1, [(self.pi[elec], CF[('pi', 'H2')]), (self.beta[elec], CF[('pi', 'H2')])],
+                 [(flow, -CF[('pi', 'NH3')] / CF[('H2', 'NH3')]) for flow in hb_flows]
+                 + [(self.gamma[count], -CF[('H2', 'gamma')]) for count in range(len(self.components))]),
+                (battery_store, cons.BATTERY_RETENTION, [(self.pi[battery], CF[('pi', 'beta')])],
+                 [(self.beta[count], -1) for count in range(len(self.components))])):
+            old_storage = np.concatenate([[self.initial_state[store]], self.storage_volume[store, rest - 1]])
+            self._add_rows('eq', [(old_storage, retention)] + inflows + outflows
+                           + [(self.storage_volume[store], -1)], np.zeros(T))
+        # Production of the period, in the units of _AmmoniaBalance
+        production_factor = (design_class.G_annual_hours / 24) / self.total_days * CF[('pi', 'NH3')]
+        self._add_rows('eq', [(flow, production_factor, np.zeros(T, dtype=int)) for flow in hb_flows]
+                       + [(self.production, -1, 0), (self.slacks[3*T], 1, 0), (self.slacks[3*T + 1], -1, 0)], [0])
+        # _NH3_ramp_down and _NH3_ramp_up, with slack
+        old_weights = np.concatenate([[self.previous_weight], weights[rest - 1]])
+        modifier = 2 * old_weights * weights / (old_weights + weights)
+        rate = len(self.storage_components)
+        for count, (sign, limit) in enumerate(((1, design_class.ramp_down), (-1, design_class.ramp_up))):
+            self._add_rows('ub', [(flow[rest - 1], sign / weights[rest - 1], rest) for flow in hb_flows]
+                           + [(self.initial_state[rate], sign, 0)]
+                           + [(flow, -sign / weights) for flow in hb_flows]
+                           + [(np.full(T, self.C_components[hb]), -limit * modifier),
+                              (self.slacks[(1 + count)*T:(2 + count)*T], -1)], np.zeros(T))
+        # _ComponentCap
+        for count in range(len(self.components)):
+            self._add_rows('ub', [(self.pi[count], 1), (self.beta[count], 1), (self.gamma[count], 1),
+                                  (np.full(T, self.C_components[count]), -weights)], np.zeros(T))
+        # _DischargeCap
+        self._add_rows('ub', [(self.beta[count], 1) for count in range(len(self.components))]
+                       + [(np.full(T, self.C_components[battery]), -weights)], np.zeros(T))
+        # _StorageCap
+        for count in range(len(self.storage_components)):
+            self._add_rows('ub', [(self.storage_volume[count], 1), (np.full(T, self.C_storage[count]), -1)], np.zeros(T))
+        # _HBCap_min, with slack
+        self._add_rows('ub', [(np.full(T, self.C_components[hb]), design_class.HB_min)]
+                       + [(flow, -1 / weights) for flow in hb_flows] + [(self.slacks[:T], -1)], np.zeros(T))
+        # _FC_Cap
+        self._add_rows('ub', [(self.gamma[count], 1) for count in range(len(self.components))]
+                       + [(np.full(T, self.C_FC), -weights)], np.zeros(T))
+        # _FC_limit and _Battery_limit
+        self._add_rows('eq', [(self.gamma[elec], 1), (self.gamma[battery], 1)], np.zeros(T))
+        self._add_rows('eq', [(self.beta[battery], 1)], np.zeros(T))
+        # The final state, with slack either way
+        states = len(self.storage_components) + 1
+        state_slack = self.slacks[3*T + 2:].reshape(2, states)
+        last = [self.storage_volume[count, T - 1] for count in range(len(self.storage_components))]
+        for count in range(states):
+            ending = [(last[count], 1)] if count < rate else [(flow[T - 1], 1 / weights[T - 1]) for flow in hb_flows]
+            self._add_rows('eq', ending + [(self.final_state[count], -1), (state_slack[0, count], 1),
+                                           (state_slack[1, count], -1)], [0])
+        # Rows fixing the copies to the master's values; their right hand sides are set by solve
+        self.linking_rows = self._rows['eq']['count'] + np.arange(len(self.linked))
+        self._add_rows('eq', [(self.linked, 1)], np.zeros(len(self.linked)))
+
+    def add_objective(self):
+        """The period only pays for slack. The capital cost of the capacities (as in the full model) is kept in
+        self.capital for the master"""
+        super().add_objective()
+        self.capital = self.c[self.linked[:len(self.linked) - 1 - 2*(len(self.storage_components) + 1)]]
+        self.capital_constant = self.objective_constant
+        self.c = np.zeros(self._columns)
+        self.c[self.slacks] = PENALTY
+        self.objective_constant = 0
+
+    def solve(self, linked_values, options = None):
+        """Solves the period with the master's values fixed; returns the cost of slack and its gradient with respect to
+        linked_values (from the marginals of the linking rows)"""
+        self.b_eq[self.linking_rows] = linked_values
+        result = super().solve(options)
+        if not self.converged:
+            raise RuntimeError("A period subproblem could not be solved: {a}".format(a = result.message))
+        return self.objective, self.eqlin_marginals[self.linking_rows]
+
+
+def solve_period_star(args):
+    """Solves one period in a worker process: args are (period_subproblem, linked_values). Returns the cost, the
+    gradient and the period's solution"""
+    subproblem, linked_values = args
+    cost, gradient = subproblem.solve(linked_values)
+    return cost, gradient, subproblem.x
+
+
+class benders_design_model:
+    """The design problem for the location held by design_class, solved by Benders decomposition over periods. It has
+    the same interface as p_matrix_model.matrix_design_model (solve, solution, capacities), so location_optimise_design
+    can use it as its 'benders' backend"""
+
+    def __init__(self, design_class, periods = None, pool = None, tolerance = TOLERANCE, max_iterations = MAX_ITERATIONS):
+        """Splits the profile into periods (12 per year of data by default) of consecutive timesteps and builds their
+        subproblems. With a pool, the periods are solved on it in parallel"""
+        if design_class.grid_on:
+            raise ValueError("The Benders backend is only for designs without a grid connection")
+        self.design_class = design_class
+        self.pool = pool
+        self.tolerance = tolerance
+        self.max_iterations = max_iterations
+        T = len(design_class._times)
+        if periods is None:
+            periods = 12 * max(1, int(round(design_class.location.total_days / 365)))
+        self.bounds = np.linspace(0, T, min(periods, T) + 1).round().astype(int)
+        self.subproblems = [period_subproblem(design_class, start, stop)
+                            for start, stop in zip(self.bounds[:-1], self.bounds[1:])]
+        self.periods = len(self.subproblems)
+        self.converged = False
+        self.build_master()
+
+    def build_master(self):
+        """Lays out the master's variables: the capacities (as in period_subproblem.LINKED), then for each period its
+        production and its initial state (storage, then production rate), then one cost estimate per period"""
+        design_class = self.design_class
+        n = self.periods
+        subproblem = self.subproblems[0]
+        self.capacity_count = len(subproblem.renewables) + len(subproblem.components) + \
+                              len(subproblem.storage_components) + 1
+        self.state_count = len(subproblem.storage_components) + 1
+        self.production = self.capacity_count + np.arange(n)
+        self.states = self.capacity_count + n + np.arange(n * self.state_count).reshape(n, self.state_count)
+        self.theta = self.capacity_count + n * (1 + self.state_count) + np.arange(n)
+        self.size = self.theta[-1] + 1
+
+        self.c = np.zeros(self.size)
+        self.c[:self.capacity_count] = subproblem.capital
+        self.c[self.theta] = 1
+        self.objective_constant = subproblem.capital_constant
+
+        # Bounds: capacities as in the full model; states within the storage and HB capacities (rows below)
+        self.lower = np.zeros(self.size)
+        self.upper = np.full(self.size, np.inf)
+        self.upper[:self.capacity_count] = 20
+        self.upper[self.production] = design_class.G_production
+
+        # The periods make the target production between them, and start within the capacities
+        self.A_eq = np.zeros((1, self.size))
+        self.A_eq[0, self.production] = 1
+        self.b_eq = np.array([design_class.G_production])
+        rows = []
+        storage = len(subproblem.renewables) + len(subproblem.components)
+        hb = len(subproblem.renewables) + subproblem.components.index('HB+ASU')
+        for period in range(n):
+            for count in range(self.state_count):
+                row = np.zeros(self.size)
+                row[self.states[period, count]] = 1
+                row[storage + count if count < self.state_count - 1 else hb] = -1
+                rows.append(row)
+        self.A_state = np.array(rows)
+        self.cuts = []
+        self.cut_rhs = []
+
+    def linked_columns(self, period):
+        """Master columns of the values period_subproblem.LINKED of a period, in order"""
+        return np.concatenate([np.arange(self.capacity_count), [self.production[period]], self.states[period],
+                               self.states[(period + 1) % self.periods]])
+
+    def solve_master(self):
+        """Solves the master with the cuts so far; returns its solution"""
+        A_ub = np.vstack([self.A_state] + self.cuts) if self.cuts else self.A_state
+        b_ub = np.concatenate([np.zeros(len(self.A_state)), self.cut_rhs])
+        result = linprog(self.c, A_ub = A_ub, b_ub = b_ub, A_eq = self.A_eq, b_eq = self.b_eq,
+                         bounds = np.column_stack([self.lower, self.upper]), method = 'highs')
+        if result.status != 0:
+            raise RuntimeError("The Benders master problem could not be solved: {a}".format(a = result.message))
+        return result
+
+    def solve(self, options = None):
+        """Alternates between the master and the periods until the best design found is within tolerance of the
+        master's lower bound, or for max_iterations. Sets self.converged, self.objective (the LCOA), self.x (the master's
+        values), self.iterations, self.gap (relative to the best design) and self.slack (the periods' penalised slack)"""
+        best = np.inf
+        self.iterations = 0
+        while self.iterations < self.max_iterations:
+            self.iterations += 1
+            master = self.solve_master()
+            lower_bound = master.fun
+            tasks = [(subproblem, master.x[self.linked_columns(period)])
+                     for period, subproblem in enumerate(self.subproblems)]
+            results = list(self.pool.map(solve_period_star, tasks)) if self.pool is not None else \
+                      [solve_period_star(task) for task in tasks]
+            costs = np.array([cost for cost, gradient, x in results])
+            upper_bound = self.c[:self.capacity_count] @ master.x[:self.capacity_count] + costs.sum()
+            if upper_bound < best:
+                best = upper_bound
+                self.x = master.x
+                self.period_x = [x for cost, gradient, x in results]
+                self.slack = costs.sum() / PENALTY
+            for period, (cost, gradient, x) in enumerate(results):
+                # theta_period >= cost + gradient . (values - current values)
+                row = np.zeros(self.size)
+                np.add.at(row, self.linked_columns(period), gradient)
+                row[self.theta[period]] = -1
+                self.cuts.append(row)
+                self.cut_rhs.append(gradient @ master.x[self.linked_columns(period)] - cost)
+            if best - lower_bound <= self.tolerance * abs(best):
+                self.converged = True
+                break
+        self.objective = float(best + self.objective_constant)
+        self.gap = (best - lower_bound) / abs(best)
+        return self
+
+    def check_converged(self):
+        """Raises if the best design found is not within tolerance of the optimum"""
+        if not self.converged:
+            raise RuntimeError("The Benders decomposition did not converge in {a} iterations (gap {b:.2e})".format(
+                a = self.iterations, b = self.gap))
+
+    def solution(self):
+        """Returns the solution for the whole profile in the layout of matrix_design_model.solution, joining the
+        dispatch of the periods"""
+        self.check_converged()
+        design_class = self.design_class
+        solution = {}
+        for name in ('pi', 'beta', 'gamma', 'curtailed', 'storage_volume'):
+            solution[name] = np.concatenate([x[subproblem._variables[name]] for subproblem, x in
+                                             zip(self.subproblems, self.period_x)], axis = -1)
+        capacities = self.capacities()
+        solution['C_power'] = np.array(list(capacities['Renewables'].values()))
+        solution['C_components'] = np.array(list(capacities['Components'].values()))
+        solution['C_storage'] = np.array(list(capacities['StorageComponents'].values()))
+        solution['C_FC'] = capacities['FC']
+        T = solution['curtailed'].size
+        solution.update(grid_active = 0, eta_in = np.zeros(T), eta_out = np.zeros(T))
+        solution['power_supply'] = np.concatenate([subproblem.power_supply for subproblem in self.subproblems], axis = 1)
+        solution['t_weights'] = np.concatenate([subproblem.weights for subproblem in self.subproblems])
+        solution['grid_power_cost'] = np.array([design_class._grid_power_cost[t] for t in design_class._times], dtype=float)
+        solution['grid_power_cost_no_TUOS'] = np.array([design_class._grid_power_cost_no_TUOS[t]
+                                                        for t in design_class._times], dtype=float)
+        solution['total_days'] = design_class.location.total_days
+        solution['obj'] = self.objective
+        return solution
+
+    def capacities(self):
+        """Returns the designed capacities in the same format as location_optimise_design.get_capacities"""
+        self.check_converged()
+        subproblem = self.subproblems[0]
+        values = self.x[:self.capacity_count].tolist()
+        renewables, components = len(subproblem.renewables), len(subproblem.components)
+        return {'Renewables': dict(zip(subproblem.renewables, values[:renewables])),
+                'Components': dict(zip(subproblem.components, values[renewables:renewables + components])),
+                'StorageComponents': dict(zip(subproblem.storage_components, values[renewables + components:-1])),
+                'FC': values[-1], 'Production_LCOA': self.objective, 'Grid Active': 0}
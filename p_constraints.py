@@ -1,9 +1,27 @@
 import pyomo.environ as pm
 
+BATTERY_RETENTION = 0.999943 # Fraction of the battery charge kept from one timestep to the next
+
+def _grid_in(model, t):
+    """Power bought from the grid at t; 0 if the model was built without a grid connection"""
+    return model.eta_in[t] if hasattr(model, 'eta_in') else 0
+
+def _grid_out(model, t):
+    """Power sold to the grid at t; 0 if the model was built without a grid connection"""
+    return model.eta_out[t] if hasattr(model, 'eta_out') else 0
+
+def _grid_connection(model):
+    """Whether the plant pays for a grid connection; 0 if the model was built without one"""
+    return model.grid_active if hasattr(model, 'grid_active') else 0
+
+def _initial_state(model):
+    """Whether the model starts from a given state (a rolling horizon window) rather than wrapping round to its last timestep"""
+    return hasattr(model, 'initial_storage')
+
 def _PowerBalance(model, t):
     """Checks that the renewables are producing more energy than is consumed"""
     return sum(model.power_supply[Renewable, t] * model.C_power[Renewable] for Renewable in model.Renewables) + \
-           model.eta_in[t] - model.curtailed[t] == sum(model.pi[Component, t] for Component in model.Components)+model.eta_out[t]
+           _grid_in(model, t) - model.curtailed[t] == sum(model.pi[Component, t] for Component in model.Components)+_grid_out(model, t)
 
 def _CurtailedLimit(model, t):
     """Stops the model curtailing more energy than the current production of renewable energy"""
@@ -11,7 +29,9 @@ def _CurtailedLimit(model, t):
 
 def _HydrogenBalance(model, t):
     """Size hydrogen storage, ensuring there is always enough to meet ammonia demand"""
-    if t == 1:
+    if t == 1 and _initial_state(model):
+        old_storage = model.initial_storage['Hydrogen']
+    elif t == 1:
         old_storage = model.storage_volume[('Hydrogen', len(model.t))]
     else:
         old_storage = model.storage_volume[('Hydrogen', t-1)]
@@ -32,18 +52,23 @@ def _AmmoniaBalance(model):
 
 def _BatteryBalance(model, t):
     """Forces the model to increase the size of the battery when it is used for storage"""
-    if t == 1:
+    if t == 1 and _initial_state(model):
+        old_storage = model.initial_storage['Battery']
+    elif t == 1:
         old_storage = model.storage_volume[('Battery', len(model.t))]
     else:
         old_storage = model.storage_volume[('Battery', t - 1)]
 
-    return 0.999943 * old_storage + model.CF[('pi', 'beta')] * model.pi[('Battery', t)] - sum(
+    return BATTERY_RETENTION * old_storage + model.CF[('pi', 'beta')] * model.pi[('Battery', t)] - sum(
         model.beta[(Component, t)] for Component in model.Components) == model.storage_volume[
                ('Battery', t)]
 
 def _NH3_ramp_down(model,t):
     """Places a cap on how quickly the ammonia plant can ramp down"""
-    if t == 1:
+    if t == 1 and _initial_state(model):
+        old_weight = model.initial_weight
+        old_rate = model.initial_rate
+    elif t == 1:
         old_weight = model.t_weights[len(model.t)]
         old_rate = (model.pi[('HB+ASU', len(model.t))] + model.beta[('HB+ASU', len(model.t))] + \
                    model.gamma[('HB+ASU', len(model.t))])/old_weight
@@ -59,7 +84,10 @@ def _NH3_ramp_down(model,t):
 
 def _NH3_ramp_up(model, t):
     """Places a cap on how quickly the ammonia plant can ramp down"""
-    if t == 1:
+    if t == 1 and _initial_state(model):
+        old_weight = model.initial_weight
+        old_rate = model.initial_rate
+    elif t == 1:
         old_weight = model.t_weights[len(model.t)]
         old_rate = (model.pi[('HB+ASU', len(model.t))] + model.beta[('HB+ASU', len(model.t))] + \
                    model.gamma[('HB+ASU', len(model.t))])/old_weight
@@ -73,6 +101,20 @@ def _NH3_ramp_up(model, t):
     return (model.pi[('HB+ASU', t)] + model.beta[('HB+ASU', t)] + model.gamma[
         ('HB+ASU', t)])/model.t_weights[t] - old_rate <= model.C_components['HB+ASU'] * model.ramp_up * modifier
 
+def _FinalRate(model):
+    """Records the ammonia production rate at the end of a rolling horizon window, so it can be fixed"""
+    T = len(model.t)
+    return model.final_rate * model.t_weights[T] == model.pi[('HB+ASU', T)] + model.beta[('HB+ASU', T)] + \
+           model.gamma[('HB+ASU', T)]
+
+def _RollingProduction(model):
+    """Ammonia production of a rolling horizon window, plus the ammonia the storage left at its end could still make,
+    valued at storage_value; without it, each window would run its storage down with no regard for the next"""
+    T = len(model.t)
+    stored = model.storage_volume[('Hydrogen', T)] * model.CF[('H2', 'NH3')] + \
+             model.storage_volume[('Battery', T)] * model.CF[('pi', 'NH3')]
+    return _AmmoniaProduction(model) + model.G_annual_hours / 24 / model.total_days * model.storage_value * stored
+
 def _ComponentCap(model, Component, t):
     """Forces the component capacity to be greater than or equal to the power supply to that component"""
     return model.pi[(Component, t)] + model.beta[(Component, t)] + model.gamma[
@@ -126,10 +168,10 @@ def _LCOA(model):
     CAPEX = (sum(model.Cost_power[Renewable] * model.C_power[Renewable] for Renewable in model.Renewables) + \
             sum(model.Cost_components[Component] * model.C_components[Component] for Component in model.Components)) + \
             sum(model.Cost_storage[StorageComponent] * model.C_storage[StorageComponent] for StorageComponent in
-                model.StorageComponents) + (model.Cost_FC * model.C_FC) + (model.Cost_grid * model.grid_active)
+                model.StorageComponents) + (model.Cost_FC * model.C_FC) + (model.Cost_grid * _grid_connection(model))
 
-    OPEX = sum((model.eta_in[t] * model.grid_power_cost[t] - 
-                model.eta_out[t] * model.grid_power_cost_no_TUOS[t])/model.t_weights[t] for t in model.t) * model.G_annual_hours / 24 / model.total_days +\
+    OPEX = sum((_grid_in(model, t) * model.grid_power_cost[t] - 
+                _grid_out(model, t) * model.grid_power_cost_no_TUOS[t])/model.t_weights[t] for t in model.t) * model.G_annual_hours / 24 / model.total_days +\
            model.water_cost * model.water_consumption / model.CF[('H2', 'NH3')] * model.G_production +\
            model.O_and_M * CAPEX
 
@@ -140,7 +182,7 @@ def _AmmoniaProduction(model):
     ammonia_in = sum((model.pi[('HB+ASU', t)] + model.beta[('HB+ASU', t)] + model.gamma[
                 ('HB+ASU', t)]) for t in model.t) * model.CF[('pi', 'NH3')]
                 
-    ammonia_out = sum((model.eta_in[t] * model.grid_power_cost[t] - model.eta_out[(t)] * model.grid_power_cost_no_TUOS[t])*
+    ammonia_out = sum((_grid_in(model, t) * model.grid_power_cost[t] - _grid_out(model, t) * model.grid_power_cost_no_TUOS[t])*
                 1E6 for t in model.t)/model.G_production_LCOA
     
     return model.G_annual_hours / 24 / model.total_days * (ammonia_in-ammonia_out)
\ No newline at end of file
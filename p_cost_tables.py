@@ -0,0 +1,76 @@
+"""Registry of the equipment cost tables in Equipment Data/. Each table is read once per process with all of its
+sensitivity columns, checked, and kept in memory, so building an optimiser no longer reads any files. The tables are
+found next to this file rather than in the working directory. Optionally they are also kept in a pickle file on disk,
+which is used as long as none of the csv files have changed since it was written"""
+import os
+import pickle
+import functools
+import pandas as pd
+
+
+DATA_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Equipment Data')
+
+# Tables read by the optimisers, and the sensitivity columns every one of them must have
+TABLES = ('Finance', 'TUOS', 'Components', 'Storage Components', 'FC', 'Renewables')
+SENSITIVITIES = ('Base', 'Cheap', 'Expensive')
+
+# Pickle file the tables are also kept in, if any; set COST_TABLE_CACHE to use one without changing any code
+CACHE_FILE = os.environ.get('COST_TABLE_CACHE')
+
+
+def read_table(directory, element):
+    """Reads one csv file, indexed by its first column (Components), and checks it"""
+    file_name = os.path.join(directory, element + '.csv')
+    table = pd.read_csv(file_name, encoding = 'utf-8-sig')
+    table = table.set_index(table.columns[0])
+    missing = [sensitivity for sensitivity in SENSITIVITIES if sensitivity not in table.columns]
+    if missing:
+        raise ValueError("{a} has no {b} column(s)".format(a = file_name, b = missing))
+    if table.index.duplicated().any():
+        raise ValueError("{a} lists {b} more than once".format(a = file_name,
+                                                               b = list(table.index[table.index.duplicated()])))
+    values = table[list(SENSITIVITIES)].apply(pd.to_numeric, errors = 'coerce')
+    if values.isna().any().any() or (values < 0).any().any():
+        raise ValueError("{a} has missing, non-numeric or negative costs".format(a = file_name))
+    return values.astype(float)
+
+
+def _file_stamps(directory):
+    """Modification time and size of each table file, used to tell whether a disk cache is out of date"""
+    stamps = {}
+    for element in TABLES:
+        status = os.stat(os.path.join(directory, element + '.csv'))
+        stamps[element] = (status.st_mtime_ns, status.st_size)
+    return stamps
+
+
+@functools.lru_cache(maxsize = None)
+def cost_tables(directory = DATA_DIRECTORY, cache_file = None):
+    """Returns every table in TABLES as a DataFrame of its sensitivity columns, by name. Tables are read once per process
+    and directory; with cache_file, they are read from (or written to) that pickle file if the csv files are unchanged"""
+    directory = os.path.abspath(directory)
+    stamps = _file_stamps(directory)
+    if cache_file is not None and os.path.exists(cache_file):
+        try:
+            with open(cache_file, 'rb') as file:
+                cached = pickle.load(file)
+            if cached['directory'] == directory and cached['stamps'] == stamps:
+                return cached['tables']
+        except (OSError, pickle.UnpicklingError, EOFError, KeyError):
+            pass # An unreadable cache is just rebuilt
+    tables = {element: read_table(directory, element) for element in TABLES}
+    if cache_file is not None:
+        with open(cache_file, 'wb') as file:
+            pickle.dump({'directory': directory, 'stamps': stamps, 'tables': tables}, file)
+    return tables
+
+
+def cost_data(element, sensitivity, directory = DATA_DIRECTORY, cache_file = CACHE_FILE):
+    """Costs in one table for the nominated sensitivity, in the form the optimisers use: {None: value} for tables with a
+    single row, otherwise a dictionary by component. A new dictionary is returned each time, so it can be changed freely"""
+    if sensitivity not in SENSITIVITIES:
+        raise ValueError("Unknown sensitivity {a}; choose from {b}".format(a = sensitivity, b = list(SENSITIVITIES)))
+    column = cost_tables(directory, cache_file)[element][sensitivity]
+    if len(column) == 1:
+        return {None: float(column.iloc[0])}
+    return column.to_dict()
@@ -1,5 +1,10 @@
 """Creates a class in which the optimisation driver stores results"""
+import os
+import json
+import sqlite3
 import numpy as np
+import pandas as pd
+import netCDF4 as nc
 
 def is_leap(year):
     """Returns true if the input year is a leap year. Returns false otherwise"""
@@ -13,11 +18,35 @@ def is_leap(year):
     else:
         return False
 
+def location_key(latitude, longitude, years, scale = None, sensitivity = None):
+    """The key results are stored under: latitude_longitude_scale, or latitude_longitude_first year without a scale.
+    With a Sensitivity_dictionary, its Production, Storage and Finance sensitivities are added, e.g. _Base_Cheap_Base"""
+    if scale is None:
+        key = str(latitude) + '_' + str(longitude) + '_' + str(years[0])
+    else:
+        key = str(latitude) + '_' + str(longitude) + '_' + str(scale)
+    if sensitivity is not None:
+        key += ''.join('_' + sensitivity[name] for name in ('Production', 'Storage', 'Finance'))
+    return key
+
+# Results holding one value per timestep, which are kept out of the scalar results
+SERIES = ('Hydrogen Storage', 'Battery Storage', 'Ammonia Production', 'eta_in', 'eta_out')
+# The start time of each timestep, which the series file uses as its time coordinate
+SERIES_TIME = 'Timestep start'
+SERIES_TIME_UNITS = 'hours since 1970-01-01 00:00:00'
+
+def _pop_series(location_results):
+    """Removes the series (and their timestep start times) from a result, returning them in a dictionary and leaving
+    only the scalar results"""
+    return {name: location_results.pop(name) for name in SERIES + (SERIES_TIME,) if name in location_results}
+
 class Data_store:
     """Class designed to store data from each instance of the optimisation driver case"""
-    def __init__(self):
-        """Creates an empty dictionary in which data will be stored"""
+    def __init__(self, series_file = None):
+        """Creates an empty dictionary in which data will be stored. If series_file is given, the series of each location
+        are written to it (see Series_store); otherwise they are dropped"""
         self.collated_results = {}
+        self.series = None if series_file is None else Series_store(series_file)
         self.hydrogen_storage = {}
         self.battery_storage = {}
         self.grid_usage = {}
@@ -31,30 +60,40 @@ class Data_store:
         self.StorageComponents = model_class._storage_components
         self._storage_component_units = model_class._storage_component_units
     
-    def add_location(self, location_results, years, scale = None):
+    def add_location(self, location_results, years, scale = None, sensitivity = None):
         """Adds a location to the collated results"""
-        if scale is None:
-            self.key = str(location_results['Latitude']) + '_' + str(location_results['Longitude']) \
-                    + '_' + str(years[0])
-        else:
-            self.key = str(location_results['Latitude']) + '_' + str(location_results['Longitude']) \
-                    + '_' + str(scale)
-        if location_results['Converged']:
-            #self.hydrogen_storage[self.key] = location_results.pop('Hydrogen Storage')
-            location_results.pop('Hydrogen Storage')
-            #self.battery_storage[self.key] = location_results.pop('Battery Storage')
-            location_results.pop('Battery Storage')
-            #self.grid_usage[self.key] = location_results.pop('eta_in')
-            #location_results.pop('eta_in')
-            #location_results.pop('eta_out')
-
-            ammonia_production = location_results.pop('Ammonia Production')
-            
-        self.collated_results[self.key] = location_results  
-            
-    def add_operating_year(self, production, operating_year):
-        """Adds the operating year to the dictionary - used for most recent case only"""
-        self.collated_results[self.key][operating_year] = production
+        self.key = location_key(location_results['Latitude'], location_results['Longitude'], years, scale, sensitivity)
+        self.add_series(location_results)
+        self.collated_results[self.key] = location_results
+
+    def add_series(self, location_results):
+        """Moves the series out of location_results and into the series file, if there is one"""
+        series = _pop_series(location_results)
+        if self.series is not None and series:
+            self.series.add_location(self.key, location_results['Latitude'], location_results['Longitude'], series)
+
+    def __contains__(self, key):
+        return key in self.collated_results
+
+    def to_frame(self, keys = None):
+        """Returns the results (only those under keys, if given) as a DataFrame with one row per key"""
+        results = self.collated_results
+        if keys is not None:
+            results = {key: results[key] for key in keys if key in results}
+        return pd.DataFrame.from_dict(results, orient="index")
+
+    def to_csv(self, output_file_name, keys = None):
+        """Writes the results (only those under keys, if given) to a csv file"""
+        self.to_frame(keys).to_csv(output_file_name)
+
+    def close(self):
+        """Closes the series file, if there is one"""
+        if self.series is not None:
+            self.series.close()
+
+    def add_operating_year(self, production, operating_year, key = None):
+        """Adds the operating year to the dictionary - for the most recent case, unless the key of another is given"""
+        self.collated_results[self.key if key is None else key][operating_year] = production
         
     def print_results(self, location_name):
         """Prints results from model"""
@@ -73,4 +112,116 @@ class Data_store:
         for StorageComponent in self.StorageComponents:
             print('The ' + str(StorageComponent) + ' storage capacity is ' + str(dict_[str(StorageComponent) + ' storage']) + ' ' + self._storage_component_units[StorageComponent]) 
         print(str(dict_['Curtailed']) + ' % of electricity was curtailed')
-    
\ No newline at end of file
+    
+
+
+class Result_store(Data_store):
+    """Stores results in an SQLite file as each location is added, rather than in memory, so that a sweep that stops
+    part way loses nothing and can be resumed. Rows are only ever appended: one per location, keyed as in add_location,
+    and one per operating year added"""
+    def __init__(self, file_name, resume = False, series_file = None):
+        """Opens (resume = True) or replaces the store in file_name; series_file is treated the same way"""
+        if not resume and os.path.exists(file_name):
+            os.remove(file_name)
+        self.file_name = file_name
+        self.series = None if series_file is None else Series_store(series_file, resume = resume)
+        self.renewables = None
+        self.key = None
+        self.connection = sqlite3.connect(file_name)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS locations (key TEXT PRIMARY KEY, results TEXT)')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS operating_years (key TEXT, operating_year TEXT, production TEXT)')
+        self.connection.commit()
+
+    def __contains__(self, key):
+        return self.connection.execute('SELECT 1 FROM locations WHERE key = ?', (key,)).fetchone() is not None
+
+    def keys(self):
+        """Keys of every location stored"""
+        return [row[0] for row in self.connection.execute('SELECT key FROM locations ORDER BY rowid')]
+
+    def add_location(self, location_results, years, scale = None, sensitivity = None):
+        """Writes a location to the file straight away; a key that is already stored keeps its first results"""
+        self.key = location_key(location_results['Latitude'], location_results['Longitude'], years, scale, sensitivity)
+        self.add_series(location_results)
+        results = json.dumps(location_results, default = _to_json)
+        self.connection.execute('INSERT OR IGNORE INTO locations VALUES (?, ?)', (self.key, results))
+        self.connection.commit()
+
+    def add_operating_year(self, production, operating_year, key = None):
+        """Adds the operating year to the most recently added location, unless the key of another is given"""
+        self.connection.execute('INSERT INTO operating_years VALUES (?, ?, ?)',
+                                (self.key if key is None else key, str(operating_year),
+                                 json.dumps(production, default = _to_json)))
+        self.connection.commit()
+
+    @property
+    def collated_results(self):
+        """All stored results, read back from the file as a dictionary by key"""
+        collated_results = {key: json.loads(results)
+                            for key, results in self.connection.execute('SELECT key, results FROM locations ORDER BY rowid')}
+        for key, operating_year, production in self.connection.execute('SELECT * FROM operating_years ORDER BY rowid'):
+            if key in collated_results:
+                collated_results[key][operating_year] = json.loads(production)
+        return collated_results
+
+    def close(self):
+        """Closes the store and the series file"""
+        self.connection.close()
+        super().close()
+
+
+class Series_store:
+    """Writes the series of each location (see SERIES) as float32 rows of a compressed NetCDF file, one site per
+    location along an unlimited site dimension, with the key, latitude and longitude of each site alongside. Each site
+    also has the start time of each of its timesteps, since aggregation makes these differ between sites; the series
+    name all of these as their coordinates, so the file can be read without the results. Sites with fewer timesteps
+    than others are padded with NaN. If a resumed sweep solves a location again, its key appears twice; the last row is
+    the one to use"""
+    def __init__(self, file_name, resume = False):
+        """Opens (resume = True) or replaces the file"""
+        self.file_name = file_name
+        if resume and os.path.exists(file_name):
+            self.dataset = nc.Dataset(file_name, 'a')
+            return
+        self.dataset = nc.Dataset(file_name, 'w')
+        self.dataset.createDimension('site', None)
+        self.dataset.createDimension('timestep', None)
+        self.dataset.createVariable('key', str, ('site',))
+        self.dataset.createVariable('latitude', 'f8', ('site',)).units = 'degrees_north'
+        self.dataset.createVariable('longitude', 'f8', ('site',)).units = 'degrees_east'
+        time = self.dataset.createVariable('time', 'f8', ('site', 'timestep'), zlib = True, complevel = 4,
+                                           fill_value = np.nan)
+        time.units = SERIES_TIME_UNITS
+        time.long_name = 'Start of the timestep'
+        for name in SERIES:
+            variable = self.dataset.createVariable(name.replace(' ', '_'), 'f4', ('site', 'timestep'), zlib = True,
+                                                   complevel = 4, fill_value = np.float32(np.nan))
+            variable.long_name = name
+            variable.coordinates = 'key latitude longitude time'
+
+    def add_location(self, key, latitude, longitude, series):
+        """Appends one site; series maps names in SERIES to 1D arrays, and SERIES_TIME to their start times"""
+        site = len(self.dataset.dimensions['site'])
+        self.dataset['key'][site] = key
+        self.dataset['latitude'][site] = latitude
+        self.dataset['longitude'][site] = longitude
+        series = dict(series)
+        times = series.pop(SERIES_TIME, None)
+        if times is not None and 'time' in self.dataset.variables: #files written before the time coordinate have none
+            times = nc.date2num(pd.to_datetime(times).to_pydatetime(), SERIES_TIME_UNITS)
+            self.dataset['time'][site, :len(times)] = times
+        for name, values in series.items():
+            values = np.asarray(values, dtype = np.float32)
+            self.dataset[name.replace(' ', '_')][site, :len(values)] = values
+        self.dataset.sync()
+
+    def close(self):
+        self.dataset.close()
+
+
+def _to_json(value):
+    """Converts the numpy values found in results into types json can store"""
+    if hasattr(value, 'tolist'):
+        return value.tolist()
+    return str(value)
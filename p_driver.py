@@ -1,6 +1,11 @@
+import time
 import numpy as np
 import p_location_class as location_class
 import p_data_store as d_store
+import p_shared_profiles as shared_profiles
+import p_memory as memory
+import p_rolling_horizon as rolling_horizon
+import p_result_cache as result_cache
 from multiprocessing import current_process
 import pandas as pd
 
@@ -11,42 +16,135 @@ def calculate(func, args):
 def calculatestar(args):
     return calculate(*args)
 
-def driver(weather_data, design_class, design_years, aggregation_variable, aggregation_mode, operating_class = None):
-    """N Salmon 25/05/2021: Solves design problem and uses it as input to operating problem"""
+# Design instances (and their persistent solvers) kept by each worker process, by optimiser.instance_key(), so later
+# locations in the same process can reuse them - see driver(reuse_instance = True)
+_design_instances = {}
+
+def get_design_instance(design_class, reuse_instance = False):
+    """Returns an instance for the location currently loaded in design_class. With reuse_instance, an instance built
+    earlier in this process for the same instance_key is updated in place and solved with the same persistent solver,
+    so a sweep over many locations only pays the model build cost once per process"""
+    if not reuse_instance or design_class.backend != 'pyomo':
+        design_class.create_data()
+        return design_class.create_instance()
+    key = design_class.instance_key()
+    if key in _design_instances:
+        instance, opt = _design_instances[key]
+        design_class.reuse_persistent_solver(opt)
+        design_class.update_instance(instance)
+    else:
+        design_class.create_data()
+        instance = design_class.create_instance()
+        design_class.use_persistent_solver()
+        _design_instances[key] = (instance, design_class.opt)
+    return instance
+
+# Operating instances kept by each worker process, by optimiser.instance_key(), in the same way
+_operating_instances = {}
+
+def get_operating_instance(operating_class, equipment_capacities, reuse_instance = False):
+    """Returns an operating instance for the location currently loaded in operating_class, with the plant fixed at
+    equipment_capacities (see location_optimise_design.get_capacities). With reuse_instance, an instance built earlier in
+    this process for the same instance_key has its profile and capacities swapped in place and keeps its persistent
+    solver, so each further operating year only costs a re-solve"""
+    if not reuse_instance:
+        operating_class.create_data(equipment_capacities)
+        return operating_class.create_instance()
+    key = operating_class.instance_key()
+    if key in _operating_instances:
+        instance, opt = _operating_instances[key]
+        operating_class.reuse_persistent_solver(opt)
+        operating_class.update_instance(instance)
+        operating_class.update_capacities(instance, equipment_capacities)
+    else:
+        operating_class.create_data(equipment_capacities)
+        instance = operating_class.create_instance()
+        operating_class.use_persistent_solver()
+        _operating_instances[key] = (instance, operating_class.opt)
+    return instance
+
+def operate(weather_data, operating_class, equipment_capacities, operating_year, aggregation_variable, aggregation_mode, reuse_instance = False):
+    """Operates a designed plant (equipment_capacities) on the profile of one operating_year at a location, and returns
+    its annual production along with the location and year. Takes the same weather_data as driver. A
+    p_rolling_horizon.location_optimise_rolling operating_class operates the year in windows"""
+    if isinstance(weather_data, shared_profiles.profile_cell):
+        weather_data = weather_data.arrays()
+    location = location_class.renewable_data(weather_data, operating_class._renewables, years_of_interest = [operating_year], aggregation_variable = aggregation_variable, aggregation_mode = aggregation_mode)
+    operating_class.specific_model_features(location, False)
+    if isinstance(operating_class, rolling_horizon.location_optimise_rolling):
+        operating_results = operating_class.operate(equipment_capacities) #Windows keep their own instances
+    else:
+        operating_instance = get_operating_instance(operating_class, equipment_capacities, reuse_instance)
+        operating_class.solve_model(operating_instance)
+        operating_results = operating_class.store_results(operating_instance)
+    return {'Latitude': location.latitude, 'Longitude': location.longitude, 'Operating year': operating_year,
+            'Annual Production': operating_results['Annual Production'] if operating_class.converged else 'Non-converged',
+            'Peak memory': round(memory.peak_memory(), 1)}
+
+def driver(weather_data, design_class, design_years, aggregation_variable, aggregation_mode, operating_class = None, reuse_instance = False, operating_years = None, warm_start = False, start = None, cache_directory = None):
+    """N Salmon 25/05/2021: Solves design problem and uses it as input to operating problem.
+    reuse_instance = True keeps the design instance and a persistent solver between locations (see get_design_instance)
+    With warm_start, the design is started from start (the 'Warm start' of the result of a neighbouring location, if
+    there is one - see p_solution_cache.py), and this solution is returned under 'Warm start' in turn. Either way the
+    solver iterations and solve time are reported, along with whether the solve was warm started
+    With an operating_class, the designed plant is operated over each of operating_years here, one after another, and
+    the production of each is stored as 'Production in year'. Without operating_years, the capacities are returned
+    under 'Equipment capacities' instead, for the caller to operate the years in parallel (see p_sweep.sweep)
+    Converged results are kept in cache_directory (p_result_cache.CACHE_DIRECTORY if not given; None keeps nothing), and
+    a run whose profile, costs and settings match a kept result returns that instead, marked as 'Memoized'"""
 
     # Import the weather data for the given location:
+    if isinstance(weather_data, shared_profiles.profile_cell):
+        weather_data = weather_data.arrays() #Zero-copy views of the cell in the shared profile files
     location = location_class.renewable_data(weather_data, design_class._renewables, years_of_interest = design_years, aggregation_variable = aggregation_variable, aggregation_mode = aggregation_mode)
     
+    # Return the result of an identical earlier run if there is one
+    if cache_directory is None:
+        cache_directory = result_cache.CACHE_DIRECTORY
+    if cache_directory is not None:
+        cache_key = result_cache.run_key(location, design_class, design_years, aggregation_variable, aggregation_mode, operating_class, operating_years)
+        results = result_cache.load(cache_directory, cache_key)
+        if results is not None:
+            results['Memoized'] = True
+            results['Peak memory'] = round(memory.peak_memory(), 1)
+            return results
+
     # Import the data and set up the optimisation:
     design_class.specific_model_features(location, False)
-    design_class.create_data()
-    design_instance = design_class.create_instance()            
+    design_instance = get_design_instance(design_class, reuse_instance)
                
     # Solve the design optimisation
+    solve_start = time.time() #Includes loading the start, which can mean sending the instance to the solver early
+    warm_started = start is not None and design_class.backend == 'pyomo' and design_class.warm_start(design_instance, start)
     design_class.solve_model(design_instance)
+    solve_time = time.time() - solve_start
     
     if design_class.converged:
     # Store the results
         results = design_class.store_results(design_instance)
         design_class.print_results(design_instance)
         
-        ## Uncomment the below if you're nterested in operating the designed plant:
-        # operating_years = [[design_years[0] - i] for i in range(1,4)]
-        # for operating_year in operating_years:
-            # location.set_years(years_of_interest = operating_year, aggregation_mode = aggregation_mode)
-            # operating_class.specific_model_features(location, grid_sale)
-            # equipment_capacities = design_class.get_capacities(design_instance)    
-            # operating_class.create_data(equipment_capacities)
-            # operating_instance = operating_class.create_instance()
-            # operating_class.solve_model(operating_instance)
-            
-            # if operating_class.converged:
-                # operating_results = operating_class.store_results(operating_instance)
-                # operating_class.print_results(operating_instance)
-                # results['Production in {year}'.format(year = operating_year)] = operating_results['Annual Production']
-            # else:
-                # results['Production in {year}'.format(year = operating_year)] = 'Non-converged'
+        if operating_class is not None:
+            equipment_capacities = design_class.get_capacities(design_instance)
+            if operating_years is None:
+                results['Equipment capacities'] = equipment_capacities
+            for operating_year in operating_years or []:
+                operating_results = operate(weather_data, operating_class, equipment_capacities, operating_year, aggregation_variable, aggregation_mode, reuse_instance)
+                results['Production in {year}'.format(year = operating_year)] = operating_results['Annual Production']
     
+        if warm_start:
+            results['Warm start'] = design_class.warm_start_data(design_instance)
+
+        if cache_directory is not None:
+            result_cache.store(cache_directory, cache_key, results)
+
     else:
         results = design_class.store_non_converged_results()
+    if design_class.backend == 'pyomo':
+        results['Warm started'] = warm_started
+        results['Solver iterations'] = design_class.iterations
+        results['Solve time'] = round(solve_time, 2)
+    elif design_class.iterations is not None:
+        results['Solver iterations'] = design_class.iterations
+    results['Peak memory'] = round(memory.peak_memory(), 1) #MB, used by p_memory.task_throttle to size the pool
     return results
\ No newline at end of file
@@ -6,13 +6,39 @@ import pvlib
 import netCDF4 as nc
 import matplotlib.pyplot as plt
 import glob
+import threading
+
+# Chunk sizes used when streaming a grid through get_renewables.get_grid_profiles; each chunk is roughly 14MB per variable
+DEFAULT_CHUNKS = {'time': 24 * 366, 'latitude': 20, 'longitude': 20}
+# ERA5 variables needed by each profile type
+WIND_VARIABLES = ('u100', 'v100', 'u10', 'v10')
+SOLAR_VARIABLES = ('ssrd', 't2m', 'u10', 'v10')
+# Number of time series whose solar time terms are kept (see get_solar_zenith); the oldest is dropped first
+SOLAR_TIME_CACHE_SIZE = 8
+# Guards the solar time term caches, which dask worker threads share; module level so get_renewables still pickles
+_solar_time_lock = threading.Lock()
+
+
+def coordinate_slice(coordinate, bounds):
+    """Returns a slice selecting the inclusive range bounds = (min, max) from a coordinate, which may be ascending or
+    descending (ERA5 latitudes are descending). Returns slice(None) if bounds is None"""
+    if bounds is None:
+        return slice(None)
+    low, high = min(bounds), max(bounds)
+    if len(coordinate) > 1 and coordinate[0] > coordinate[-1]:
+        return slice(high, low)
+    return slice(low, high)
 
 
 class all_locations:
     # List of files and relevant information
-    def __init__(self, path):
-        self.variables = { '100m_u_component_of_wind': 'u100',
-                          '100m_v_component_of_wind': 'v100', 'surface_solar_radiation_downwards': 'ssrd'} #'2m_temperature': 't2m', ,
+    def __init__(self, path, variables = WIND_VARIABLES, latitudes = None, longitudes = None, chunks = None):
+        """Opens the weather files lazily as a single dataset. Only the listed variables and the cells inside the
+        latitudes/longitudes bounding box ((min, max) tuples) are kept, and both filters are applied per file before
+        anything is read, so memory use is set by the chunk size rather than the size of the archive"""
+        self.variables = { '100m_u_component_of_wind': 'u100', '100m_v_component_of_wind': 'v100',
+                          '10m_u_component_of_wind': 'u10', '10m_v_component_of_wind': 'v10',
+                          'surface_solar_radiation_downwards': 'ssrd', '2m_temperature': 't2m'}
                           #'model_bathymetry': 'wmb'
         self.path = path
         if path is None:
@@ -22,23 +48,57 @@ class all_locations:
             self.file_list = glob.glob(path + r'/Model_for_Luke-main/*')
         #self.file_list = ['Test.nc']#Needs changing to required file
         print(self.file_list)
-        for count, file in enumerate(self.file_list):
-            if count == 0:
-                self.ds = xr.open_dataset(file)
-            elif file[-9:] == 'ential.nc':
-                self.altitude = xr.open_dataset(file)
-            else:
-                self.ds = xr.merge([self.ds, xr.open_dataset(file)])
+        weather_files = [file for file in sorted(self.file_list) if file[-9:] != 'ential.nc']
+        altitude_files = [file for file in self.file_list if file[-9:] == 'ential.nc']
+
+        def preprocess(ds):
+            """Drops unwanted variables and cells from each file as it is opened"""
+            ds = ds[[variable for variable in variables if variable in ds.data_vars]]
+            return ds.sel(latitude = coordinate_slice(ds.latitude, latitudes),
+                          longitude = coordinate_slice(ds.longitude, longitudes))
+
+        # Files may be split by variable and/or by time; combining by coordinates handles both without repeated merges
+        self.ds = xr.open_mfdataset(weather_files, preprocess = preprocess, combine = 'by_coords',
+                                    chunks = DEFAULT_CHUNKS if chunks is None else chunks,
+                                    data_vars = 'minimal', coords = 'minimal', compat = 'override')
+        if altitude_files:
+            altitude = xr.open_dataset(altitude_files[0], chunks = {})
+            self.altitude = altitude.sel(latitude = coordinate_slice(altitude.latitude, latitudes),
+                                         longitude = coordinate_slice(altitude.longitude, longitudes))
+
+
+class turbine_spec:
+    """Power curve for a wind turbine. The defaults describe a Vestas 3.0MW with a rotor diameter of 90m, with wind
+    speeds measured at 100m extrapolated to the hub height using a log law with the given surface roughness"""
+    def __init__(self, hub_height = 120, measured_height = 100, roughness = 0.03, rated = 3000, cut_in = 3, cut_out = 25,
+                 cubic_limit = 7.5, rated_speed = 11.5, cubic_coefficients = (2.785299, 3.161124),
+                 quadratic_coefficients = (-103.447526, 2319.060494, -10004.69559)):
+        """Rated power in kW; speeds in m/s. Below cubic_limit the output is cubic_coefficients[0]*speed**cubic_coefficients[1],
+        up to rated_speed it is the quadratic in quadratic_coefficients (highest power first), and above that it is rated"""
+        self.hub_height = hub_height
+        self.measured_height = measured_height
+        self.roughness = roughness
+        self.rated = rated
+        self.cut_in = cut_in
+        self.cut_out = cut_out
+        self.cubic_limit = cubic_limit
+        self.rated_speed = rated_speed
+        self.cubic_coefficients = cubic_coefficients
+        self.quadratic_coefficients = quadratic_coefficients
+
+    def shear_factor(self):
+        """Ratio of the hub height wind speed to the measured wind speed"""
+        return np.log(self.hub_height / self.roughness) / np.log(self.measured_height / self.roughness)
 
 
 class get_renewables:
-    def __init__(self, data):
-        """Sets up the solar model"""
-        __temperature_model_parameters = pvlib.temperature.TEMPERATURE_MODEL_PARAMETERS['sapm']['open_rack_glass_glass']
-        self.__pvwatts_system = pvlib.pvsystem.PVSystem(module_parameters={'pdc0': 240, 'gamma_pdc': -0.004},
-                                                        inverter_parameters={'pdc0': 240},
-                                                        temperature_model_parameters=__temperature_model_parameters)
+    def __init__(self, data, turbine = None):
+        """Sets up the solar and wind models"""
+        self.temperature_model_parameters = pvlib.temperature.TEMPERATURE_MODEL_PARAMETERS['sapm']['open_rack_glass_glass']
+        self.module_parameters = {'pdc0': 240, 'gamma_pdc': -0.004}
+        self._solar_time_terms = {}
 
+        self.turbine = turbine_spec() if turbine is None else turbine
         self.data = data.ds
         #self.altitudes = data.altitude
         self.hourly_data = pd.to_datetime(self.data.time.values)
@@ -51,90 +111,125 @@ class get_renewables:
         #altitude = self.altitudes.z.loc[:, self.latitude, self.longitude].values[0] / 9.80665
         v100 = ds.v100.loc[:, self.latitude, self.longitude].values
         u100 = ds.u100.loc[:, self.latitude, self.longitude].values
-        #t2m = ds.t2m.loc[:, self.latitude, self.longitude].values
-        #ssrd = ds.ssrd.loc[:, self.latitude, self.longitude].values
         v10 = ds.v10.loc[:, self.latitude, self.longitude].values
         u10 = ds.u10.loc[:, self.latitude, self.longitude].values
-        s10 = [(u ** 2 + v ** 2) ** 0.5 for u, v in zip(u10, v10)]
-        v1 = np.array([s * np.log(1 / 0.03) / np.log(10 / 0.03) for s in s10])
-
-        return [self.get_wind_power(v100, u100)] #self.get_solar_power(ssrd, t2m, v1, altitude),
-
-    def get_wind_power(self, u100, v100):
-        """Given u100 and v100 estimates wind power for a Vestas 3.0MW with a rotor diameter of 90m and a nacelle height of 80m
-        Vestas is the most common wind turbine type on Australian wind farms"""
-        measured_height = 100
-        hub_height = 120
-        rated = 3000  # installed capacity in kW
-        cut_in = 3
-        cut_out = 25
-        power = []
-        for u, v in zip(u100, v100):
-            speed_measured = (u ** 2 + v ** 2) ** 0.5
-            speed_hub = speed_measured * np.log(hub_height / 0.03) / np.log(measured_height / 0.03)
-            if speed_hub < cut_in or speed_hub > cut_out:
-                power.append(0)
-            elif speed_hub < 7.5:
-                power.append(2.785299 * speed_hub ** 3.161124 / rated)
-            elif speed_hub < 11.5:
-                power.append((-103.447526 * speed_hub ** 2 + 2319.060494 * speed_hub - 10004.69559) / rated)
-            else:
-                power.append(1)
-        return np.array(power)
-
-    def get_solar_power(self, ssrd, t2m, v1, altitude):
-        """Uses PV_Lib to estimate solar power based on provided weather data"""
-        """Note t2m to the function in Kelvin - function converts to degrees C!"""
-        # Manipulate input data
-        times = self.hourly_data.tz_localize('ETC/GMT')
-        ssrd = pd.DataFrame(ssrd / 3600, index=times, columns=['ghi'])
-        #t2m = pd.DataFrame(t2m - 273.15, index=times, columns=['temp_air'])
-        v1 = pd.DataFrame(v1, index=times, columns=['wind_speed'])
-
-        # Set up solar farm design
-        mc_location = pvlib.location.Location(latitude=self.latitude, longitude=self.longitude, altitude=altitude,
-                                              name='NA')
-        solpos = pvlib.solarposition.pyephem(times, latitude=self.latitude, longitude=self.longitude, altitude=altitude,
-                                             pressure=101325, temperature=t2m.mean(), horizon='+0:00')
-        mc = pvlib.modelchain.ModelChain(self.__pvwatts_system, mc_location, aoi_model='physical',
-                                         spectral_model='no_loss')
-
-        # Get the diffuse normal irradiance (dni) and diffuse horizontal irradiance (dhi) from the data; hence create a weather dataframe
-        df_res = pd.concat([ssrd, t2m, v1, solpos['zenith']], axis=1)
-        df_res['dni'] = pd.Series([pvlib.irradiance.disc(ghi, zen, i)['dni'] for ghi, zen, i in
-                                   zip(df_res['ghi'], df_res['zenith'], df_res.index)], index=times).astype(float)
-        df_res['dhi'] = df_res['ghi'] - df_res['dni'] * np.cos(np.radians(df_res['zenith']))
-        weather = df_res.drop('zenith', axis=1)
-        dc_power = mc.run_model(weather).dc / 240
-        return np.array(dc_power)
-
-
-data = all_locations(None)
-get_renewables_class = get_renewables(data)
-#Adjust for long/latitude for the data
-lon_range = np.arange(3.5,4.5)
-lat_range = np.arange(53.5,54.5)
-
-#Solar = np.zeros((len(get_renewables_class.hourly_data), len(lat_range), len(lon_range)))
-Wind = np.zeros((len(get_renewables_class.hourly_data), len(lat_range), len(lon_range)))
-
-for count_lat, lat in enumerate(lat_range):
-    #print(lat)
-    for count_lon, lon in enumerate(lon_range):
-        #print(lon)
-        location_data = get_renewables_class.get_data(lat, lon)
-        #Solar[:, count_lat, count_lon] = location_data[0]
-        Wind[:, count_lat, count_lon] = location_data[0] #[1]
-
-#ds = xr.Dataset(data_vars={'Solar': (['time', 'latitude', 'longitude'], Solar)}, coords=dict(
-    #latitude=(['latitude'], lat_range.tolist()), longitude=(['longitude'], lon_range.tolist()),
-    #time=(['time'], get_renewables_class.hourly_data)), )
-
-#ds.to_netcdf('Solar2.nc', mode='w')
-
-ds2 = xr.Dataset(data_vars={'Wind': (['time', 'latitude', 'longitude'], Wind)}, coords=dict(
-    latitude=(['latitude'], lat_range.tolist()), longitude=(['longitude'], lon_range.tolist()),
-    time=(['time'], get_renewables_class.hourly_data)), )
-
-ds2.to_netcdf('WindWales.nc', mode='w')
-print(ds2)
+        s10 = np.hypot(u10, v10)
+        v1 = s10 * np.log(1 / 0.03) / np.log(10 / 0.03)
+        if 'ssrd' in ds:
+            t2m = ds.t2m.loc[:, self.latitude, self.longitude].values
+            ssrd = ds.ssrd.loc[:, self.latitude, self.longitude].values
+            solar = self.get_solar_power(ssrd, t2m, v1, self.latitude, self.longitude)
+        else:
+            solar = np.zeros(len(v100), dtype = np.float32)
+
+        return [solar, self.get_wind_power(v100, u100)]
+
+    def get_grid_profiles(self, latitudes = None, longitudes = None, chunks = None, solar = False):
+        """Computes the wind (and optionally solar) profile of every cell inside the bounding box in one pass over the dataset.
+        latitudes and longitudes are (min, max) tuples (None keeps the whole axis); chunks is a dask chunk dictionary.
+        The result is lazy, so nothing is read until it is written out with write_profiles"""
+        ds = self.data.sel(latitude = coordinate_slice(self.data.latitude, latitudes),
+                           longitude = coordinate_slice(self.data.longitude, longitudes))
+        ds = ds.transpose('time', 'latitude', 'longitude').chunk(DEFAULT_CHUNKS if chunks is None else chunks)
+        profiles = xr.Dataset()
+        if solar:
+            template = xr.zeros_like(ds.ssrd, dtype = np.float32).rename('Solar')
+            profiles['Solar'] = xr.map_blocks(self._solar_block, ds[list(SOLAR_VARIABLES)], template = template)
+        profiles['Wind'] = xr.apply_ufunc(self.get_wind_power, ds.u100, ds.v100, dask = 'parallelized',
+                                          output_dtypes = [np.float32])
+        return profiles
+
+    def _solar_block(self, block):
+        """Solar profile for one dask block of the grid, using the block's own time, latitude and longitude coordinates"""
+        v1 = np.hypot(block.u10.values, block.v10.values) * np.log(1 / 0.03) / np.log(10 / 0.03)
+        power = self.get_solar_power(block.ssrd.values, block.t2m.values, v1, block.latitude.values,
+                                     block.longitude.values, times = block.time.values)
+        return xr.DataArray(power, coords = block.ssrd.coords, dims = block.ssrd.dims, name = 'Solar')
+
+    def write_profiles(self, profiles, output_file_name):
+        """Streams the profiles to disk chunk by chunk; a name ending in .zarr is written as Zarr, anything else as NetCDF"""
+        if output_file_name.endswith('.zarr'):
+            profiles.to_zarr(output_file_name, mode = 'w')
+        else:
+            encoding = {variable: {'zlib': True, 'complevel': 4} for variable in profiles.data_vars}
+            profiles.to_netcdf(output_file_name, mode = 'w', encoding = encoding)
+
+    def get_wind_power(self, u100, v100, turbine = None):
+        """Given u100 and v100 estimates the wind capacity factor using the power curve in turbine (defaults to self.turbine).
+        Works on whole arrays at once, so u100 and v100 can be (time, latitude, longitude) cubes; returns a float32 array of the same shape"""
+        if turbine is None:
+            turbine = self.turbine
+        speed_hub = np.hypot(np.asarray(u100, dtype=np.float64), np.asarray(v100, dtype=np.float64)) * turbine.shear_factor()
+        cubic_scale, cubic_power = turbine.cubic_coefficients
+        a, b, c = turbine.quadratic_coefficients
+        # Piecewise power curve; NaN speeds fall through to rated output, as they did in the original hourly loop
+        conditions = [(speed_hub < turbine.cut_in) | (speed_hub > turbine.cut_out),
+                      speed_hub < turbine.cubic_limit,
+                      speed_hub < turbine.rated_speed]
+        choices = [0,
+                   cubic_scale * speed_hub ** cubic_power / turbine.rated,
+                   (a * speed_hub ** 2 + b * speed_hub + c) / turbine.rated]
+        return np.select(conditions, choices, default = 1).astype(np.float32)
+
+    def get_solar_zenith(self, latitudes, longitudes, times = None):
+        """Returns the solar zenith in degrees as a (time, latitude, longitude) array. The declination and equation of time
+        depend only on time, and the hour angle only on longitude, so each is computed once and shared by every cell in
+        the same time series or longitude band. The time terms of the last SOLAR_TIME_CACHE_SIZE series (told apart by
+        their start, step and length) are kept"""
+        times = self.hourly_data if times is None else pd.DatetimeIndex(times)
+        step = times[1] - times[0] if len(times) > 1 else times.freq
+        key = (times[0], step, len(times))
+        with _solar_time_lock:
+            if key not in self._solar_time_terms:
+                if len(self._solar_time_terms) >= SOLAR_TIME_CACHE_SIZE:
+                    del self._solar_time_terms[next(iter(self._solar_time_terms))]
+                day_of_year = times.dayofyear.to_numpy()
+                hours = ((times - times.normalize()) / pd.Timedelta(hours = 1)).to_numpy()
+                self._solar_time_terms[key] = (pvlib.solarposition.declination_spencer71(day_of_year),
+                                               pvlib.solarposition.equation_of_time_spencer71(day_of_year), hours)
+            declination, equation_of_time, hours = self._solar_time_terms[key]
+        # Times are UTC, so the hour angle is as in pvlib.solarposition.hour_angle with no timezone offset
+        hour_angle = np.radians(15 * (hours[:, None] - 12) + np.atleast_1d(longitudes)[None, :] + equation_of_time[:, None] / 4)
+        zenith = pvlib.solarposition.solar_zenith_analytical(np.radians(np.atleast_1d(latitudes))[None, :, None],
+                                                             hour_angle[:, None, :], declination[:, None, None])
+        return np.degrees(zenith)
+
+    def get_solar_power(self, ssrd, t2m, v1, latitudes, longitudes, times = None):
+        """Uses PV_Lib to estimate the solar capacity factor for horizontal panels based on provided weather data.
+        ssrd, t2m and v1 are either (time,) series for a single cell or (time, latitude, longitude) cubes matching the
+        latitudes and longitudes given; everything is evaluated as whole-array operations, including the DISC decomposition.
+        Note t2m to the function in Kelvin - function converts to degrees C!"""
+        times = self.hourly_data if times is None else pd.DatetimeIndex(times)
+        ghi = np.asarray(ssrd, dtype = np.float64) / 3600
+        zenith = self.get_solar_zenith(latitudes, longitudes, times)
+        if ghi.ndim == 1:
+            zenith = zenith[:, 0, 0]
+        day_of_year = times.dayofyear.to_numpy().reshape((-1,) + (1,) * (ghi.ndim - 1))
+
+        # Get the direct normal irradiance (dni) and diffuse horizontal irradiance (dhi) from the data
+        dni = pvlib.irradiance.disc(ghi, zenith, day_of_year)['dni']
+        cos_zenith = np.cos(np.radians(zenith))
+        dhi = ghi - dni * cos_zenith
+
+        # Panels are horizontal, so the angle of incidence is the zenith and all of the sky diffuse reaches the panel
+        poa_direct = np.maximum(dni * cos_zenith, 0)
+        iam = np.where(zenith < 90, pvlib.iam.physical(np.minimum(zenith, 90)), 0)
+        effective_irradiance = poa_direct * iam + dhi
+        temp_cell = pvlib.temperature.sapm_cell(poa_direct + dhi, np.asarray(t2m) - 273.15, v1,
+                                                **self.temperature_model_parameters)
+        dc_power = pvlib.pvsystem.pvwatts_dc(effective_irradiance, temp_cell, **self.module_parameters)
+        return np.nan_to_num(dc_power / self.module_parameters['pdc0']).astype(np.float32)
+
+
+def main():
+    """Builds the wind and solar profile file for the bounding box of interest in a single chunked pass over the weather data"""
+    data = all_locations(None, variables = tuple(dict.fromkeys(WIND_VARIABLES + SOLAR_VARIABLES)))
+    get_renewables_class = get_renewables(data)
+    #Adjust for long/latitude for the data
+    profiles = get_renewables_class.get_grid_profiles(latitudes = (53.5, 53.5), longitudes = (3.5, 3.5), solar = True)
+    get_renewables_class.write_profiles(profiles, 'WindWales.nc')
+    print(profiles)
+
+
+if __name__ == '__main__':
+    main()
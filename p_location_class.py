@@ -5,30 +5,80 @@ import numpy as np
 import matplotlib.pyplot as plt
 #import glob
 import xarray as xr
+import p_aggregation as aggregation
 #import pvlib
-#import bisect
 #from kneed import KneeLocator
 #from shapely.geometry import Point
 
 
 
 
+class profile_arrays:
+    """Compact store for the profile of a location: one contiguous float64 array per column (each renewable, Weights,
+    Grid...) plus an integer array holding the year of each row. Columns are read and written like a dictionary"""
+    __slots__ = ('_columns', 'years')
+
+    def __init__(self, columns = None, years = None):
+        """columns maps column names to 1D arrays of equal length; years gives the year of each row"""
+        self._columns = {}
+        for name, values in (columns or {}).items():
+            self[name] = values
+        self.years = None if years is None else np.ascontiguousarray(years, dtype = np.int32)
+
+    def __getitem__(self, name):
+        return self._columns[name]
+
+    def __setitem__(self, name, values):
+        self._columns[name] = np.ascontiguousarray(values, dtype = np.float64)
+
+    def __contains__(self, name):
+        return name in self._columns
+
+    def __len__(self):
+        if self.years is not None:
+            return len(self.years)
+        return len(next(iter(self._columns.values()))) if self._columns else 0
+
+    @property
+    def columns(self):
+        """List of the column names, in the order they were added"""
+        return list(self._columns)
+
+    def drop(self, name):
+        """Removes a column"""
+        del self._columns[name]
+
+    def take(self, index):
+        """Returns a new profile containing only the rows selected by index (an integer array, mask or slice)"""
+        return profile_arrays({name: values[index] for name, values in self._columns.items()},
+                              None if self.years is None else self.years[index])
+
+    def to_frame(self):
+        """Returns the profile as a pandas DataFrame - only used for output"""
+        return pd.DataFrame(self._columns)
+
+
 class renewable_data:
     # Data stored for a specific renewable location, including cluster information
 
 
-    def __init__(self, weather_data, renewables, latitude =3.5 , longitude =53.5, years_of_interest = None, aggregation_variable = 1, aggregation_mode = None):
+    def __init__(self, weather_data, renewables, latitude =3.5 , longitude =53.5, years_of_interest = None, aggregation_variable = 1, aggregation_mode = None, ragged_tail = False):
         """Initialises the data class by importing the relevant file, loading the data, and finding the location.
         Reshapes the data.
         Note that df refers to just the data for the specific location as an xarray; not the data for all locations."""
 
         #self.longitude = weather_data[weather_data.find('_')+1:weather_data.find('_', weather_data.find('_')+1)]
         #self.latitude = weather_data[0:weather_data.find('_')]
+        if isinstance(weather_data, dict):
+            # A single grid cell given as 1D arrays (see p_sweep.grid_cells), which carries its own coordinates
+            latitude = weather_data.get('latitude', latitude)
+            longitude = weather_data.get('longitude', longitude)
 
         self.latitude = latitude
         self.longitude = longitude
         self.aggregation_variable = aggregation_variable
         self.aggregation_mode = aggregation_mode
+        self.ragged_tail = ragged_tail #If True, fixed aggregation allows a shorter final block when aggregation_variable doesn't divide the data
         #self.concat = pd.read_csv(weather_data)
         self.get_data_from_nc(weather_data)
         print('The plant is at latitude {latitude} and longitude {longitude}'.format(
@@ -37,29 +87,47 @@ class renewable_data:
         self.grid_on = False #Luke - you won't be using grid data so keep this as false
         # Extract the relevant profile
         self.renewables = renewables
-        self.set_years()
+        self.set_years(years_of_interest)
+
+    @property
+    def years(self):
+        """The year of each row of the profile"""
+        return self.concat.years
 
     def to_csv(self):
         """Sends output weather data to a csv file - not typically called"""
         output_file_name = '{a}_{b}_renewable_energy data.csv'.format(a = self.latitude, b = self.longitude)
-        self.concat.to_csv(output_file_name)
+        self.concat.to_frame().to_csv(output_file_name)
             
     def set_years(self, years_of_interest = None, aggregation_mode = None):
         """Initialises or re-initialises the data, then selects only the years you want, and trims them if apropriate - Luke you shouldn't need this if you import the data straight from a csv"""
         self.get_data_as_list()
         self.trim_years(years_of_interest)
-        
-        if aggregation_mode == 'optimal_cluster':
-            self.consecutive_temporal_cluster(self.aggregation_variable)
-        else:
+
+        # Falls back to the mode given when the data was set up; fixed aggregation if neither was given
+        if aggregation_mode is None:
+            aggregation_mode = self.aggregation_mode
+        if aggregation_mode is None or aggregation_mode == 'aggregate':
             self.aggregate(self.aggregation_variable)
+        else:
+            self.apply_aggregation(aggregation_mode, self.aggregation_variable)
 
 
         
     def get_data_from_nc(self,weather_data):
-        """Imports only the weather data for years in which grid data is available - Luke this should not be used in your model"""
+        """Imports only the weather data for years in which grid data is available - Luke this should not be used in your model.
+        weather_data is either a dataset of profiles on a (time, latitude, longitude) grid, or a dictionary holding the
+        'Wind' (and optionally 'Solar') profile and 'time' of this location as 1D arrays"""
         self.data={}
-        self.data['Solar'] = weather_data.Wind.loc[:, self.latitude, self.longitude].values*0
+        if isinstance(weather_data, dict):
+            self.data['Wind'] = np.asarray(weather_data['Wind'])
+            self.data['Solar'] = np.asarray(weather_data['Solar']) if 'Solar' in weather_data else self.data['Wind']*0
+            self.hourly_data = pd.to_datetime(weather_data['time'])
+            return
+        if 'Solar' in weather_data:
+            self.data['Solar'] = weather_data.Solar.loc[:, self.latitude, self.longitude].values
+        else:
+            self.data['Solar'] = weather_data.Wind.loc[:, self.latitude, self.longitude].values*0
         self.data['Wind'] = weather_data.Wind.loc[:, self.latitude, self.longitude].values
         self.hourly_data = pd.to_datetime(weather_data.time.values)
 
@@ -75,110 +143,66 @@ class renewable_data:
         direct_output = self.data[source]
         # Move the last few values to the front so that we start at midnight
         if start_time > 0:
-            edited_output = np.append(direct_output[-start_time:],
-                                      direct_output[:np.shape(direct_output)[0] - start_time], axis=0)
+            edited_output = np.roll(direct_output, start_time, axis=0)
         else:
             edited_output = np.array(direct_output)
         return edited_output
         
     def get_data_as_list(self):
-        """Extracts the data required and stores it in lists by hour - Luke you shouldn't need this if you're importing data straight from a csv"""
-        df = pd.DataFrame()
-        for source in self.renewables:
-            edited_output = self.correct_start_time(source, 10) #Be careful here
-            df[source] = edited_output    
+        """Extracts the data required and stores it in arrays by hour - Luke you shouldn't need this if you're importing data straight from a csv"""
+        self.concat = profile_arrays({source: self.correct_start_time(source, 10) for source in self.renewables}) #Be careful here
         if self.grid_on:
             grid_data = pd.read_csv(self.path + "//Grid_data//" + self.wire_state + '.csv')
             grid_data = grid_data['RRP'][0:len(self.data['Solar'])].to_numpy()
-            df['Grid'] = grid_data
-            df['Normalised Grid'] = 1-grid_data/max(grid_data)
-
-        self.concat = df
+            self.concat['Grid'] = grid_data
+            self.concat['Normalised Grid'] = 1-grid_data/max(grid_data)
         self.years_list()
         
     def trim_years(self, years_of_interest):
         """Trims the concatenated dataset to only include data from the years listed; fixes the years and dates data
         to match. Must be used BEFORE PCA or other analysis - Luke you shouldn't need this unless you're feeding the model several years of data but only want to do analysis on one of them"""
         if years_of_interest is not None:
-            year_data = []
-            years2 = []
-            for year_of_interest in years_of_interest:
-                start_row = bisect.bisect_left(self.years, year_of_interest)#+1992
-                finish_row = bisect.bisect_right(self.years, year_of_interest)#-(8760-2500)
-                year_data.append(self.concat.iloc[start_row:finish_row])
-                years2 += self.years[start_row:finish_row]
-            self.concat = year_data[0]
-            headings = self.concat.columns
-            self.years = years2
-
-            for count, year_datum in enumerate(year_data):
-                if count > 0:
-                    self.concat = pd.DataFrame(np.append(self.concat, year_datum, axis=0))
-
-            index = pd.Series(range(0, self.concat.shape[0]))
-            self.concat = self.concat.set_index(index)
-            self.concat.columns = headings
+            # Years are in order, so each year is a contiguous block of rows
+            start_rows = np.searchsorted(self.years, years_of_interest, side = 'left')
+            finish_rows = np.searchsorted(self.years, years_of_interest, side = 'right')
+            rows = np.concatenate([np.arange(start_row, finish_row) for start_row, finish_row in zip(start_rows, finish_rows)])
+            self.concat = self.concat.take(rows)
+            self.timestep_times = self.timestep_times[rows]
         self.total_days = len(self.concat)//24
         
-    def aggregate(self, aggregation_count):
-        """Aggregates self.concat into blocks of fixed numbers of size aggregation_count. aggregation_count must be an integer which is a factor of 24 (i.e. 1, 2, 3, 4, 6, 12, 24)"""
-        """To be corrected to work without days/clusters - Luke you shouldn't need to use this unless you decide to further aggregate your weather data"""
-        if self.concat.shape[0]%aggregation_count != 0:
-            raise TypeError("Aggregation counter must divide evenly into the total number of data points")
-        
-        self.concat['Weights'] = np.ones(self.concat.shape[0]).tolist()
-        for i in range(0, self.concat.shape[0]//aggregation_count): 
-            keep_index = i*aggregation_count
-            for j in range(1, aggregation_count):
-                drop_index = keep_index+j
-                self.concat.loc[keep_index] += self.concat.loc[drop_index]
-                self.concat.drop(drop_index, inplace = True) 
-        if self.grid_on:
-            self.concat.drop(columns = ['Normalised Grid'], inplace = True)
-            
-    def consecutive_temporal_cluster(self, data_reduction_factor):
-        """Reduces the data size by clustering adjacent hours until it has reduced in size by data_reduction_factor - Luke you shouldn't need to use this unless you decide to further aggregate your weather data"""
-        
-        if data_reduction_factor<1:
-            raise TypeError("Data reduction factor must be greater than 1")
-        
-        self.concat['Weights'] = np.ones(self.concat.shape[0]).tolist()
+    def apply_aggregation(self, aggregation_mode, aggregation_variable, **options):
+        """Reduces self.concat with one of the methods in p_aggregation.AGGREGATION_MODES, and records how much of the hourly
+        profile it kept in self.aggregation_report. self.labels maps each hourly row to the period it was merged into, and
+        each period takes its year and its time in self.timestep_times from the hourly row the method dates it by"""
+        if aggregation_mode not in aggregation.AGGREGATION_MODES:
+            raise ValueError("Unknown aggregation mode {a}; choose from {b}".format(
+                a = aggregation_mode, b = list(aggregation.AGGREGATION_MODES)))
         columns_to_sum = ['Solar', 'Wind']
         if self.grid_on:
             columns_to_sum.append('Normalised Grid')
+        hourly = {name: self.concat[name] for name in self.concat.columns if name != 'Weights'}
+        aggregated, rows, self.labels = aggregation.AGGREGATION_MODES[aggregation_mode](
+            hourly, self.years, aggregation_variable, columns_to_sum, **options)
+        aggregated.pop('Normalised Grid', None)
+        self.aggregation_report = aggregation.aggregation_report(hourly, aggregated, self.labels, self.renewables)
+        self.concat = profile_arrays(aggregated, self.years[rows])
+        self.timestep_times = self.timestep_times[rows]
+
+    def aggregate(self, aggregation_count, ragged_tail = None):
+        """Aggregates self.concat into consecutive blocks of aggregation_count rows by summing each column, so Weights holds
+        the number of hours in each block. aggregation_count can be any positive integer; if it does not divide evenly into
+        the number of rows, the leftover rows form a shorter final block when ragged_tail is True (defaults to self.ragged_tail),
+        and a TypeError is raised otherwise"""
+        """Luke you shouldn't need to use this unless you decide to further aggregate your weather data"""
+        if ragged_tail is None:
+            ragged_tail = self.ragged_tail
+        self.apply_aggregation('aggregate', aggregation_count, ragged_tail = ragged_tail)
             
-        proximity = []
-        for row in range(self.concat.shape[0]):
-            if row < self.concat.shape[0]-1:
-                differences = sum(abs(self.concat[element].iloc[row] - self.concat[element].iloc[row+1]) for element in columns_to_sum)
-                proximity.append(2*differences*self.concat['Weights'].iloc[row]*self.concat['Weights'].iloc[row+1]\
-                /(self.concat['Weights'].iloc[row] + self.concat['Weights'].iloc[row+1]))
-        proximity.append(1E6)            
-        self.concat['Proximity'] = proximity
-        
-        target_size = self.concat.shape[0]//data_reduction_factor
-        while self.concat.shape[0] > target_size:
-            keep_index = self.concat['Proximity'].idxmin()
-            i_keep_index = self.concat.index.get_indexer([keep_index])[0]
-            drop_index = self.concat.index.values[i_keep_index+1]
-            self.concat.loc[keep_index] += self.concat.loc[drop_index]
-            self.concat.drop(drop_index, inplace = True)
-            if i_keep_index+1 < len(self.concat):
-                differences = sum(abs(self.concat[element].iloc[i_keep_index]/self.concat['Weights'].iloc[i_keep_index]\
-                                            - self.concat[element].iloc[i_keep_index+1]/self.concat['Weights'].iloc[i_keep_index+1])\
-                                            for element in columns_to_sum)
-                self.concat['Proximity'].iloc[i_keep_index] = 2*differences*self.concat['Weights'].iloc[i_keep_index]\
-                                                                *self.concat['Weights'].iloc[i_keep_index+1]\
-                                                /(self.concat['Weights'].iloc[i_keep_index] + self.concat['Weights'].iloc[i_keep_index+1])
-        if self.grid_on:
-            self.concat.drop(columns = ['Proximity', 'Normalised Grid'], inplace = True)
-        else:
-            self.concat.drop(columns = ['Proximity'], inplace = True)
+    def consecutive_temporal_cluster(self, data_reduction_factor):
+        """Reduces the data size by clustering adjacent hours until it has reduced in size by data_reduction_factor - Luke you shouldn't need to use this unless you decide to further aggregate your weather data"""
+        self.apply_aggregation('optimal_cluster', data_reduction_factor)
         
     def years_list(self):
-        """Creates a list of cells matching the date, that contains only their year"""
-        self.years = []
-        for row in range(self.concat.shape[0]):
-            self.years.append(self.hourly_data[row].year)
-
-
+        """Stores the year and the start time of each row of the profile"""
+        self.concat.years = self.hourly_data.year.to_numpy()[:len(self.concat[self.renewables[0]])]
+        self.timestep_times = self.hourly_data.to_numpy()[:len(self.concat)]
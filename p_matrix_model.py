@@ -0,0 +1,225 @@
+"""Builds the design LP of location_optimise_design directly as sparse matrices from the profile arrays, so that no
+Pyomo rule has to be expanded one timestep at a time. Every constraint family in p_constraints.py becomes one vectorised
+block of rows, and the model is solved through scipy's interface to HiGHS"""
+import numpy as np
+import scipy.sparse as sparse
+from scipy.optimize import linprog
+import p_constraints as cons
+
+
+class matrix_design_model:
+    """The design problem for the location held by design_class, as min c.x subject to A_ub x <= b_ub, A_eq x = b_eq and
+    variable bounds. Variables and constraints mirror the Pyomo model, so the objective is the same LCOA"""
+
+    def __init__(self, design_class):
+        """Reads the profile and costs from design_class (after specific_model_features) and assembles the matrices"""
+        self.design_class = design_class
+        self.renewables = list(design_class._renewables)
+        self.components = list(design_class._components)
+        self.storage_components = list(design_class._storage_components)
+        self.weights = np.array([design_class._t_weights[t] for t in design_class._times], dtype=float)
+        self.power_supply = np.array([[design_class._powers[(renewable, t)] for t in design_class._times]
+                                      for renewable in self.renewables], dtype=float)
+        self.grid_power_cost = np.array([design_class._grid_power_cost[t] for t in design_class._times], dtype=float)
+        self.grid_power_cost_no_TUOS = np.array([design_class._grid_power_cost_no_TUOS[t] for t in design_class._times],
+                                                dtype=float)
+        self.total_days = design_class.location.total_days
+        self.grid_on = design_class.grid_on
+        self.size = len(self.weights)
+        self.converged = False
+
+        self._variables = {}
+        self._columns = 0
+        self._lower = []
+        self._upper = []
+        self._integer = []
+        self._rows = {'eq': {'rows': [], 'columns': [], 'values': [], 'rhs': [], 'count': 0},
+                      'ub': {'rows': [], 'columns': [], 'values': [], 'rhs': [], 'count': 0}}
+        self.add_variables()
+        self.add_constraints()
+        self.add_objective()
+        self.A_eq, self.b_eq = self._assemble('eq')
+        self.A_ub, self.b_ub = self._assemble('ub')
+
+    def _add_variable(self, name, shape, lower, upper, integer = False):
+        """Reserves a block of columns for a variable indexed like the Pyomo one; returns the column indices"""
+        count = int(np.prod(shape))
+        self._variables[name] = np.arange(self._columns, self._columns + count).reshape(shape)
+        self._columns += count
+        self._lower.append(np.full(count, lower, dtype=float))
+        self._upper.append(np.full(count, upper, dtype=float))
+        self._integer.append(np.full(count, int(integer)))
+        return self._variables[name]
+
+    def _add_rows(self, kind, terms, rhs):
+        """Adds len(rhs) rows of kind 'eq' or 'ub'. Each term is (columns, coefficients) or (columns, coefficients, rows),
+        where rows gives the local row of each column and defaults to one column per row"""
+        block = self._rows[kind]
+        rhs = np.atleast_1d(np.asarray(rhs, dtype=float))
+        for term in terms:
+            columns = np.atleast_1d(term[0])
+            local_rows = term[2] if len(term) > 2 else np.arange(len(rhs))
+            block['rows'].append(block['count'] + np.broadcast_to(local_rows, columns.shape))
+            block['columns'].append(columns)
+            block['values'].append(np.broadcast_to(np.asarray(term[1], dtype=float), columns.shape))
+        block['rhs'].append(rhs)
+        block['count'] += len(rhs)
+
+    def _assemble(self, kind):
+        """Converts the rows of one kind into a CSR matrix; repeated (row, column) entries are summed"""
+        block = self._rows[kind]
+        if block['count'] == 0:
+            return None, None
+        matrix = sparse.coo_matrix((np.concatenate(block['values']),
+                                    (np.concatenate(block['rows']), np.concatenate(block['columns']))),
+                                   shape=(block['count'], self._columns)).tocsr()
+        return matrix, np.concatenate(block['rhs'])
+
+    def add_variables(self):
+        """Creates the same variables, with the same bounds, as location_optimise_design.create_instance"""
+        design_class = self.design_class
+        T = self.size
+        max_weight = design_class.bound_weight()
+        self.C_power = self._add_variable('C_power', (len(self.renewables),), 0, 20)
+        self.C_components = self._add_variable('C_components', (len(self.components),), 0, 20)
+        self.C_storage = self._add_variable('C_storage', (len(self.storage_components),), 0, 20)
+        self.C_FC = self._add_variable('C_FC', (1,), 0, 20)[0]
+        if self.grid_on:
+            self.grid_active = self._add_variable('grid_active', (1,), 0, 1, integer = True)[0]
+        self.pi = self._add_variable('pi', (len(self.components), T), 0, 5*max_weight)
+        self.beta = self._add_variable('beta', (len(self.components), T), 0, 5*max_weight)
+        self.gamma = self._add_variable('gamma', (len(self.components), T), 0, 5*max_weight)
+        if self.grid_on:
+            self.eta_in = self._add_variable('eta_in', (T,), 0, 0.175*max_weight)
+            self.eta_out = self._add_variable('eta_out', (T,), 0, 0.175*max_weight)
+        self.curtailed = self._add_variable('curtailed', (T,), 0, 5*max_weight)
+        self.storage_volume = self._add_variable('storage_volume', (len(self.storage_components), T), 0, 1E4)
+
+    def add_constraints(self):
+        """Adds one block of rows per constraint family in p_constraints.py"""
+        design_class = self.design_class
+        CF = design_class._CF
+        T = self.size
+        weights = self.weights
+        previous = np.roll(np.arange(T), 1)  # Storage and ramping are cyclic, so the first timestep follows the last
+        elec, hb, battery = (self.components.index(name) for name in ('Elec', 'HB+ASU', 'Battery'))
+        hydrogen_store, battery_store = (self.storage_components.index(name) for name in ('Hydrogen', 'Battery'))
+        hb_flows = [self.pi[hb], self.beta[hb], self.gamma[hb]]
+        supply = [(np.full(T, self.C_power[count]), self.power_supply[count]) for count in range(len(self.renewables))]
+        grid = [(self.eta_in, 1), (self.eta_out, -1)] if self.grid_on else []
+
+        # _PowerBalance
+        self._add_rows('eq', supply + grid + [(self.curtailed, -1)]
+                       + [(self.pi[count], -1) for count in range(len(self.components))], np.zeros(T))
+        # _CurtailedLimit
+        self._add_rows('ub', [(self.curtailed, 1)] + [(columns, -values) for columns, values in supply], np.zeros(T))
+        # _HydrogenBalance
+        self._add_rows('eq', [(self.storage_volume[hydrogen_store, previous], 1),
+                              (self.pi[elec], CF[('pi', 'H2')]), (self.beta[elec], CF[('pi', 'H2')])]
+                       + [(flow, -CF[('pi', 'NH3')] / CF[('H2', 'NH3')]) for flow in hb_flows]
+                       + [(self.gamma[count], -CF[('H2', 'gamma')]) for count in range(len(self.components))]
+                       + [(self.storage_volume[hydrogen_store], -1)], np.zeros(T))
+        # _AmmoniaBalance
+        production_factor = (design_class.G_annual_hours / 24) / self.total_days * CF[('pi', 'NH3')]
+        self._add_rows('eq', [(flow, production_factor, np.zeros(T, dtype=int)) for flow in hb_flows],
+                       [design_class.G_production])
+        # _BatteryBalance
+        self._add_rows('eq', [(self.storage_volume[battery_store, previous], cons.BATTERY_RETENTION),
+                              (self.pi[battery], CF[('pi', 'beta')])]
+                       + [(self.beta[count], -1) for count in range(len(self.components))]
+                       + [(self.storage_volume[battery_store], -1)], np.zeros(T))
+        # _NH3_ramp_down and _NH3_ramp_up
+        modifier = 2 * weights[previous] * weights / (weights[previous] + weights)
+        for sign, rate in ((1, design_class.ramp_down), (-1, design_class.ramp_up)):
+            self._add_rows('ub', [(flow[previous], sign / weights[previous]) for flow in hb_flows]
+                           + [(flow, -sign / weights) for flow in hb_flows]
+                           + [(np.full(T, self.C_components[hb]), -rate * modifier)], np.zeros(T))
+        # _ComponentCap
+        for count in range(len(self.components)):
+            self._add_rows('ub', [(self.pi[count], 1), (self.beta[count], 1), (self.gamma[count], 1),
+                                  (np.full(T, self.C_components[count]), -weights)], np.zeros(T))
+        # _DischargeCap
+        self._add_rows('ub', [(self.beta[count], 1) for count in range(len(self.components))]
+                       + [(np.full(T, self.C_components[battery]), -weights)], np.zeros(T))
+        # _StorageCap
+        for count in range(len(self.storage_components)):
+            self._add_rows('ub', [(self.storage_volume[count], 1), (np.full(T, self.C_storage[count]), -1)], np.zeros(T))
+        # _HBCap_min
+        self._add_rows('ub', [(np.full(T, self.C_components[hb]), design_class.HB_min)]
+                       + [(flow, -1 / weights) for flow in hb_flows], np.zeros(T))
+        # _FC_Cap
+        self._add_rows('ub', [(self.gamma[count], 1) for count in range(len(self.components))]
+                       + [(np.full(T, self.C_FC), -weights)], np.zeros(T))
+        # _FC_limit and _Battery_limit
+        self._add_rows('eq', [(self.gamma[elec], 1), (self.gamma[battery], 1)], np.zeros(T))
+        self._add_rows('eq', [(self.beta[battery], 1)], np.zeros(T))
+        if not self.grid_on:
+            return
+        # _grid_power_limit_in and _grid_power_limit_out
+        self._add_rows('ub', [(self.eta_in, 1)], design_class._grid_max_use * weights)
+        self._add_rows('ub', [(self.eta_out, 1)], design_class._grid_max_sale * weights)
+        # _grid_active_constraint_in and _grid_active_constraint_out
+        for flow in (self.eta_in, self.eta_out):
+            self._add_rows('ub', [(flow, 1 / (self.total_days * 24 * 20), np.zeros(T, dtype=int)),
+                                  (self.grid_active, -1, 0)], [0])
+
+    def add_objective(self):
+        """Builds the cost vector for _LCOA; the constant water cost is kept separately in self.objective_constant"""
+        design_class = self.design_class
+        scale = 1E6 / design_class.G_production
+        capital = scale * (design_class.G_crf + design_class.O_and_M)
+        self.c = np.zeros(self._columns)
+        self.c[self.C_power] = capital * np.array([design_class._Cost_renewables[name] for name in self.renewables])
+        self.c[self.C_components] = capital * np.array([design_class._Cost_components[name] for name in self.components])
+        self.c[self.C_storage] = capital * np.array([design_class._Cost_storage[name] for name in self.storage_components])
+        self.c[self.C_FC] = capital * design_class._Cost_FC[None]
+        if self.grid_on:
+            self.c[self.grid_active] = capital * design_class._Cost_grid_fixed[design_class.transmission_type] \
+                                       * design_class.AUD_to_USD / design_class.scaling_factor
+            operating = scale * design_class.G_annual_hours / 24 / self.total_days
+            self.c[self.eta_in] = operating * self.grid_power_cost / self.weights
+            self.c[self.eta_out] = -operating * self.grid_power_cost_no_TUOS / self.weights
+        self.objective_constant = scale * design_class.water_cost * design_class.water_consumption \
+                                  / design_class._CF[('H2', 'NH3')] * design_class.G_production
+
+    def solve(self, options = None):
+        """Solves the LP (a MIP if the grid is on) with HiGHS; sets self.converged, self.objective and self.x"""
+        integrality = np.concatenate(self._integer)
+        result = linprog(self.c, A_ub=self.A_ub, b_ub=self.b_ub, A_eq=self.A_eq, b_eq=self.b_eq,
+                         bounds=np.column_stack([np.concatenate(self._lower), np.concatenate(self._upper)]),
+                         method='highs', integrality=integrality if integrality.any() else None, options=options)
+        self.converged = result.status == 0
+        if self.converged:
+            self.x = result.x
+            self.objective = result.fun + self.objective_constant
+            self.eqlin_marginals = None if result.eqlin is None else result.eqlin.marginals
+        return result
+
+    def value(self, name):
+        """Returns the optimal values of a variable as an array shaped like its index"""
+        return self.x[self._variables[name]]
+
+    def solution(self):
+        """Returns the solution and the profile data it was solved with as a dictionary of arrays, keyed by the names of
+        the equivalent Pyomo components"""
+        solution = {name: self.value(name) for name in self._variables}
+        solution['C_FC'] = float(solution['C_FC'][0])
+        if self.grid_on:
+            solution['grid_active'] = float(solution['grid_active'][0])
+        else:
+            solution.update(grid_active = 0, eta_in = np.zeros(self.size), eta_out = np.zeros(self.size))
+        solution['power_supply'] = self.power_supply
+        solution['t_weights'] = self.weights
+        solution['grid_power_cost'] = self.grid_power_cost
+        solution['grid_power_cost_no_TUOS'] = self.grid_power_cost_no_TUOS
+        solution['total_days'] = self.total_days
+        solution['obj'] = self.objective
+        return solution
+
+    def capacities(self):
+        """Returns the designed capacities in the same format as location_optimise_design.get_capacities"""
+        return {'Renewables': dict(zip(self.renewables, self.value('C_power').tolist())),
+                'Components': dict(zip(self.components, self.value('C_components').tolist())),
+                'StorageComponents': dict(zip(self.storage_components, self.value('C_storage').tolist())),
+                'FC': float(self.x[self.C_FC]), 'Production_LCOA': self.objective,
+                'Grid Active': float(self.x[self.grid_active]) if self.grid_on else 0}
@@ -0,0 +1,114 @@
+"""Estimates how much memory each driver task needs, and sizes and throttles the worker pool of a sweep (and the threads
+each solver uses) so that the tasks running at once fit in a memory budget"""
+import os
+import time
+import resource
+
+
+# Peak resident memory of a worker, in MB: the interpreter with the model code imported, plus the build and solve of the
+# model per variable. Measured on WindWales.nc with HiGHS at aggregation 24, 6 and 3 (365 to 2920 timesteps); benders
+# only at aggregation 3, where it needs a fifth of the memory of one LP since no LP covers the whole profile
+BASE_MEMORY = 220
+MEMORY_PER_VARIABLE = {'pyomo': 5.7E-3, 'matrix': 4.1E-3, 'benders': 0.8E-3}
+
+# Fraction of the available memory used when no budget is given, and headroom added to measured peaks
+DEFAULT_BUDGET_FRACTION = 0.8
+SAFETY_FACTOR = 1.2
+
+
+def model_variables(design_class, hours, aggregation_variable):
+    """Number of variables in the design model for a profile of hours hours aggregated by aggregation_variable: the
+    pi, beta and gamma flows to each component, curtailed and storage_volume (and eta_in and eta_out with a grid) for
+    every timestep, plus the capacities"""
+    timesteps = -(-hours//aggregation_variable)
+    per_timestep = 3*len(design_class._components) + 1 + len(design_class._storage_components)
+    if design_class.grid_on:
+        per_timestep += 2
+    capacities = len(design_class._renewables) + len(design_class._components) + len(design_class._storage_components) + 1
+    return timesteps*per_timestep + capacities
+
+
+def estimate_task_memory(design_class, hours, aggregation_variable):
+    """Estimated peak memory of one driver task in MB"""
+    backend = getattr(design_class, 'backend', 'pyomo')
+    return BASE_MEMORY + model_variables(design_class, hours, aggregation_variable)*MEMORY_PER_VARIABLE[backend]
+
+
+def peak_memory():
+    """Peak resident memory of this process so far in MB"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024
+
+
+def available_memory():
+    """Memory available for new processes in MB, from /proc/meminfo where there is one"""
+    try:
+        with open('/proc/meminfo') as meminfo:
+            for line in meminfo:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1])/1024
+    except OSError:
+        pass
+    return os.sysconf('SC_PAGE_SIZE')*os.sysconf('SC_AVPHYS_PAGES')/1024**2
+
+
+def default_budget():
+    """Memory budget in MB used when none is given"""
+    return DEFAULT_BUDGET_FRACTION*available_memory()
+
+
+def pool_size(task_memory, memory_budget = None, cores = None):
+    """Returns (workers, solver threads): as many workers as fit in memory_budget (MB) at task_memory MB each, but no
+    more than there are cores; cores left over are shared out as solver threads"""
+    if memory_budget is None:
+        memory_budget = default_budget()
+    if cores is None:
+        cores = os.cpu_count() or 1
+    workers = int(max(1, min(cores, memory_budget//task_memory)))
+    return workers, max(1, cores//workers)
+
+
+class task_throttle:
+    """Limits how many tasks are running at once. The limit starts at the pool size from the estimated task memory, and
+    after the first calibration_tasks results are back it is set from the largest peak memory measured by the workers
+    (the 'Peak memory' each driver result reports), so it can only fall below the number of workers in the pool"""
+
+    def __init__(self, workers, task_memory, memory_budget = None, calibration_tasks = None):
+        self.workers = workers
+        self.limit = workers
+        self.task_memory = task_memory
+        self.memory_budget = default_budget() if memory_budget is None else memory_budget
+        self.calibration_tasks = workers if calibration_tasks is None else calibration_tasks
+        self.measured = []
+
+    def record(self, result):
+        """Records the peak memory reported with a result, and updates the limit once enough have been measured"""
+        if isinstance(result, dict) and result.get('Peak memory') is not None:
+            self.measured.append(result['Peak memory'])
+        if len(self.measured) >= self.calibration_tasks:
+            self.task_memory = max(self.measured)*SAFETY_FACTOR
+            self.limit = int(max(1, min(self.workers, self.memory_budget//self.task_memory)))
+
+    def run(self, pool, function, tasks, poll_interval = 0.05):
+        """Runs function on each of tasks through pool, with at most self.limit tasks in flight, and yields each result as
+        soon as it is ready"""
+        tasks = iter(tasks)
+        in_flight = []
+        finished = False
+        while True:
+            while not finished and len(in_flight) < self.limit:
+                task = next(tasks, None)
+                if task is None:
+                    finished = True
+                else:
+                    in_flight.append(pool.apipe(function, task))
+            if not in_flight:
+                return
+            ready = [result for result in in_flight if result.ready()]
+            if not ready:
+                time.sleep(poll_interval)
+                continue
+            for result in ready:
+                in_flight.remove(result)
+                value = result.get()
+                self.record(value)
+                yield value
@@ -1,26 +1,39 @@
 import pyomo.environ as pm
 import p_constraints as cons
+import p_matrix_model as matrix_model
+import p_benders as benders
 from p_optimisation_parent import optimiser
+import multiprocess
+from pathos.multiprocessing import ProcessPool
 import matplotlib.pyplot as plt
 import time 
 
 class location_optimise_design(optimiser):
     """Class designed for optimising an ammonia plant given a profile formed in clusters"""
 
-    def __init__(self, Target_Production, Sensitivity_dictionary = {'Production': 'Base', 'Storage': 'Base', 'Finance': 'Base', 'Year': 'Base'}, HB_min = 0.2):
-        """Store the location data in the class and create the model and its solver"""
-        super().__init__(Target_Production, Sensitivity_dictionary = Sensitivity_dictionary)
+    def __init__(self, Target_Production, Sensitivity_dictionary = {'Production': 'Base', 'Storage': 'Base', 'Finance': 'Base', 'Year': 'Base'}, HB_min = 0.2, backend = 'pyomo', solver = None, solver_threads = None, grid_on = False, benders_workers = None):
+        """Store the location data in the class and create the model and its solver.
+        backend = 'matrix' builds each instance as sparse matrices (p_matrix_model) instead of through Pyomo, and
+        backend = 'benders' solves it by Benders decomposition over monthly periods (p_benders, without a grid only),
+        solving the periods on benders_workers processes at once (None solves them in turn).
+        solver picks the solver backend (see p_solvers) used for Pyomo instances.
+        With grid_on = False (as in all our runs) there is no grid_active binary, so the design problem is a pure LP"""
+        super().__init__(Target_Production, Sensitivity_dictionary = Sensitivity_dictionary, solver = solver,
+                         solver_threads = solver_threads, grid_on = grid_on)
+        self.backend = backend
+        self.benders_workers = benders_workers
         self.design_requirements(HB_min = HB_min)
 
     def design_requirements(self, HB_min = 0.2):
         
         #Parameters
-        self.model.Cost_power = pm.Param(self.model.Renewables, within = pm.NonNegativeReals, initialize = self._Cost_renewables) #million USD/installed MW
-        self.model.Cost_components = pm.Param(self.model.Components, within = pm.NonNegativeReals, initialize = self._Cost_components) #million USD/installed MW
-        self.model.Cost_storage = pm.Param(self.model.StorageComponents, within = pm.NonNegativeReals, initialize = self._Cost_storage) #million USD/installed MW
-        self.model.Cost_FC = pm.Param(within = pm.NonNegativeReals, initialize = self._Cost_FC) #million USD/installed MW
+        self.model.Cost_power = pm.Param(self.model.Renewables, within = pm.NonNegativeReals, initialize = self._Cost_renewables, mutable = True) #million USD/installed MW
+        self.model.Cost_components = pm.Param(self.model.Components, within = pm.NonNegativeReals, initialize = self._Cost_components, mutable = True) #million USD/installed MW
+        self.model.Cost_storage = pm.Param(self.model.StorageComponents, within = pm.NonNegativeReals, initialize = self._Cost_storage, mutable = True) #million USD/installed MW
+        self.model.Cost_FC = pm.Param(within = pm.NonNegativeReals, initialize = self._Cost_FC, mutable = True) #million USD/installed MW
         self.model.Cost_grid = pm.Param(within=pm.NonNegativeReals, mutable = True)
         
+        self.HB_min = HB_min
         self.model.G_HB_min = pm.Param(initialize=HB_min, mutable=True)  # TBC
 
         #Variables
@@ -28,12 +41,14 @@ class location_optimise_design(optimiser):
         self.model.C_components = pm.Var(self.model.Components, bounds = (0, 20), initialize = 100)
         self.model.C_storage = pm.Var(self.model.StorageComponents, bounds = (0, 20), initialize = 100)
         self.model.C_FC = pm.Var(bounds = (0,20), initialize = 0)
-        self.model.grid_active = pm.Var(within=pm.Binary)
+        if self.grid_on:
+            self.model.grid_active = pm.Var(within=pm.Binary)
 
         #Constraints
         super().model_constraints()
-        self.model.grid_active_constraint_in = pm.Constraint(rule=cons._grid_active_constraint_in)
-        self.model.grid_active_constraint_out = pm.Constraint(rule=cons._grid_active_constraint_out)
+        if self.grid_on:
+            self.model.grid_active_constraint_in = pm.Constraint(rule=cons._grid_active_constraint_in)
+            self.model.grid_active_constraint_out = pm.Constraint(rule=cons._grid_active_constraint_out)
         self.model.AmmoniaBalance = pm.Constraint(rule = cons._AmmoniaBalance)
         
         #Objective  
@@ -41,22 +56,53 @@ class location_optimise_design(optimiser):
 
     def create_data(self):
         """Creates a data dictionary which can be loaded into an instance"""
+        if self.backend != 'pyomo':
+            return #The matrix backends read the profile straight from the class
         super().create_data()
-        self.data[None]['Cost_grid'] = {None:(self._Cost_grid_fixed[self.transmission_type])
-                                             *self.AUD_to_USD/self.scaling_factor}
+        self.data[None]['Cost_grid'] = {None: self.grid_cost()}
+
+    def grid_cost(self):
+        """Cost of the grid connection, scaled to the model"""
+        return self._Cost_grid_fixed[self.transmission_type]*self.AUD_to_USD/self.scaling_factor
+
+    def update_costs(self, instance):
+        """Updates the cost parameters of an instance to the current sensitivities and target production"""
+        super().update_costs(instance)
+        instance.Cost_power.store_values(self._Cost_renewables)
+        instance.Cost_components.store_values(self._Cost_components)
+        instance.Cost_storage.store_values(self._Cost_storage)
+        instance.Cost_FC.set_value(self._Cost_FC[None])
+        instance.Cost_grid.set_value(self.grid_cost())
            
-    def update_instance(self, instance):
-        """Updates the instance with new data specific to the location"""
-        super().update_instance(instance)
+    def create_instance(self):
+        """Creates an instance of the model"""
+        if self.backend == 'matrix':
+            return matrix_model.matrix_design_model(self)
+        if self.backend == 'benders':
+            return benders.benders_design_model(self, pool = self.benders_pool())
+        return super().create_instance()
+
+    def benders_pool(self):
+        """The pool the 'benders' backend solves its periods on: benders_workers processes, or None to solve them in turn.
+        Pathos keeps the pool, so every design with the same benders_workers shares its processes. The workers of a sweep
+        (or a sensitivity run) can't start processes of their own, so there the locations are the parallel part"""
+        if self.benders_workers is None or self.benders_workers <= 1:
+            return None
+        if multiprocess.current_process().daemon:
+            raise ValueError("benders_workers can't be used inside a worker process, such as a sweep's; set it to None "
+                             "and let the sweep run the locations in parallel instead")
+        return ProcessPool(nodes = self.benders_workers)
+
+    def solve_model(self, instance):
+        """Solves the model, and checks that it reached an optimal solution"""
+        if self.backend == 'pyomo':
+            return super().solve_model(instance)
+        instance.solve()
+        self.converged = instance.converged
+        self.iterations = getattr(instance, 'iterations', None) #Benders iterations; the matrix backend doesn't report any
+        if not self.converged:
+            print('\nThe instance did not converge properly')
 
-        delete_list = ['obj']
-        for element in delete_list:
-            instance.del_component(element)
-        
-        instance.obj = pm.Objective(rule = cons._LCOA) #Objective needs to be reconstructed for each location because equipment CAPEX changes
-        if not self.location.grid_on:
-            instance.grid_active.fix(0)        
-        
     def print_results(self, instance):
         """Prints results from model"""
         try:
@@ -64,12 +110,12 @@ class location_optimise_design(optimiser):
         except:
             self.store_results(instance)
             
-        for Renewable in instance.Renewables:
+        for Renewable in self._renewables:
             print('The ' + str(Renewable) + ' installed capacity is ' + str(self.results[Renewable]) + ' MW.') 
-        for Component in instance.Components:
+        for Component in self._components:
             print('The ' + str(Component) + ' installed capacity is ' + str(self.results[Component]) +
                   ' MW; its load factor is ' + str(self.results[str(Component) + ' LF']) + '%.')
-        for StorageComponent in instance.StorageComponents:
+        for StorageComponent in self._storage_components:
             print('The ' + str(StorageComponent) + ' storage capacity is ' +
                   str(self.results[str(StorageComponent) + ' storage capacity']) + ' ' +
                   self._storage_component_units[StorageComponent])
@@ -104,23 +150,36 @@ class location_optimise_design(optimiser):
         # plt.clf()
         
     def store_results(self, instance):
-        """Stores the results from the model into a dictionary"""
+        """Stores the results from the model into a dictionary; a design that did not converge is only flagged as such"""
+        if not self.converged:
+            return self.store_non_converged_results()
         self.results = {}
         
-        self.results['Solar Capex'] = pm.value(instance.Cost_power['Solar'])
-        self.results['Wind Capex'] = pm.value(instance.Cost_power['Wind'])
+        self.results['Solar Capex'] = self._Cost_renewables['Solar']
+        self.results['Wind Capex'] = self._Cost_renewables['Wind']
         
         #Store some high level results relating to the solution
-        self.results['LCOA'] = round(pm.value(instance.obj()), 2)
+        if self.backend != 'pyomo':
+            self.results['LCOA'] = round(instance.objective, 2)
+        else:
+            self.results['LCOA'] = round(pm.value(instance.obj()), 2)
 
         self.results['Transfer Efficiency'] = round(self.transmission_efficiency, 2)
         
-        super().store_results(instance)
+        if self.backend != 'pyomo':
+            super().store_solution(instance.solution())
+            if self.backend == 'benders':
+                self.results['Benders gap'] = instance.gap
+                self.results['Benders slack'] = instance.slack
+        else:
+            super().store_results(instance)
         
         return self.results
         
     def get_capacities(self, instance):
         """Stores the capacities from the designed solution in a useful dictionary for the operating optimiser"""
+        if self.backend != 'pyomo':
+            return instance.capacities()
         
         capacities = {'Renewables' : {}, 'Components': {}, 'StorageComponents': {}, 'FC': pm.value(instance.C_FC), 'Production_LCOA':pm.value(instance.obj())}
         for Renewable in instance.Renewables:
@@ -129,5 +188,5 @@ class location_optimise_design(optimiser):
             capacities['Components'][Component] = pm.value(instance.C_components[Component])
         for StorageComponent in instance.StorageComponents:
             capacities['StorageComponents'][StorageComponent] = pm.value(instance.C_storage[StorageComponent])
-        capacities['Grid Active'] = pm.value(instance.grid_active)
+        capacities['Grid Active'] = pm.value(cons._grid_connection(instance))
         return capacities
\ No newline at end of file
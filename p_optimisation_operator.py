@@ -7,9 +7,10 @@ import time
 class location_optimise_operation(optimiser):
     """Class designed for optimising an ammonia plant given a profile formed in clusters"""
 
-    def __init__(self, Target_Production, Sensitivity_dictionary ={'Production': 'Base', 'Storage': 'Base', 'Finance': 'Base', 'Year': 'Base'}):
+    def __init__(self, Target_Production, Sensitivity_dictionary ={'Production': 'Base', 'Storage': 'Base', 'Finance': 'Base', 'Year': 'Base'}, solver = None, solver_threads = None, grid_on = False):
         """Store the location data in the class and create the model and its solver"""
-        super().__init__(Target_Production, Sensitivity_dictionary)
+        super().__init__(Target_Production, Sensitivity_dictionary, solver = solver, solver_threads = solver_threads,
+                         grid_on = grid_on)
         self.operating_requirements() #Doesn't need finance information to work...
 
     def operating_requirements(self):
@@ -28,6 +29,7 @@ class location_optimise_operation(optimiser):
         super().model_constraints()
 
         # Objective
+        self.model.obj = pm.Objective(rule=cons._AmmoniaProduction, sense=pm.maximize)
 
     def create_data(self, Equipment_capacities):
         """Creates a data dictionary which can be loaded into an instance"""
@@ -39,7 +41,16 @@ class location_optimise_operation(optimiser):
         self.data[None]['G_production_LCOA'] = {None: Equipment_capacities['Production_LCOA']}
         self.data[None]['grid_active'] = {None: Equipment_capacities['Grid Active']}
 
-        self.model.obj = pm.Objective(rule=cons._AmmoniaProduction, sense=pm.maximize)
+    def update_capacities(self, instance, Equipment_capacities):
+        """Fixes an existing instance to another set of capacities (from location_optimise_design.get_capacities); all
+        of them are mutable parameters, so nothing is rebuilt"""
+        instance.C_power.store_values(Equipment_capacities['Renewables'])
+        instance.C_components.store_values(Equipment_capacities['Components'])
+        instance.C_storage.store_values(Equipment_capacities['StorageComponents'])
+        instance.C_FC.set_value(Equipment_capacities['FC'])
+        instance.G_production_LCOA.set_value(Equipment_capacities['Production_LCOA'])
+        instance.grid_active.set_value(Equipment_capacities['Grid Active'])
+
     def update_instance(self, instance):
         """Updates the instance with new data specific to the location"""
 
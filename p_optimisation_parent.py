@@ -1,27 +1,43 @@
 import pyomo.environ as pm
 import p_constraints as cons
+import p_solvers as solvers
+import p_cost_tables as cost_tables
 import matplotlib.pyplot as plt
 import time
-import gurobipy
 import pandas as pd
+import numpy as np
 import os
+try:
+    import highspy
+except ImportError: #Only needed to warm start HiGHS from a basis, which needs highspy installed anyway
+    highspy = None
+
+
+# Variables whose values warm_start_data keeps: the capacities and the dispatch
+START_VARIABLES = ('C_power', 'C_components', 'C_storage', 'pi', 'beta', 'gamma', 'curtailed', 'storage_volume')
 
 
 class optimiser:
     """Class designed for optimising an ammonia plant given a renewable energy profile"""
 
-    def __init__(self, Target_Production, Sensitivity_dictionary):
-        """Store the location data in the class and create the model and its solver"""
+    def __init__(self, Target_Production, Sensitivity_dictionary, solver = None, solver_threads = None, grid_on = False):
+        """Store the location data in the class and create the model and its solver.
+        solver is one of p_solvers.SOLVER_BACKENDS ('highs', 'cbc', 'glpk', 'gurobi'); by default the first licence-free
+        one installed is used. solver_threads limits the threads it uses.
+        grid_on must match the grid_on of the locations; without a grid the model has no grid variables or constraints"""
 
         self.model = pm.AbstractModel()
-        self.opt = pm.SolverFactory('gurobi')
-        self.opt.options["Method"] = 3
-        self.opt.options["NodeMethod"] = 2
-        self.path = os.getcwd() +r'/Model_for_Luke-main/'
+        self.grid_on = grid_on
+        self.solver = solvers.choose_backend(solver)
+        self.solver_threads = solver_threads
+        self.opt = solvers.make_solver(self.solver, threads = solver_threads, lp = not grid_on)
+        self.path = os.path.dirname(os.path.abspath(__file__)) + r'/'
         self.NoRelHeurWork = 5
         self.NodefileStart = 0.5
+        self.warmstart = False
         self.target_production = Target_Production
         self.scaling_factor = Target_Production/1000
+        self.sensitivity_dictionary = dict(Sensitivity_dictionary)
         self.model_set_up(Sensitivity_dictionary)
         self.start_time = time.time()
 
@@ -33,22 +49,12 @@ class optimiser:
         self.model_variables()
         
     def read_data(self, element, sensitivity):
-        """Imports equipment cost data based on the nominated sensitivity"""
-        #df = pd.read_csv(self.path + r'Equipment Data/' + element + r'.csv').set_index('Components')[sensitivity]
-        df = pd.read_csv(self.path + r'Equipment Data/' + element + r'.csv').set_index('Components')[sensitivity]
-        if len(df) == 1:
-            return {None: df.iloc[0]}
-        else:
-            return df.to_dict() #All in milion USD/installed MW
+        """Returns equipment cost data based on the nominated sensitivity, from the tables cached by p_cost_tables.py"""
+        return cost_tables.cost_data(element, sensitivity, self.path + r'Equipment Data') #All in milion USD/installed MW
 
     def general_model_features(self, Sensitivity_dictionary):
         """Sets up the model features that are common to all locations
         Input data to the model also stored here."""
-        #Unpack the sensitivities:
-        Finance_sensitivity = Sensitivity_dictionary['Finance']
-        Production_sensitivity = Sensitivity_dictionary['Production']
-        Storage_sensitivity = Sensitivity_dictionary['Storage']        
-        
         # Key sets (non-location specific)      
         self._renewables = ['Solar', 'Wind']
         self._components = ['Elec', 'HB+ASU', 'Battery']
@@ -60,9 +66,7 @@ class optimiser:
         # Constants not used in the optimisation model but required for pre- or post-processing of results
             
         self.G_operating_years = 30
-        self.G_discount_rate_general = self.read_data('Finance', Finance_sensitivity)[None]
         self.AUD_to_USD = 0.7  # AUD/USD
-        self.TUOS_DUOS = self.read_data('TUOS', Production_sensitivity)[None]  # in AUD/MWh
         self.distance_factor = 1.1
         
         # Parameters depending on sets
@@ -70,16 +74,7 @@ class optimiser:
                     ('H2', 'NH3'): 17 / 3, ('pi', 'beta'): 0.98, ('H2',
                                                                   'gamma'): 0.6 * 141 / 3.6 / 1}  # Materials
         # in t, powers in MW, ammonia energy demand and fuel cell efficiency from Nayak-Luke 2020
-        self._Cost_components = self.read_data('Components', Production_sensitivity) #Data in USD/MW
-        # Just added in to adjust for scale:
-        if self.target_production/0.8 < 1E6:
-            self._Cost_components['HB+ASU'] = self._Cost_components['HB+ASU']*(self.target_production/0.8/8E4)**0.7/(self.target_production/0.8/8E4)
-        else:
-            self._Cost_components['HB+ASU'] = self._Cost_components['HB+ASU']#*(1E6/8E4)**0.7/(1E6/8E4)
-        self._Cost_storage = self.read_data('Storage Components', Storage_sensitivity) # Data in USD/MWh or USD/t
-        self._Cost_FC = self.read_data('FC', Storage_sensitivity) #Data in USD/MW
-        self._Cost_renewables = self.read_data('Renewables', Production_sensitivity) #in Million USD/MW See # https://irena.org/-/media/Files/IRENA/Agency/Publication/2020/Jun/IRENA_Power_Generation_Costs_2019.pdf 
-        #for base costs (p 65 for solar for Australia, p53 for wind, general to Oceania)
+        self.set_costs(Sensitivity_dictionary)
         
         #For grid data references see x_transmission comparison
         #All costs in AUD
@@ -90,27 +85,71 @@ class optimiser:
         # million USD for connection; scaled because it is an integer variable
 
         # Constants (not included in parameters function betcause the value needs to be set here)
-        self.model.G_production = pm.Param(
-            initialize=self.target_production / self.scaling_factor)  # t/year, target production same for all cases
+        self.G_production = self.target_production / self.scaling_factor  # t/year, target production same for all cases
+        self.model.G_production = pm.Param(initialize=self.G_production)
         
-        self.model.G_annual_hours = pm.Param(initialize=8760 - 2 * 168)  # Assumes 2 weeks off per year for maintenance
+        self.G_annual_hours = 8760 - 2 * 168  # Assumes 2 weeks off per year for maintenance
+        self.model.G_annual_hours = pm.Param(initialize=self.G_annual_hours)
         self._storage_component_units = {'Battery': 'MWh', 'Hydrogen': 't'}
         
         # LCOA input parameters
-        self.model.O_and_M = pm.Param(initialize=0.02)  # For all components
-        self.model.ramp_up = pm.Param(initialize=0.02)  # For all components
-        self.model.ramp_down = pm.Param(initialize=0.2)  # For all components
-        self.model.water_cost = pm.Param(initialize=2E-6)  # millions of USD/t
-        self.model.water_consumption = pm.Param(initialize=9)
-        G_crf = self.G_discount_rate_general * (1 + self.G_discount_rate_general) ** self.G_operating_years / (
+        self.O_and_M = 0.02  # For all components
+        self.ramp_up = 0.02  # For all components
+        self.ramp_down = 0.2  # For all components
+        self.water_cost = 2E-6  # millions of USD/t
+        self.water_consumption = 9
+        self.model.O_and_M = pm.Param(initialize=self.O_and_M)
+        self.model.ramp_up = pm.Param(initialize=self.ramp_up)
+        self.model.ramp_down = pm.Param(initialize=self.ramp_down)
+        self.model.water_cost = pm.Param(initialize=self.water_cost)
+        self.model.water_consumption = pm.Param(initialize=self.water_consumption)
+        self.model.G_crf = pm.Param(initialize=self.G_crf, mutable=True)
+
+    def set_costs(self, Sensitivity_dictionary):
+        """Reads the costs for the nominated sensitivities (and the current target production)"""
+        #Unpack the sensitivities:
+        Finance_sensitivity = Sensitivity_dictionary['Finance']
+        Production_sensitivity = Sensitivity_dictionary['Production']
+        Storage_sensitivity = Sensitivity_dictionary['Storage']        
+
+        self.G_discount_rate_general = self.read_data('Finance', Finance_sensitivity)[None]
+        self.TUOS_DUOS = self.read_data('TUOS', Production_sensitivity)[None]  # in AUD/MWh
+        self._Cost_components = self.read_data('Components', Production_sensitivity) #Data in USD/MW
+        # Just added in to adjust for scale:
+        if self.target_production/0.8 < 1E6:
+            self._Cost_components['HB+ASU'] = self._Cost_components['HB+ASU']*(self.target_production/0.8/8E4)**0.7/(self.target_production/0.8/8E4)
+        else:
+            self._Cost_components['HB+ASU'] = self._Cost_components['HB+ASU']#*(1E6/8E4)**0.7/(1E6/8E4)
+        self._Cost_storage = self.read_data('Storage Components', Storage_sensitivity) # Data in USD/MWh or USD/t
+        self._Cost_FC = self.read_data('FC', Storage_sensitivity) #Data in USD/MW
+        self._Cost_renewables = self.read_data('Renewables', Production_sensitivity) #in Million USD/MW See # https://irena.org/-/media/Files/IRENA/Agency/Publication/2020/Jun/IRENA_Power_Generation_Costs_2019.pdf 
+        #for base costs (p 65 for solar for Australia, p53 for wind, general to Oceania)
+        self.G_crf = self.G_discount_rate_general * (1 + self.G_discount_rate_general) ** self.G_operating_years / (
                 (1 + self.G_discount_rate_general) ** self.G_operating_years - 1)
-        self.model.G_crf = pm.Param(initialize=G_crf)
+
+    def set_scenario(self, Sensitivity_dictionary, Target_Production = None):
+        """Switches the optimiser to other cost sensitivities and (optionally) another target production without
+        rebuilding the model. Call specific_model_features again afterwards, then update_instance and update_costs to
+        move an existing instance over"""
+        if Target_Production is not None:
+            self.target_production = Target_Production
+            self.scaling_factor = Target_Production/1000
+        self.sensitivity_dictionary = dict(Sensitivity_dictionary)
+        self.set_costs(Sensitivity_dictionary)
+
+    def update_costs(self, instance):
+        """Updates the cost parameters of an instance to the current sensitivities (see set_scenario); the model structure
+        does not change, so a persistent solver only updates objective coefficients"""
+        instance.G_crf.set_value(self.G_crf)
 
     def specific_model_features(self, location, grid_sale):
         """Sets up the model to be location specific (i.e. gets data for the list of hours)"""
         # Set up the timer
         
         #Luke - this should all be obselete to you except for self.interpret_profile()
+        if location.grid_on != self.grid_on:
+            raise ValueError("The location has grid_on = {a} but the model was built with grid_on = {b}".format(
+                a = location.grid_on, b = self.grid_on))
         self.location = location
         self.transmission_type = 'HV'
         self.transmission_efficiency = 1
@@ -134,15 +173,20 @@ class optimiser:
         self._grid_power_cost_no_TUOS = {}
         self._t_weights = {}
         # Interpret profile as a dictionary
-        self._times = pm.RangeSet(len(self.location.hourly_data))
+        profile = self.location.concat
+        weights = profile['Weights'].tolist()
+        powers = {renewable: profile[renewable].tolist() for renewable in self.location.renewables}
+        if self.location.grid_on:
+            grid = profile['Grid'].tolist()
+        self._times = pm.RangeSet(len(profile))
         for time in self._times:
-            self._t_weights[time] =  self.location.concat['Weights'].iloc[time-1]
+            self._t_weights[time] =  weights[time-1]
             for renewable in self.location.renewables:
-                self._powers[(renewable, time)] = self.location.concat[renewable].iloc[time-1]
+                self._powers[(renewable, time)] = powers[renewable][time-1]
             if self.location.grid_on:
-                self._grid_power_cost[time] = (self.location.concat['Grid'].iloc[time-1]\
+                self._grid_power_cost[time] = (grid[time-1]\
                      + self.TUOS_DUOS)/self.transmission_efficiency * self.AUD_to_USD * 1E-6
-                self._grid_power_cost_no_TUOS[time] = self.location.concat['Grid'].iloc[time-1]*self.transmission_efficiency * self.AUD_to_USD * 1E-6
+                self._grid_power_cost_no_TUOS[time] = grid[time-1]*self.transmission_efficiency * self.AUD_to_USD * 1E-6
             else:
                 self._grid_power_cost[time] = 1
                 self._grid_power_cost_no_TUOS[time] =1
@@ -182,8 +226,9 @@ class optimiser:
         self.model.pi = pm.Var(self.model.Components, self.model.t, bounds=(0, 5))
         self.model.beta = pm.Var(self.model.Components, self.model.t, bounds=(0, 5))
         self.model.gamma = pm.Var(self.model.Components, self.model.t, bounds=(0, 5))
-        self.model.eta_in = pm.Var(self.model.t, bounds=(0,0.175))
-        self.model.eta_out = pm.Var(self.model.t, bounds=(0,0.175))
+        if self.grid_on:
+            self.model.eta_in = pm.Var(self.model.t, bounds=(0,0.175))
+            self.model.eta_out = pm.Var(self.model.t, bounds=(0,0.175))
         self.model.curtailed = pm.Var(self.model.t, bounds = (0,5))
         self.model.storage_volume = pm.Var(self.model.StorageComponents, self.model.t, bounds=(0, 1E4))
 
@@ -200,8 +245,9 @@ class optimiser:
         self.model.FC_Cap = pm.Constraint(self.model.t, rule=cons._FC_Cap)
         self.model.FC_limit = pm.Constraint(self.model.t, rule=cons._FC_limit)
         self.model.Battery_limit = pm.Constraint(self.model.t, rule=cons._Battery_limit)
-        self.model.grid_power_limit_in = pm.Constraint(self.model.t, rule=cons._grid_power_limit_in)
-        self.model.grid_power_limit_out = pm.Constraint(self.model.t, rule=cons._grid_power_limit_out)
+        if self.grid_on:
+            self.model.grid_power_limit_in = pm.Constraint(self.model.t, rule=cons._grid_power_limit_in)
+            self.model.grid_power_limit_out = pm.Constraint(self.model.t, rule=cons._grid_power_limit_out)
 
     def create_data(self):
         """Creates a data dictionary which can be loaded into an instance"""
@@ -213,17 +259,15 @@ class optimiser:
                             't_weights': self._t_weights, 'grid_max_use': {None: self._grid_max_use},
                             'grid_max_sale': {None: self._grid_max_sale}, 'grid_max_use': {None: self._grid_max_use},
                             'grid_power_cost_no_TUOS': self._grid_power_cost_no_TUOS}}
+
+    def bound_weight(self):
+        """The weight used to scale the upper bounds of the per-timestep variables: the largest timestep weight"""
+        return max(self._t_weights.values())
+
     def create_instance(self):
         """Creates an instance of the model"""
         instance = self.model.create_instance(self.data)
-
-        max_weight = max(self._t_weights)
-        instance.pi.setub(5*max_weight)
-        instance.beta.setub(5*max_weight)
-        instance.gamma.setub(5*max_weight)
-        instance.eta_in.setub(0.175*max_weight)
-        instance.eta_out.setub(0.175*max_weight)
-        instance.curtailed.setub(5*max_weight)
+        self.set_bounds(instance)
 
         instance.HydrogenBalance = pm.Constraint(instance.t, rule=cons._HydrogenBalance)
         instance.BatteryBalance = pm.Constraint(instance.t, rule=cons._BatteryBalance)
@@ -232,45 +276,169 @@ class optimiser:
 
         return instance
 
-    def update_instance(self, instance):
-        """Updates the instance with new data specific to the location"""
+    def set_bounds(self, instance):
+        """Scales the upper bounds of the per-timestep variables to the largest timestep weight"""
+        max_weight = self.bound_weight()
+        instance.pi.setub(5*max_weight)
+        instance.beta.setub(5*max_weight)
+        instance.gamma.setub(5*max_weight)
+        if self.grid_on:
+            instance.eta_in.setub(0.175*max_weight)
+            instance.eta_out.setub(0.175*max_weight)
+        instance.curtailed.setub(5*max_weight)
 
-        instance.power_supply.clear()
-        instance.power_supply._constructed = False
-        instance.power_supply.construct(self._powers)
+    def instance_key(self):
+        """Identifies the instances that update_instance can move between: the same plant, costs and number of timesteps"""
+        return (type(self).__name__, self.target_production, tuple(sorted(self.sensitivity_dictionary.items())),
+                len(self._times), self.location.grid_on)
 
-        instance.grid_power_cost.clear()
-        instance.grid_power_cost._constructed = False
-        instance.grid_power_cost.construct(self._grid_power_cost)
-        
-        instance.grid_power_cost_no_TUOS.clear()
-        instance.grid_power_cost_no_TUOS._constructed = False
-        instance.grid_power_cost_no_TUOS.construct(self._grid_power_cost_no_TUOS)
-        
-        instance.t_weights.clear()
-        instance.t_weights._constructed = False
-        instance.t_weights.construct(self._t_weights)
-
-        delete_list = ['PowerBalance', 'PowerBalance_index','HydrogenBalance', 'HydrogenBalance_index', 'BatteryBalance', 'BatteryBalance_index',
-                       'NH3_ramp_down', 'NH3_ramp_down_index', 'NH3_ramp_up', 'NH3_ramp_up_index']
-        for element in delete_list:
-            instance.del_component(element)
-        instance.PowerBalance = pm.Constraint(instance.t, rule=cons._PowerBalance)
-        instance.HydrogenBalance = pm.Constraint(instance.t, rule=cons._HydrogenBalance)
-        instance.BatteryBalance = pm.Constraint(instance.t, rule=cons._BatteryBalance)
+    def update_instance(self, instance):
+        """Updates an instance built for another location (with the same instance_key) in place with the data for this
+        location. Everything location specific is a mutable parameter, so only parameter values and variable bounds change
+        and no constraint is rebuilt; a persistent solver attached to the instance (see use_persistent_solver) then only
+        updates the affected coefficients and bounds, and starts from its previous basis (see reuse_persistent_solver)"""
+        if len(instance.t) != len(self._times):
+            raise ValueError("update_instance needs the same number of timesteps as the instance; create a new instance instead")
+        instance.power_supply.store_values(self._powers)
+        instance.grid_power_cost.store_values(self._grid_power_cost)
+        instance.grid_power_cost_no_TUOS.store_values(self._grid_power_cost_no_TUOS)
+        instance.t_weights.store_values(self._t_weights)
+        instance.total_days.set_value(self.location.total_days)
+        instance.grid_max_use.set_value(self._grid_max_use)
+        instance.grid_max_sale.set_value(self._grid_max_sale)
+        self.set_bounds(instance)
+
+    def set_solver_threads(self, solver_threads):
+        """Recreates the solver limited to solver_threads threads (None for the solver's default)"""
+        self.solver_threads = solver_threads
+        self.opt = solvers.make_solver(self.solver, threads = solver_threads, lp = not self.grid_on)
+
+    def use_persistent_solver(self, options = None):
+        """Swaps the solver for the persistent version of the backend, which keeps the model it was last given in memory.
+        Solving an instance again after update_instance then only sends the changes (see reuse_persistent_solver).
+        options are added to the backend's own options"""
+        self.opt = solvers.make_solver(self.solver, persistent = True, threads = self.solver_threads, options = options)
+        # appsi passes warm starts as a primal solution, which HiGHS takes in place of its basis: only a MIP gains from it
+        self.warmstart = self.grid_on
+
+    def reuse_persistent_solver(self, opt = None):
+        """Readies the persistent solver (opt, or the current one) to solve an instance it has solved before again, after
+        update_instance or update_costs. The solver kept the basis of that solve, so an LP is re-solved with the backend's
+        RESOLVE_OPTIONS (simplex for HiGHS), which start from it"""
+        if opt is not None:
+            self.opt = opt
+        self.warmstart = self.grid_on
+        if not self.grid_on:
+            self.opt.options.update(solvers.RESOLVE_OPTIONS.get(self.solver, {}))
 
     def solve_model(self, instance):
-        """Solves the model, and checks that it reached an optimal solution"""
-        sol = self.opt.solve(instance, tee=False, warmstart=False)
+        """Solves the model, and checks that it reached an optimal solution. The time taken and the solver's iteration
+        count (see solver_iterations) are kept in self.solve_time and self.iterations"""
+        solve_start = time.time()
+        try:
+            sol = self.opt.solve(instance, tee=False, warmstart=self.warmstart)
+        except RuntimeError: #The appsi solvers raise instead of returning when there is no solution to load
+            sol = None
+        self.solve_time = time.time() - solve_start
+        self.iterations = self.solver_iterations()
+        if getattr(self, '_cold_options', None) is not None: #Undo warm_start's switch to simplex
+            self.opt.options.update(self._cold_options)
+            self._cold_options = None
         #instance.display("Results.csv") #Only used if you want to check the results
-        if sol.solver.termination_condition != pm.TerminationCondition.optimal:
+        if sol is None or sol.solver.termination_condition != pm.TerminationCondition.optimal:
             print('\nThe instance did not converge properly')
             self.converged = False
         else:
             self.converged = True
 
+    def solver_iterations(self):
+        """Simplex, interior point and crossover iterations of the last solve added up, if the solver is HiGHS (the appsi
+        solver keeps its highspy model as _solver_model); None for other solvers"""
+        highs = getattr(self.opt, '_solver_model', None)
+        if highs is None:
+            return None
+        info = highs.getInfo()
+        return sum(max(0, count) for count in (info.simplex_iteration_count, info.ipm_iteration_count,
+                                               info.crossover_iteration_count))
+
+    def warm_start_data(self, instance):
+        """What another solve of a similar problem (usually a neighbouring location) needs to start from this solution:
+        the capacities and dispatch (in single precision), and the simplex basis if the solver is HiGHS"""
+        solution = self.extract_solution(instance)
+        start = {'solution': {name: np.asarray(solution[name], dtype=np.float32) for name in START_VARIABLES}}
+        highs = getattr(self.opt, '_solver_model', None)
+        if highs is not None:
+            basis = highs.getBasis()
+            if basis.valid:
+                start['basis'] = (np.array([int(status) for status in basis.col_status], dtype=np.int8),
+                                  np.array([int(status) for status in basis.row_status], dtype=np.int8))
+        return start
+
+    def warm_start(self, instance, start):
+        """Makes the next solve of instance start from start (see warm_start_data). With HiGHS the basis is loaded and the
+        solve uses simplex, since the interior point method cannot start from a basis; with a grid connection, the
+        capacities and dispatch are also set as the starting point of the MIP. Returns whether any of start was used"""
+        used = False
+        if self.grid_on:
+            for name in START_VARIABLES:
+                component = getattr(instance, name)
+                if component.ctype is pm.Var: #The capacities are parameters in the operating model
+                    component.set_values(dict(zip(component.extract_values().keys(), start['solution'][name].ravel().tolist())))
+            self.warmstart = used = True
+        if not hasattr(self.opt, '_solver_model') or 'basis' not in start:
+            return used
+        if self.opt._model is not instance:
+            self.opt.set_instance(instance) #Loads the instance into HiGHS, which the solve would otherwise do
+        else:
+            self.opt.update() #Send the changes from update_instance now, so they do not reset the basis during the solve
+        highs = self.opt._solver_model
+        columns, rows = start['basis']
+        if len(columns) != highs.getNumCol() or len(rows) != highs.getNumRow():
+            return used
+        basis = highspy.HighsBasis()
+        basis.col_status = [highspy.HighsBasisStatus(status) for status in columns.tolist()]
+        basis.row_status = [highspy.HighsBasisStatus(status) for status in rows.tolist()]
+        basis.valid = True
+        if highs.setBasis(basis) != highspy.HighsStatus.kOk:
+            return used
+        self._cold_options = {'solver': self.opt.options.get('solver', 'choose')}
+        self.opt.options['solver'] = 'simplex'
+        return True
+
+    def extract_solution(self, instance):
+        """Reads the solved values of a Pyomo instance into NumPy arrays in one pass over each component, in the layout of
+        p_matrix_model.matrix_design_model.solution: flows are (component, t) arrays and storage_volume is
+        (storage component, t). The capacities are variables in the design model and parameters in the operating one"""
+        T = len(instance.t)
+
+        def values(component, rows = None):
+            array = np.array([0 if value is None else value for value in component.extract_values().values()], dtype=float)
+            return array if rows is None else array.reshape(rows, T)
+
+        solution = {'C_power': values(instance.C_power), 'C_components': values(instance.C_components),
+                    'C_storage': values(instance.C_storage), 'C_FC': pm.value(instance.C_FC),
+                    'grid_active': pm.value(cons._grid_connection(instance)),
+                    'pi': values(instance.pi, len(self._components)), 'beta': values(instance.beta, len(self._components)),
+                    'gamma': values(instance.gamma, len(self._components)), 'curtailed': values(instance.curtailed),
+                    'storage_volume': values(instance.storage_volume, len(self._storage_components)),
+                    'power_supply': values(instance.power_supply, len(self._renewables)),
+                    't_weights': values(instance.t_weights), 'grid_power_cost': values(instance.grid_power_cost),
+                    'grid_power_cost_no_TUOS': values(instance.grid_power_cost_no_TUOS),
+                    'total_days': pm.value(instance.total_days)}
+        if self.grid_on:
+            solution['eta_in'] = values(instance.eta_in)
+            solution['eta_out'] = values(instance.eta_out)
+        else:
+            solution['eta_in'] = solution['eta_out'] = np.zeros(T)
+        return solution
+
     def store_results(self, instance):
         """Stores the results from the model into a dictionary"""
+        self.store_solution(self.extract_solution(instance))
+
+    def store_solution(self, solution):
+        """Stores the results from a solution held as a dictionary of arrays (see extract_solution and
+        p_matrix_model.matrix_design_model.solution) into a dictionary, computing every metric on whole arrays"""
         self.results['Converged'] = True
 
         # Store some location specific information
@@ -278,111 +446,80 @@ class optimiser:
         self.results['Longitude'] = self.location.longitude
         self.results['Aggregation_variable'] = self.location.aggregation_variable
         self.results['Aggregation_mode'] = self.location.aggregation_mode
+        self.results['Variance retained'] = round(self.location.aggregation_report['Variance retained'], 4)
+        self.results['Duration curve error'] = round(self.location.aggregation_report['Duration curve error'], 4)
         self.results['Production'] = self.target_production
-        self.results['Max weight'] = max(pm.value(instance.t_weights[t]) for t in instance.t.data())
-        self.results['Total time'] = sum(pm.value(instance.t_weights[t]) for t in instance.t.data())
+        weights = solution['t_weights']
+        self.results['Max weight'] = weights.max()
+        self.results['Total time'] = weights.sum()
 
         # Store Wind and Solar
-        for Renewable in instance.Renewables:
-            self.results[Renewable] = round(pm.value(instance.C_power[Renewable] * self.scaling_factor), 2)
+        for count, Renewable in enumerate(self._renewables):
+            self.results[Renewable] = round(solution['C_power'][count] * self.scaling_factor, 2)
 
         # Store electrolyser, Battery and HB capacities (Also calculate and store load factors)
-        for Component in instance.Components:
-            Capacity = pm.value(instance.C_components[Component])
-            LF = 0
-            for t in instance.t.data():
-                LF += pm.value(
-                    (instance.pi[Component, t] + instance.beta[Component, t] + instance.gamma[
-                        Component, t]))
+        flows = solution['pi'] + solution['beta'] + solution['gamma']
+        for count, Component in enumerate(self._components):
+            Capacity = solution['C_components'][count]
+            LF = flows[count].sum()
             if LF > 0 and Capacity > 0:
-                LF /= (self.results['Total time']*Capacity/100)
-                LF = round(LF, 2)
+                LF = round(LF / (self.results['Total time']*Capacity/100), 2)
             else:
                 LF = 'N/A'
             self.results[str(Component) + ' LF'] = LF
             self.results[Component] = round(Capacity * self.scaling_factor, 2)
-            
+
         # Store Storage component capacities
-        for StorageComponent in instance.StorageComponents:
+        for count, StorageComponent in enumerate(self._storage_components):
             self.results[str(StorageComponent) + ' storage capacity'] = round(
-                pm.value(instance.C_storage[StorageComponent]) * self.scaling_factor, 2)
+                solution['C_storage'][count] * self.scaling_factor, 2)
 
         # Store HB Fuel Cell data
-        Capacity = pm.value(instance.C_FC)
+        Capacity = solution['C_FC']
         if Capacity > 0:
-            LF = 0
-            for t in instance.t.data():
-                LF += sum(pm.value(instance.gamma[Component, t]) for Component in instance.Components)
-            LF /= (self.results['Total time'] * Capacity / 100)
-            self.results['FC LF'] = round(LF, 2)
+            self.results['FC LF'] = round(solution['gamma'].sum() / (self.results['Total time'] * Capacity / 100), 2)
         else:
             self.results['FC LF'] = 0
         self.results['FC Capacity'] = round(Capacity * self.scaling_factor, 2)
 
         # Store grid connection data
-        self.results['Grid Active'] = pm.value(instance.grid_active)
+        self.results['Grid Active'] = solution['grid_active']
         if self.results['Grid Active']:
-            self.results['Grid Fraction'] = round(sum(pm.value(instance.eta_in[t])
-                                            for t in instance.t)*100/sum(pm.value(instance.pi[Component, t])
-                                            for Component in instance.Components for t in instance.t),2)
-                                            
+            self.results['Grid Fraction'] = round(solution['eta_in'].sum()*100/solution['pi'].sum(), 2)
+
         #Estimate Curtailment
-        if sum(pm.value(instance.power_supply[Renewable, t])*
-                                         pm.value(instance.C_power[Renewable]) for Renewable in instance.Renewables
-                                         for t in instance.t) > 0:
-            self.results['Curtailed'] = sum(pm.value(instance.curtailed[t])
-                                        for t in instance.t)/\
-                                    sum(pm.value(instance.power_supply[Renewable, t])*
-                                         pm.value(instance.C_power[Renewable]) for Renewable in instance.Renewables
-                                         for t in instance.t)
+        supplied = (solution['power_supply'] * solution['C_power'][:, None]).sum()
+        if supplied > 0:
+            self.results['Curtailed'] = solution['curtailed'].sum()/supplied
         else:
             self.results['Curtailed'] = 0
-        
+
         # Report Storage volume
-        H2_storage = []
-        Battery_storage = []
-        Ammonia_production = []
-        eta_in = []
-        eta_out = []
-        total_carbon = 0
-        carbon_avoided = 0
-        for t in instance.t.data():
-            eta_in.append(pm.value(instance.eta_in[t] * self.scaling_factor))
-            eta_out.append(pm.value(instance.eta_out[t] * self.scaling_factor))
-            H2_storage.append(
-                round(pm.value(instance.storage_volume[('Hydrogen', t)]) * self.scaling_factor, 2))
-            Battery_storage.append(
-                round(pm.value(instance.storage_volume[('Battery', t)]) * self.scaling_factor, 2))
-            Ammonia_production.append(round((pm.value(instance.pi[('HB+ASU', t)]) + pm.value(
-                instance.beta[('HB+ASU', t)]) + pm.value(
-                instance.gamma[('HB+ASU',  t)])) / pm.value(instance.C_components['HB+ASU']), 3))
-        self.results['Hydrogen Storage'] = H2_storage
-        self.results['Battery Storage'] = Battery_storage
-        self.results['Ammonia Production'] = Ammonia_production
-        
+        hydrogen = self._storage_components.index('Hydrogen')
+        battery = self._storage_components.index('Battery')
+        hb = self._components.index('HB+ASU')
+        self.results['Hydrogen Storage'] = np.round(solution['storage_volume'][hydrogen] * self.scaling_factor, 2).astype(np.float32)
+        self.results['Battery Storage'] = np.round(solution['storage_volume'][battery] * self.scaling_factor, 2).astype(np.float32)
+        self.results['Ammonia Production'] = np.round(flows[hb] / solution['C_components'][hb], 3).astype(np.float32)
+        self.results['eta_in'] = (solution['eta_in'] * self.scaling_factor).astype(np.float32)
+        self.results['eta_out'] = (solution['eta_out'] * self.scaling_factor).astype(np.float32)
+        self.results['Timestep start'] = self.location.timestep_times
+
         #Estimate power cost and revenue
-        power_cost = 0
-        power_revenue = 0
-        for t in instance.t:
-            if pm.value(instance.grid_power_cost[t]) < 0:
-                power_revenue -= pm.value(instance.grid_power_cost[t]/instance.t_weights[t]) * pm.value(instance.eta_in[t])
-            else:
-                power_cost += pm.value(instance.grid_power_cost[t]/instance.t_weights[t]) * pm.value(instance.eta_in[t])
-                power_revenue += pm.value(instance.grid_power_cost_no_TUOS[t]/instance.t_weights[t]) * pm.value(instance.eta_out[t])
+        buying = solution['grid_power_cost'] / weights * solution['eta_in']
+        selling = solution['grid_power_cost_no_TUOS'] / weights * solution['eta_out']
+        negative = solution['grid_power_cost'] < 0
+        power_cost = buying[~negative].sum()
+        power_revenue = selling[~negative].sum() - buying[negative].sum()
         self.results['Power cost'] = power_cost*self.scaling_factor
         self.results['Power revenue'] = power_revenue*self.scaling_factor
         if power_revenue != 0 or power_cost != 0:
-            self.results['LCOE'] = (power_cost)*1E6/(sum(pm.value(instance.eta_in[t])
-                                                            for t in instance.t))
+            self.results['LCOE'] = (power_cost)*1E6/solution['eta_in'].sum()
 
         self.results['Solve time'] = round(time.time() - self.start_time, 2)
         self.start_time = time.time()
-        #fig, ax1 = plt.subplots()
-        #ax1.plot([t for t in instance.t.data()], [i/max(Ammonia_production) for i in Ammonia_production])
-        #ax1.set_ylim([0,1.2])
-        #plt.show()
         print('The time taken to run this case was ' + str(self.results['Solve time']) + ' s')
-        print('The total days were {a}'.format(a = pm.value(instance.total_days)))
+        print('The total days were {a}'.format(a = solution['total_days']))
 
     def store_non_converged_results(self):
             """Store some data for a case that didn't converge"""
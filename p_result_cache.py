@@ -0,0 +1,127 @@
+"""Keeps the results of driver.driver on disk, one pickle file per run, named by a hash of everything the run depends on:
+the profile of the location, the design years and aggregation, the cost tables read by the optimisers (see
+p_cost_tables.py), the settings of the design and operating classes (target production, sensitivities, backend...) and
+the source code of the modules that solve a run. A sweep run again, or with only some locations, costs or settings changed, then only
+solves the runs whose hash is new. The least recently used files are deleted once the directory grows past max_size"""
+import os
+import glob
+import pickle
+import hashlib
+import tempfile
+import functools
+import numpy as np
+import p_cost_tables as cost_tables
+
+
+# Directory the results are kept in, if any; set DRIVER_CACHE to use one without changing any code
+CACHE_DIRECTORY = os.environ.get('DRIVER_CACHE')
+
+# Size the directory is trimmed back to after each result is added, in MB
+MAX_SIZE = float(os.environ.get('DRIVER_CACHE_SIZE', 1024))
+
+# Optimiser attributes that change the result of a run, where the class has them
+SETTINGS = ('target_production', 'sensitivity_dictionary', 'grid_on', 'solver', 'backend', 'HB_min', 'window',
+            'overlap', 'storage_value')
+
+# Results that describe how a run was solved rather than its result, which a stored result doesn't keep
+SOLVE_RECORDS = ('Warm start', 'Warm started', 'Solver iterations', 'Solve time')
+
+# Modules whose code changes the result of a run. Scripts, stores and caches (__main__, p_sweep, p_data_store...) only
+# decide where results go, so editing them keeps the stored results
+SOLVE_MODULES = ('p_driver', 'p_location_class', 'p_aggregation', 'p_optimisation_parent', 'p_optimisation_designer',
+                 'p_optimisation_operator', 'p_rolling_horizon', 'p_constraints', 'p_matrix_model', 'p_benders',
+                 'p_solvers')
+
+
+@functools.lru_cache(maxsize = None)
+def code_version(directory = os.path.dirname(os.path.abspath(__file__))):
+    """Hash of the SOLVE_MODULES in directory, so results go stale whenever the code that solves them changes"""
+    digest = hashlib.sha256()
+    for module in SOLVE_MODULES:
+        digest.update(module.encode())
+        with open(os.path.join(directory, module + '.py'), 'rb') as file:
+            digest.update(file.read())
+    return digest.hexdigest()
+
+
+def settings(optimiser):
+    """The class and SETTINGS of an optimiser, as text"""
+    if optimiser is None:
+        return 'None'
+    values = {name: getattr(optimiser, name) for name in SETTINGS if hasattr(optimiser, name)}
+    values = {name: sorted(value.items()) if isinstance(value, dict) else value for name, value in values.items()}
+    return type(optimiser).__name__ + repr(sorted(values.items()))
+
+
+def run_key(location, design_class, design_years, aggregation_variable, aggregation_mode, operating_class = None,
+            operating_years = None):
+    """Hash of everything a driver run depends on, for a location already loaded (see p_location_class.renewable_data)"""
+    digest = hashlib.sha256()
+    for renewable in sorted(location.data):
+        digest.update(renewable.encode())
+        digest.update(np.ascontiguousarray(location.data[renewable], dtype = float).tobytes())
+    digest.update(np.asarray(location.hourly_data, dtype = 'datetime64[ns]').tobytes())
+    digest.update(repr((round(float(location.latitude), 6), round(float(location.longitude), 6), location.ragged_tail,
+                        list(design_years), aggregation_variable, aggregation_mode,
+                        None if operating_years is None else list(operating_years))).encode())
+    tables = cost_tables.cost_tables(design_class.path + r'Equipment Data', cost_tables.CACHE_FILE)
+    for element in sorted(tables):
+        digest.update(element.encode())
+        digest.update(tables[element].to_csv().encode())
+    digest.update(settings(design_class).encode())
+    digest.update(settings(operating_class).encode())
+    digest.update(code_version().encode())
+    return digest.hexdigest()
+
+
+def _file_name(directory, key):
+    return os.path.join(directory, key + '.pickle')
+
+
+def load(directory, key):
+    """The result stored under key, or None. Marks the file as just used, for trim"""
+    file_name = _file_name(directory, key)
+    try:
+        with open(file_name, 'rb') as file:
+            result = pickle.load(file)
+        os.utime(file_name)
+    except (OSError, pickle.UnpicklingError, EOFError):
+        return None # Missing, deleted by another process or half written - the run is just solved again
+    return result
+
+
+def store(directory, key, result, max_size = MAX_SIZE):
+    """Stores a result under key, without SOLVE_RECORDS, then trims the directory to max_size MB. The file is written
+    under a temporary name and moved into place, so processes sharing the directory never read part of one"""
+    os.makedirs(directory, exist_ok = True)
+    result = {name: value for name, value in result.items() if name not in SOLVE_RECORDS}
+    handle, temporary_name = tempfile.mkstemp(dir = directory, suffix = '.tmp')
+    try:
+        with os.fdopen(handle, 'wb') as file:
+            pickle.dump(result, file, protocol = pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary_name, _file_name(directory, key))
+    except BaseException:
+        if os.path.exists(temporary_name):
+            os.remove(temporary_name)
+        raise
+    trim(directory, max_size)
+
+
+def trim(directory, max_size = MAX_SIZE):
+    """Deletes the least recently used results until those left take up no more than max_size MB"""
+    files = []
+    for file_name in glob.glob(os.path.join(directory, '*.pickle')):
+        try:
+            status = os.stat(file_name)
+        except FileNotFoundError:
+            continue
+        files.append((status.st_mtime, status.st_size, file_name))
+    size = sum(file[1] for file in files)
+    for _, file_size, file_name in sorted(files):
+        if size <= max_size * 1E6:
+            break
+        try:
+            os.remove(file_name)
+        except FileNotFoundError:
+            pass # Already trimmed by another process
+        size -= file_size
@@ -0,0 +1,212 @@
+"""Operates a designed plant over a long horizon as a series of short windows instead of one LP over the whole horizon.
+By default windows are a week long and overlap by a day: each window is solved, only its first week less a day is kept,
+and the hydrogen and battery storage and the ammonia production rate at that point become the starting state of the
+next window. With a pool, the windows are solved in parallel, then their kept parts are solved again in parallel, tied
+to the states the first pass left at their boundaries (see location_optimise_rolling.operate)"""
+import numpy as np
+import pyomo.environ as pm
+import p_constraints as cons
+from p_optimisation_operator import location_optimise_operation
+
+
+# Parts of a solution (see optimiser.extract_solution) that hold one value per timestep, along their last axis
+TIME_SERIES = ('pi', 'beta', 'gamma', 'curtailed', 'storage_volume', 'power_supply', 't_weights', 'grid_power_cost',
+               'grid_power_cost_no_TUOS', 'eta_in', 'eta_out')
+
+# Default value of what is left in storage at the end of a window, relative to the ammonia it could make (see
+# p_constraints._RollingProduction)
+STORAGE_VALUE = 1.0
+
+# Window instances kept by each process, by optimiser.instance_key() (which includes the window length)
+_window_instances = {}
+
+
+class location_optimise_rolling(location_optimise_operation):
+    """Class designed for operating an ammonia plant over a long profile in overlapping windows. window and overlap are
+    in hours, and are converted to timesteps of the aggregated profile"""
+
+    def __init__(self, Target_Production, Sensitivity_dictionary = {'Production': 'Base', 'Storage': 'Base', 'Finance': 'Base', 'Year': 'Base'}, window = 168, overlap = 24, storage_value = STORAGE_VALUE, solver = None, solver_threads = None, grid_on = False):
+        """Store the location data in the class and create the model and its solver. storage_value is the value put on
+        what is left in storage at the end of each window, relative to the ammonia it could make"""
+        self.storage_value = storage_value
+        if overlap >= window:
+            raise ValueError("The overlap ({a} h) must be shorter than the window ({b} h)".format(a = overlap, b = window))
+        super().__init__(Target_Production, Sensitivity_dictionary, solver = solver, solver_threads = solver_threads,
+                         grid_on = grid_on)
+        self.window = window
+        self.overlap = overlap
+
+    def operating_requirements(self):
+        """Adds the state each window starts from and the production rate it ends on to the operating model. The starting
+        storage and rate are variables, so they can be left free (the first window) or fixed by their bounds. The
+        objective also values the storage left at the end of the window (see p_constraints._RollingProduction)"""
+        super().operating_requirements()
+        self.model.initial_storage = pm.Var(self.model.StorageComponents, within = pm.NonNegativeReals)
+        self.model.initial_rate = pm.Var(within = pm.NonNegativeReals)
+        self.model.initial_weight = pm.Param(within = pm.NonNegativeReals, mutable = True, initialize = 1)
+        self.model.final_rate = pm.Var(within = pm.NonNegativeReals)
+        self.model.FinalRate = pm.Constraint(rule = cons._FinalRate)
+        self.model.storage_value = pm.Param(within = pm.NonNegativeReals, mutable = True, initialize = self.storage_value)
+        self.model.del_component('obj')
+        self.model.obj = pm.Objective(rule = cons._RollingProduction, sense = pm.maximize)
+
+    def interpret_profile(self):
+        """Interprets the whole profile, then keeps it aside so that set_window can take windows out of it"""
+        super().interpret_profile()
+        self._horizon = (self._powers, self._t_weights, self._grid_power_cost, self._grid_power_cost_no_TUOS)
+        self._horizon_length = len(self._times)
+
+    def set_window(self, start, length):
+        """Makes the timesteps start + 1 to start + length of the profile the data for the next instance"""
+        powers, weights, grid_power_cost, grid_power_cost_no_TUOS = self._horizon
+        self._times = pm.RangeSet(length)
+        self._powers = {(renewable, t): powers[(renewable, start + t)] for renewable in self.location.renewables
+                        for t in self._times}
+        self._t_weights = {t: weights[start + t] for t in self._times}
+        self._grid_power_cost = {t: grid_power_cost[start + t] for t in self._times}
+        self._grid_power_cost_no_TUOS = {t: grid_power_cost_no_TUOS[start + t] for t in self._times}
+
+    def timesteps(self, hours):
+        """Number of timesteps of the profile covering hours"""
+        return max(1, int(round(hours / self.location.aggregation_variable)))
+
+    def windows(self, window = None, overlap = None):
+        """(start, length, kept) of each window in timesteps, where only the first kept timesteps of each window are used.
+        window and overlap (in hours) default to those the class was made with"""
+        length = self.timesteps(self.window if window is None else window)
+        overlap = self.overlap if overlap is None else overlap
+        step = max(1, length - (self.timesteps(overlap) if overlap > 0 else 0))
+        windows = []
+        start = 0
+        while start < self._horizon_length:
+            window_length = min(length, self._horizon_length - start)
+            last = start + window_length == self._horizon_length
+            windows.append((start, window_length, window_length if last else step))
+            if last:
+                break
+            start += step
+        return windows
+
+    def window_instance(self, equipment_capacities):
+        """Returns an instance for the current window, reusing one of the same length built earlier in this process"""
+        key = self.instance_key()
+        if key in _window_instances:
+            instance, opt = _window_instances[key]
+            self.reuse_persistent_solver(opt)
+            self.update_instance(instance)
+            self.update_capacities(instance, equipment_capacities)
+        else:
+            self.create_data(equipment_capacities)
+            instance = self.create_instance()
+            self.use_persistent_solver()
+            _window_instances[key] = (instance, self.opt)
+        return instance
+
+    def set_state(self, instance, initial = None, final = None):
+        """Fixes the state (see end_state) a window starts from, or leaves it free if initial is None, and fixes the
+        state it ends in if final is given"""
+        T = len(instance.t)
+        for StorageComponent in instance.StorageComponents:
+            if initial is None:
+                instance.initial_storage[StorageComponent].setlb(0)
+                instance.initial_storage[StorageComponent].setub(pm.value(instance.C_storage[StorageComponent]))
+            else:
+                instance.initial_storage[StorageComponent].setlb(initial[StorageComponent])
+                instance.initial_storage[StorageComponent].setub(initial[StorageComponent])
+            end = instance.storage_volume[(StorageComponent, T)]
+            end.setlb(0 if final is None else final[StorageComponent])
+            end.setub(1E4 if final is None else final[StorageComponent])
+        instance.initial_rate.setlb(None if initial is None else initial['rate'])
+        instance.initial_rate.setub(None if initial is None else initial['rate'])
+        instance.initial_weight.set_value(pm.value(instance.t_weights[1]) if initial is None else initial['weight'])
+        instance.final_rate.setlb(None if final is None else final['rate'])
+        instance.final_rate.setub(None if final is None else final['rate'])
+
+    def solve_window(self, equipment_capacities, start, length, initial = None, final = None):
+        """Solves one window and returns its solution (see optimiser.extract_solution), or None if it did not converge"""
+        self.set_window(start, length)
+        instance = self.window_instance(equipment_capacities)
+        self.set_state(instance, initial, final)
+        self.solve_model(instance)
+        if not self.converged:
+            return None
+        return self.extract_solution(instance)
+
+    def end_state(self, solution, kept):
+        """The storage and production rate at the end of the first kept timesteps of a solution"""
+        state = {StorageComponent: solution['storage_volume'][count, kept - 1]
+                 for count, StorageComponent in enumerate(self._storage_components)}
+        hb = self._components.index('HB+ASU')
+        state['weight'] = solution['t_weights'][kept - 1]
+        state['rate'] = (solution['pi'][hb] + solution['beta'][hb] + solution['gamma'][hb])[kept - 1] / state['weight']
+        return state
+
+    def operate(self, equipment_capacities, pool = None):
+        """Operates the plant fixed at equipment_capacities (see location_optimise_design.get_capacities) over the
+        whole profile loaded by specific_model_features and returns the results, as store_results would for one LP.
+        Without a pool, the windows are solved one after another, each starting from the state the last one kept.
+        With a pool, every window is first solved in parallel from a free starting state. In the coordination pass the
+        kept part of each window is solved again, in parallel, starting from the state the window before it kept and
+        ending in its own state from the first pass, so the parts join up. From the first part that cannot do both, the
+        rest are solved one after another as without a pool"""
+        self.results = {}
+        windows = self.windows()
+        pieces = []
+        state = None
+        joined = False
+        resolved = 0
+        if pool is not None:
+            self.set_solver_threads(self.solver_threads) #Workers are sent a plain solver, not this process's persistent one
+            first_pass = pool.map(solve_window_star, [(self, equipment_capacities, start, length)
+                                                      for start, length, kept in windows])
+            if all(solution is not None for solution in first_pass):
+                ends = [self.end_state(solution, kept) for solution, (start, length, kept) in zip(first_pass, windows)]
+                coordinated = pool.map(solve_window_star, [(self, equipment_capacities, start, kept,
+                                                            ends[count - 1] if count > 0 else None,
+                                                            ends[count] if count < len(windows) - 1 else None)
+                                                           for count, (start, length, kept) in enumerate(windows)])
+                joined = True
+        for count, (start, length, kept) in enumerate(windows):
+            solution = coordinated[count] if joined else None
+            if solution is None:
+                joined = False # From here on the parts no longer start where the first pass said they would
+                resolved += 1
+                solution = self.solve_window(equipment_capacities, start, length, state)
+                if solution is None:
+                    return self.store_results(None)
+            pieces.append((solution, kept))
+            state = self.end_state(solution, kept)
+        if pool is not None:
+            self.results['Windows re-solved in order'] = resolved
+        self.results['Windows'] = len(pieces)
+        return self.store_results(self.join(pieces, equipment_capacities))
+
+    def join(self, pieces, equipment_capacities):
+        """Joins the kept part of each window's solution into one solution for the whole profile"""
+        solution = dict(pieces[0][0])
+        for name in TIME_SERIES:
+            solution[name] = np.concatenate([piece[name][..., :kept] for piece, kept in pieces], axis = -1)
+        solution['total_days'] = self.location.total_days
+        solution['Production_LCOA'] = equipment_capacities['Production_LCOA']
+        return solution
+
+    def store_results(self, solution):
+        """Stores the results from a joined solution (see join), or records that a window did not converge if it is None"""
+        self.converged = solution is not None
+        if not self.converged:
+            self.results = {'Annual Production': 'NaN'}
+            return self.results
+        hb = self._components.index('HB+ASU')
+        ammonia_in = (solution['pi'][hb] + solution['beta'][hb] + solution['gamma'][hb]).sum() * self._CF[('pi', 'NH3')]
+        ammonia_out = (solution['eta_in'] * solution['grid_power_cost'] - solution['eta_out'] *
+                       solution['grid_power_cost_no_TUOS']).sum() * 1E6 / solution['Production_LCOA']
+        production = self.G_annual_hours / 24 / solution['total_days'] * (ammonia_in - ammonia_out)
+        self.results['Annual Production'] = round(float(production) * self.scaling_factor * 1E-6, 3)  # Production in Mtpa
+        self.store_solution(solution)
+        return self.results
+
+
+def solve_window_star(args):
+    """Solves one window in a worker process; args are those of location_optimise_rolling.solve_window, led by the class"""
+    rolling_class, *args = args
+    return rolling_class.solve_window(*args)
@@ -0,0 +1,142 @@
+"""Runs the cost sensitivity cases (every combination of the Production, Storage and Finance sensitivities in
+Equipment Data/, for every target production) for one location. The location profile is aggregated once per worker and
+one instance is built per worker; every other scenario only changes cost parameters (see optimiser.set_scenario and
+update_costs), so the persistent solver re-solves from the previous basis rather than rebuilding the model.
+Run as: python p_scenarios.py profile_file.nc [output_file.csv]"""
+import os
+import sys
+import time
+import numpy as np
+import xarray as xr
+from pathos.multiprocessing import ProcessPool
+import p_location_class as location_class
+import p_data_store as d_store
+import p_cost_tables as cost_tables
+import p_optimisation_designer as optimisation_designer
+import p_shared_profiles as shared_profiles
+import p_sweep as sweep
+import p_memory as memory
+
+
+SENSITIVITY_NAMES = ('Production', 'Storage', 'Finance')
+
+
+def reflected_gray_code(values, length):
+    """Every tuple of length items from values, in reflected Gray code order: consecutive tuples differ in exactly one
+    item, and only by one step through values. The last item changes fastest"""
+    codes = [()]
+    for _ in range(length):
+        codes = [code + (value,) for count, code in enumerate(codes)
+                 for value in (values if count % 2 == 0 else values[::-1])]
+    return codes
+
+
+def scenario_list(target_productions, sensitivities = cost_tables.SENSITIVITIES):
+    """Every (Target_Production, Sensitivity_dictionary) case: each combination of sensitivities for Production, Storage
+    and Finance (27 with the three columns in Equipment Data/) for each target production. The combinations run in
+    reflected Gray code order, forwards for one target production and backwards for the next, so consecutive cases
+    differ in a single sensitivity or only in target production, and each solve starts close to the last one"""
+    cases = reflected_gray_code(tuple(sensitivities), len(SENSITIVITY_NAMES))
+    return [(Target_Production, dict(zip(SENSITIVITY_NAMES, case), Year = 'Base'))
+            for count, Target_Production in enumerate(target_productions)
+            for case in (cases if count % 2 == 0 else cases[::-1])]
+
+
+def run_scenarios(weather_data, design_class, design_years, scenarios, aggregation_variable = 1,
+                  aggregation_mode = 'aggregate'):
+    """Designs the plant at one location (anything driver.driver accepts) for each of scenarios in turn and returns the
+    list of results. The profile is only aggregated once, and one instance is built and then updated for each scenario"""
+    if isinstance(weather_data, shared_profiles.profile_cell):
+        weather_data = weather_data.arrays()
+    location = location_class.renewable_data(weather_data, design_class._renewables, years_of_interest = design_years,
+                                             aggregation_variable = aggregation_variable,
+                                             aggregation_mode = aggregation_mode)
+    instance = None
+    results = []
+    for Target_Production, Sensitivity_dictionary in scenarios:
+        design_class.set_scenario(Sensitivity_dictionary, Target_Production)
+        design_class.specific_model_features(location, False)
+        if instance is None or design_class.backend != 'pyomo':
+            design_class.create_data()
+            instance = design_class.create_instance()
+            if design_class.backend == 'pyomo':
+                design_class.use_persistent_solver()
+        else:
+            design_class.reuse_persistent_solver()
+            design_class.update_instance(instance)
+            design_class.update_costs(instance)
+        design_class.solve_model(instance)
+        if design_class.converged:
+            result = dict(design_class.store_results(instance))
+        else:
+            result = dict(design_class.store_non_converged_results())
+        for name in SENSITIVITY_NAMES:
+            result[name + ' sensitivity'] = Sensitivity_dictionary[name]
+        results.append(result)
+    return results
+
+
+def run_scenarios_star(args):
+    return run_scenarios(*args)
+
+
+def scenario_sweep(weather_data, design_class, design_years, target_productions, aggregation_variable = 1,
+                   aggregation_mode = 'aggregate', sensitivities = cost_tables.SENSITIVITIES,
+                   output_file_name = 'Scenarios.csv', pool = None, processes = None, memory_budget = None,
+                   stored_data = None):
+    """Runs every case of scenario_list for one location, split into contiguous groups with one group per worker of
+    pool (made, and closed afterwards, if not given - sized as in p_sweep.sweep). Each result is stored in stored_data
+    (by default a p_data_store.Result_store next to output_file_name) under a key holding the target production and
+    sensitivities, and the results are written to output_file_name. A dataset is reduced to its first cell with wind
+    data before being sent to the workers. Returns stored_data"""
+    if isinstance(weather_data, xr.Dataset):
+        hours = int(weather_data.time.dt.year.isin(design_years).sum())
+        weather_data = next(sweep.grid_cells(weather_data))
+    elif isinstance(weather_data, dict):
+        hours = int(np.isin(weather_data['time'].astype('datetime64[Y]').astype(int) + 1970, design_years).sum())
+    else:
+        hours = 8760*len(design_years)
+    if stored_data is None:
+        stored_data = d_store.Result_store(os.path.splitext(output_file_name)[0] + '.sqlite',
+                                           series_file = os.path.splitext(output_file_name)[0] + '_series.nc')
+        stored_data.get_active_components(design_class)
+    scenarios = scenario_list(target_productions, sensitivities)
+
+    own_pool = pool is None
+    if own_pool:
+        task_memory = memory.estimate_task_memory(design_class, hours, aggregation_variable)
+        workers, solver_threads = memory.pool_size(task_memory, memory_budget, cores = processes)
+        workers = min(workers, len(scenarios))
+        design_class.set_solver_threads(solver_threads)
+        pool = ProcessPool(nodes = workers)
+    groups = [list(group) for group in np.array_split(np.arange(len(scenarios)), min(pool.nodes, len(scenarios)))]
+    print('Running {a} scenarios in {b} groups'.format(a = len(scenarios), b = len(groups)))
+
+    keys = []
+    try:
+        TASKS = [(weather_data, design_class, design_years, [scenarios[index] for index in group], aggregation_variable,
+                  aggregation_mode) for group in groups]
+        for group, results in zip(groups, pool.imap(run_scenarios_star, TASKS)):
+            for index, result in zip(group, results):
+                Target_Production, Sensitivity_dictionary = scenarios[index]
+                stored_data.add_location(result, design_years, scale = Target_Production,
+                                         sensitivity = Sensitivity_dictionary)
+                keys.append(stored_data.key)
+        stored_data.to_csv(output_file_name, keys)
+    finally:
+        if own_pool:
+            pool.close()
+            pool.join()
+            pool.clear()
+    return stored_data
+
+
+if __name__ == '__main__':
+    weather_file = sys.argv[1]
+    output_file_name = sys.argv[2] if len(sys.argv) > 2 else os.path.splitext(os.path.basename(weather_file))[0] + '_scenarios.csv'
+    start_time = time.time()
+    weather_data = xr.open_dataset(weather_file)
+    design_years = [int(weather_data.time.dt.year.values[0])]
+    scenario_sweep(weather_data, optimisation_designer.location_optimise_design(1E6), design_years, [1E6],
+                   output_file_name = output_file_name).close()
+    print('The scenarios took {a:.0f} s; results are in {b}'.format(a = time.time() - start_time, b = output_file_name))
@@ -0,0 +1,95 @@
+"""Keeps the profile cube of a sweep in memory-mapped .npy files laid out (latitude, longitude, time), so each cell is one
+contiguous block. The cube is written once by the parent process; workers open the files read-only and take zero-copy
+views of single cells by (latitude, longitude) index, so pages are shared between processes through the OS page cache
+instead of each worker holding (or being sent) its own copy of the dataset"""
+import os
+import numpy as np
+
+
+SOURCES = ('Solar', 'Wind')
+
+# Cubes opened by this process, by directory, with the stamps of the files they were opened from (see _file_stamps), so
+# each worker only opens the files once unless they are written again
+_open_cubes = {}
+
+
+def write_profiles(weather_data, directory):
+    """Writes the Solar (if present) and Wind profiles of weather_data, a dataset on a (time, latitude, longitude) grid,
+    to memory-mapped files in directory along with their coordinates, one latitude at a time. Returns the
+    (latitude index, longitude index) of every cell that has wind data"""
+    os.makedirs(directory, exist_ok = True)
+    sources = [source for source in SOURCES if source in weather_data]
+    latitudes = weather_data.latitude.values
+    longitudes = weather_data.longitude.values
+    shape = (len(latitudes), len(longitudes), len(weather_data.time))
+    cubes = {source: np.lib.format.open_memmap(os.path.join(directory, source + '.npy'), mode = 'w+',
+                                               dtype = weather_data[source].dtype, shape = shape)
+             for source in sources}
+    valid = np.zeros(shape[:2], dtype = bool)
+    for count, latitude in enumerate(latitudes):
+        row = weather_data[sources].sel(latitude = latitude).transpose('longitude', 'time').load()
+        for source in sources:
+            cubes[source][count] = row[source].values
+        valid[count] = ~np.isnan(row['Wind'].values).all(axis = 1)
+    for cube in cubes.values():
+        cube.flush()
+    np.save(os.path.join(directory, 'time.npy'), weather_data.time.values)
+    np.save(os.path.join(directory, 'latitude.npy'), latitudes)
+    np.save(os.path.join(directory, 'longitude.npy'), longitudes)
+    return [tuple(cell) for cell in np.argwhere(valid).tolist()]
+
+
+class profile_cube:
+    """Read-only view of a cube written by write_profiles"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.cubes = {source: np.load(os.path.join(directory, source + '.npy'), mmap_mode = 'r')
+                      for source in SOURCES if os.path.exists(os.path.join(directory, source + '.npy'))}
+        self.time = np.load(os.path.join(directory, 'time.npy'))
+        self.latitudes = np.load(os.path.join(directory, 'latitude.npy'))
+        self.longitudes = np.load(os.path.join(directory, 'longitude.npy'))
+
+    def cell(self, latitude_index, longitude_index):
+        """Returns one cell as the dictionary of 1D arrays renewable_data accepts; the profiles are views of the files"""
+        cell = {source: cube[latitude_index, longitude_index] for source, cube in self.cubes.items()}
+        cell.update(time = self.time, latitude = float(self.latitudes[latitude_index]),
+                    longitude = float(self.longitudes[longitude_index]))
+        return cell
+
+
+def _file_stamps(directory):
+    """Modification time and size of each file of a cube, used to tell whether it has been written again since it was
+    opened. The size changes with the shape, as every cube of a directory has the same dtype"""
+    stamps = []
+    for name in SOURCES + ('time', 'latitude', 'longitude'):
+        try:
+            status = os.stat(os.path.join(directory, name + '.npy'))
+        except FileNotFoundError:
+            continue
+        stamps.append((name, status.st_mtime_ns, status.st_size))
+    return tuple(stamps)
+
+
+def open_profiles(directory):
+    """Returns the profile_cube for directory, opening it the first time this process asks for it, and again whenever
+    its files have been rewritten (for example by a later sweep using the same profile_directory)"""
+    stamps = _file_stamps(directory)
+    if directory not in _open_cubes or _open_cubes[directory][0] != stamps:
+        _open_cubes[directory] = (stamps, profile_cube(directory))
+    return _open_cubes[directory][1]
+
+
+class profile_cell:
+    """Reference to one cell of a cube written by write_profiles; this, rather than the profiles, is what gets sent to
+    worker processes"""
+    __slots__ = ('directory', 'latitude_index', 'longitude_index')
+
+    def __init__(self, directory, latitude_index, longitude_index):
+        self.directory = directory
+        self.latitude_index = latitude_index
+        self.longitude_index = longitude_index
+
+    def arrays(self):
+        """Attaches to the cube and returns the cell's profiles (see profile_cube.cell)"""
+        return open_profiles(self.directory).cell(self.latitude_index, self.longitude_index)
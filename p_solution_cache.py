@@ -0,0 +1,127 @@
+"""Keeps the solutions of the locations solved so far in a sweep, by (latitude, longitude, scale, sensitivity), so that
+each new location can be warm started from its nearest solved neighbour (see optimiser.warm_start), and orders the cells
+of a grid along a Hilbert curve, so that consecutive cells are neighbours and a nearby solution is nearly always there"""
+import collections
+import numpy as np
+
+
+# Number of solutions (capacities, dispatch and basis) kept to start from; older ones are dropped first, as the Hilbert
+# order has usually moved away from them. The iteration counts and solve times of every location are kept for summary
+CACHE_SIZE = 64
+
+# One in this many locations that have a solved neighbour is started cold anyway, so the savings printed compare warm
+# and cold starts made during the same sweep
+COLD_SAMPLE = 10
+
+
+def hilbert_index(row, column, order):
+    """Distance along the Hilbert curve filling a 2**order by 2**order grid of the cell at (row, column)"""
+    distance = 0
+    side = 2**(order - 1)
+    while side > 0:
+        right = int(column & side > 0)
+        up = int(row & side > 0)
+        distance += side * side * ((3 * right) ^ up)
+        if up == 0: #Rotate the quadrant so the curve inside it joins up with its neighbours
+            if right == 1:
+                column, row = side - 1 - column, side - 1 - row
+            column, row = row, column
+        side //= 2
+    return distance
+
+
+def hilbert_order(indices):
+    """Order in which to visit cells given by their (latitude index, longitude index), along a Hilbert curve"""
+    if not indices:
+        return []
+    order = max(1, int(np.ceil(np.log2(max(max(pair) for pair in indices) + 1))))
+    return sorted(range(len(indices)), key = lambda count: hilbert_index(*indices[count], order))
+
+
+class solution_cache:
+    """Solutions of the locations of a sweep, to warm start their neighbours from. Each is stored from the 'Warm start' a
+    driver result carries (see driver.driver), and only locations with the same scale and sensitivity are neighbours"""
+
+    def __init__(self, size = CACHE_SIZE, cold_sample = COLD_SAMPLE):
+        self.size = size
+        self.cold_sample = cold_sample
+        self.starts = collections.OrderedDict()
+        self.records = []
+        self.lookups = 0
+
+    @staticmethod
+    def key(latitude, longitude, scale = None, sensitivity = None):
+        """(latitude, longitude, scale, sensitivity) key of a location"""
+        return (round(float(latitude), 4), round(float(longitude), 4), scale,
+                None if sensitivity is None else tuple(sorted(sensitivity.items())))
+
+    def add(self, result, scale = None, sensitivity = None):
+        """Takes the 'Warm start' out of a driver result and keeps it, with the iteration count and solve time"""
+        start = result.pop('Warm start', None)
+        if result.get('Solve time') is not None:
+            self.records.append({'Warm started': result.get('Warm started', False),
+                                 'Solver iterations': result.get('Solver iterations'), 'Solve time': result['Solve time']})
+        if start is None:
+            return
+        key = self.key(result['Latitude'], result['Longitude'], scale, sensitivity)
+        self.starts[key] = start
+        self.starts.move_to_end(key)
+        while len(self.starts) > self.size:
+            self.starts.popitem(last = False)
+
+    def nearest(self, latitude, longitude, scale = None, sensitivity = None):
+        """The kept solution nearest to a location with the same scale and sensitivity, or None if there are none.
+        Distances are in degrees, with longitude shrunk by the cosine of the latitude"""
+        _, _, scale, sensitivity = key = self.key(latitude, longitude, scale, sensitivity)
+        best, best_distance = None, np.inf
+        for (other_latitude, other_longitude, other_scale, other_sensitivity), start in self.starts.items():
+            if other_scale != scale or other_sensitivity != sensitivity:
+                continue
+            distance = np.hypot(other_latitude - key[0],
+                                (other_longitude - key[1]) * np.cos(np.radians(key[0])))
+            if distance < best_distance:
+                best, best_distance = start, distance
+        return best
+
+    def start(self, latitude, longitude, scale = None, sensitivity = None):
+        """The solution to start a location from: the nearest one (see nearest), except for every cold_sample-th
+        location that has one, which is started cold"""
+        start = self.nearest(latitude, longitude, scale, sensitivity)
+        if start is not None and self.cold_sample:
+            self.lookups += 1
+            if self.lookups % self.cold_sample == 0:
+                return None
+        return start
+
+    def summary(self):
+        """Iterations and solve times of the warm and cold started locations, and the estimated savings of the warm
+        starts: what the warm started locations would have taken at the average of the cold started ones, less what they
+        took. Iterations are only counted where the solver reports them (HiGHS). With HiGHS, cold starts use the
+        interior point method and warm starts simplex, whose iterations are far cheaper, so the iterations saved are
+        usually negative even when time is saved"""
+        summary = {}
+        for name, warm in (('Cold', False), ('Warm', True)):
+            records = [record for record in self.records if record['Warm started'] == warm]
+            iterations = [record['Solver iterations'] for record in records if record['Solver iterations'] is not None]
+            summary[name + ' started'] = len(records)
+            summary[name + ' mean iterations'] = np.mean(iterations) if iterations else None
+            summary[name + ' mean solve time'] = np.mean([record['Solve time'] for record in records]) if records else None
+        warm = summary['Warm started']
+        if warm and summary['Cold started']:
+            summary['Solve time saved'] = warm * (summary['Cold mean solve time'] - summary['Warm mean solve time'])
+            if summary['Cold mean iterations'] is not None and summary['Warm mean iterations'] is not None:
+                summary['Iterations saved'] = warm * (summary['Cold mean iterations'] - summary['Warm mean iterations'])
+        return summary
+
+    def print_summary(self):
+        summary = self.summary()
+        print('Warm starts: {a} of {b} locations started from a solved neighbour'.format(
+            a = summary['Warm started'], b = summary['Warm started'] + summary['Cold started']))
+        for name, method in (('Cold', 'interior point'), ('Warm', 'simplex')):
+            if summary[name + ' started']:
+                iterations = summary[name + ' mean iterations']
+                print('  {a} started: {b} iterations ({d} with HiGHS) and {c:.2f} s per solve on average'.format(
+                    a = name, b = 'n/a' if iterations is None else int(round(iterations)), d = method,
+                    c = summary[name + ' mean solve time']))
+        if 'Solve time saved' in summary:
+            print('  Estimated time saved against cold starts: {a:.1f} s'.format(a = summary['Solve time saved']))
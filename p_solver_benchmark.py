@@ -0,0 +1,48 @@
+"""Compares how long each installed solver backend takes to solve the design problem for the bundled WindWales.nc case.
+Run as: python p_solver_benchmark.py [aggregation_variable ...]"""
+import os
+import sys
+import time
+import xarray as xr
+import pandas as pd
+import p_location_class as location_class
+import p_optimisation_designer as optimisation_designer
+import p_solvers as solvers
+
+
+def benchmark(weather_file, aggregation_variables = (24, 6), backends = None, repeats = 1, Target_Production = 1E6):
+    """Solves the design problem for every aggregation variable with every backend in backends (all installed backends by
+    default), plus the sparse matrix model, and returns a DataFrame of build and solve times and the LCOA found"""
+    weather_data = xr.open_dataset(weather_file)
+    latitude = float(weather_data.latitude.values[0])
+    longitude = float(weather_data.longitude.values[0])
+    if backends is None:
+        backends = solvers.available_backends()
+    cases = [(backend, 'pyomo') for backend in backends] + [('highs', 'matrix')]
+
+    rows = []
+    for aggregation_variable in aggregation_variables:
+        for backend, model_backend in cases:
+            for repeat in range(repeats):
+                design = optimisation_designer.location_optimise_design(Target_Production, solver = backend,
+                                                                        backend = model_backend)
+                location = location_class.renewable_data(weather_data, design._renewables, latitude, longitude,
+                                                         aggregation_variable = aggregation_variable)
+                start_time = time.time()
+                design.specific_model_features(location, False)
+                design.create_data()
+                instance = design.create_instance()
+                build_time = time.time() - start_time
+                design.solve_model(instance)
+                solve_time = time.time() - start_time - build_time
+                LCOA = design.store_results(instance)['LCOA'] if design.converged else None
+                rows.append({'Solver': backend if model_backend == 'pyomo' else 'matrix (scipy HiGHS)',
+                             'Aggregation_variable': aggregation_variable, 'Repeat': repeat,
+                             'Build time': round(build_time, 2), 'Solve time': round(solve_time, 2), 'LCOA': LCOA})
+    return pd.DataFrame(rows)
+
+
+if __name__ == '__main__':
+    aggregation_variables = [int(argument) for argument in sys.argv[1:]] or [24, 6]
+    results = benchmark(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'WindWales.nc'), aggregation_variables)
+    print(results.groupby(['Aggregation_variable', 'Solver']).mean(numeric_only = True).drop(columns = 'Repeat'))
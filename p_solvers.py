@@ -0,0 +1,68 @@
+"""Solver backends the optimisers can use. Each backend names the Pyomo solver to use, the persistent (appsi) version of it
+used when instances are reused between locations, and the options used with it. The options are chosen to match what we
+used to run with Gurobi (Method = 3, NodeMethod = 2): an interior point/barrier solve of the root LP, with crossover so
+that a basis is available to warm start from, and barrier or dual simplex for the rest"""
+import pyomo.environ as pm
+
+
+SOLVER_BACKENDS = {'highs': {'solver': 'appsi_highs', 'persistent': 'appsi_highs',
+                             'options': {'solver': 'ipm', 'run_crossover': 'on', 'presolve': 'on'}},
+                   'cbc': {'solver': 'cbc', 'persistent': None,
+                           'options': {'barrier': ''}}, # Barrier (with crossover) on the root, dual simplex in the tree
+                   'glpk': {'solver': 'glpk', 'persistent': None,
+                            'options': {}}, # GLPK only offers simplex for problems with integer variables
+                   'gurobi': {'solver': 'gurobi', 'persistent': 'appsi_gurobi',
+                              'options': {'Method': 3, 'NodeMethod': 2}}}
+
+# Options replacing the above when the model is a pure LP (no grid connection) and is solved from scratch: barrier alone,
+# without crossover to a basis or any branching. Persistent solvers keep crossover, so that their re-solves (see
+# RESOLVE_OPTIONS) have a basis to start from.
+# HiGHS keeps crossover: without it, its interior point solver can stop with an unknown status on the operating model
+LP_OPTIONS = {'gurobi': {'Method': 2, 'Crossover': 0}}
+
+# Options replacing the above when a persistent solver re-solves an LP it has solved before, with only some coefficients,
+# bounds or costs changed: simplex starts from the basis the solver kept, which the interior point method cannot use
+RESOLVE_OPTIONS = {'highs': {'solver': 'simplex'}}
+
+# Order in which backends are tried when none is named; all of these are free to run on as many cores as we like
+DEFAULT_BACKENDS = ('highs', 'cbc', 'glpk')
+
+# Name of the option each backend uses to limit its number of threads
+THREAD_OPTIONS = {'highs': 'threads', 'cbc': 'threads', 'gurobi': 'Threads'}
+
+
+def available_backends(backends = None):
+    """Returns the names of the backends in backends (all of SOLVER_BACKENDS by default) that can be used on this machine"""
+    if backends is None:
+        backends = SOLVER_BACKENDS
+    return [backend for backend in backends
+            if pm.SolverFactory(SOLVER_BACKENDS[backend]['solver']).available(exception_flag = False)]
+
+
+def choose_backend(backend = None):
+    """Returns backend if it is given, otherwise the first of DEFAULT_BACKENDS that is available"""
+    if backend is not None:
+        if backend not in SOLVER_BACKENDS:
+            raise ValueError("Unknown solver backend {a}; choose from {b}".format(a = backend, b = list(SOLVER_BACKENDS)))
+        return backend
+    available = available_backends(DEFAULT_BACKENDS)
+    if not available:
+        raise RuntimeError("None of the solvers {a} are installed".format(a = list(DEFAULT_BACKENDS)))
+    return available[0]
+
+
+def make_solver(backend, persistent = False, threads = None, options = None, lp = False):
+    """Creates the Pyomo solver for backend with its options set. persistent gives the appsi version, which keeps the model
+    in memory between solves (falling back to the normal solver if the backend has none). lp uses LP_OPTIONS for models
+    without integer variables. options are added to, or replace, the backend's own options"""
+    settings = SOLVER_BACKENDS[backend]
+    solver_name = settings['persistent'] if persistent and settings['persistent'] is not None else settings['solver']
+    opt = pm.SolverFactory(solver_name)
+    backend_options = dict(settings['options'])
+    if lp and not persistent:
+        backend_options.update(LP_OPTIONS.get(backend, {}))
+    for option, value in dict(backend_options, **(options or {})).items():
+        opt.options[option] = value
+    if threads is not None and backend in THREAD_OPTIONS:
+        opt.options[THREAD_OPTIONS[backend]] = threads
+    return opt
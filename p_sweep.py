@@ -0,0 +1,178 @@
+"""Designs a plant for every grid cell of a profile NetCDF file (such as WindWales.nc), one driver task per cell spread
+over a process pool, writing each result to a csv file as soon as it arrives.
+Run as: python p_sweep.py profile_file.nc [output_file.csv] [--resume] [--aggregation hours]"""
+import os
+import sys
+import time
+import shutil
+import tempfile
+import numpy as np
+import xarray as xr
+from pathos.multiprocessing import ProcessPool
+import p_data_store as d_store
+import p_driver as driver
+import p_optimisation_designer as optimisation_designer
+import p_shared_profiles as shared_profiles
+import p_memory as memory
+import p_solution_cache as solution_cache
+
+
+# Hours per timestep of sweeps run from the command line; a single hourly design can take over ten minutes
+CLI_AGGREGATION = 24
+
+
+def grid_cells(weather_data):
+    """Yields the profiles of each grid cell of weather_data as a dictionary of 1D arrays (see renewable_data), which is
+    far cheaper to send to a worker than the dataset. Reads one latitude at a time, and skips cells without wind data
+    (e.g. masked sea or land cells)"""
+    sources = [source for source in ('Solar', 'Wind') if source in weather_data]
+    times = weather_data.time.values
+    for latitude in weather_data.latitude.values:
+        row = weather_data[sources].sel(latitude = latitude).transpose('time', 'longitude').load()
+        for count, longitude in enumerate(row.longitude.values):
+            cell = {source: np.ascontiguousarray(row[source].values[:, count]) for source in sources}
+            if np.isnan(cell['Wind']).all():
+                continue
+            cell.update(time = times, latitude = float(latitude), longitude = float(longitude))
+            yield cell
+
+
+def cell_coordinates(weather_data, cell):
+    """(latitude, longitude) of a cell from grid_cells or a p_shared_profiles.profile_cell of weather_data"""
+    if isinstance(cell, shared_profiles.profile_cell):
+        return (float(weather_data.latitude.values[cell.latitude_index]),
+                float(weather_data.longitude.values[cell.longitude_index]))
+    return cell['latitude'], cell['longitude']
+
+
+def cell_indices(weather_data, cell):
+    """(latitude index, longitude index) of a cell from grid_cells or a p_shared_profiles.profile_cell of weather_data"""
+    if isinstance(cell, shared_profiles.profile_cell):
+        return cell.latitude_index, cell.longitude_index
+    return (int(np.abs(weather_data.latitude.values - cell['latitude']).argmin()),
+            int(np.abs(weather_data.longitude.values - cell['longitude']).argmin()))
+
+
+def sweep(weather_data, design_class, design_years, aggregation_variable = 1, aggregation_mode = 'aggregate',
+          output_file_name = 'Sweep.csv', pool = None, processes = None, memory_budget = None, stored_data = None,
+          reuse_instance = True, shared = True, profile_directory = None, resume = False, operating_class = None,
+          operating_years = None, warm_start = False, cache_directory = None):
+    """Runs driver.driver for every grid cell of weather_data on pool, storing each result in stored_data as it arrives,
+    then writes the results of these cells to output_file_name. stored_data defaults to a p_data_store.Result_store
+    next to output_file_name, so results are on disk as soon as they arrive; with resume, an existing store is kept and
+    cells whose key it already holds are skipped. With reuse_instance, each worker reuses its design instance between
+    cells (see driver.get_design_instance). Returns stored_data.
+    The default store also writes the series of each location to a NetCDF file next to output_file_name.
+    With shared, the profiles are first written to memory-mapped files in profile_directory (a temporary directory,
+    deleted afterwards, if not given) and workers are only sent the index of their cell - see p_shared_profiles.py.
+    Otherwise each task carries the cell's arrays.
+    If no pool is given, one is made (and closed afterwards) with as many workers as fit in memory_budget MB (see
+    p_memory.py), up to processes (all cores by default), and the cores left over are given to the solvers as threads.
+    Either way, the number of tasks running at once is lowered if the first tasks use more memory than estimated.
+    With an operating_class and operating_years, every plant designed is then operated over each of operating_years,
+    with all (cell, year) pairs spread over the same pool; each worker reuses one operating instance, only swapping in
+    the profile and capacities (see driver.operate), and the production is stored as 'Production in year'.
+    With warm_start, the cells are run along a Hilbert curve over the grid, and each is started from the solution of its
+    nearest cell solved so far (see p_solution_cache.py; this needs the 'pyomo' backend, and HiGHS for the basis). A
+    sample of cells is still started cold, and the iterations and solve times of both are printed after the designs.
+    With a cache_directory (or DRIVER_CACHE set - see p_result_cache.py), cells designed before with the same profile,
+    costs and settings are taken from it rather than solved again, and are marked 'Memoized' in the results"""
+    if stored_data is None:
+        stored_data = d_store.Result_store(os.path.splitext(output_file_name)[0] + '.sqlite', resume = resume,
+                                           series_file = os.path.splitext(output_file_name)[0] + '_series.nc')
+        stored_data.get_active_components(design_class)
+    hours = int(weather_data.time.dt.year.isin(design_years).sum())
+    task_memory = memory.estimate_task_memory(design_class, hours, aggregation_variable)
+    own_pool = pool is None
+    if own_pool:
+        workers, solver_threads = memory.pool_size(task_memory, memory_budget, cores = processes)
+        design_class.set_solver_threads(solver_threads)
+        pool = ProcessPool(nodes = workers)
+    throttle = memory.task_throttle(pool.nodes, task_memory, memory_budget)
+    print('Running up to {a} tasks at once, estimated at {b:.0f} MB each'.format(a = pool.nodes, b = task_memory))
+
+    temporary_directory = None
+    if shared:
+        if profile_directory is None:
+            profile_directory = temporary_directory = tempfile.mkdtemp(prefix = 'profiles_')
+        cells = [shared_profiles.profile_cell(profile_directory, latitude_index, longitude_index)
+                 for latitude_index, longitude_index in shared_profiles.write_profiles(weather_data, profile_directory)]
+    else:
+        cells = grid_cells(weather_data)
+    cache = solution_cache.solution_cache() if warm_start else None
+    if warm_start:
+        cells = list(cells)
+        order = solution_cache.hilbert_order([cell_indices(weather_data, cell) for cell in cells])
+        cells = [cells[count] for count in order]
+
+    operating = operating_class is not None and bool(operating_years)
+    keys = []
+    cells_by_key = {}
+    designed = [] #(key, equipment capacities) of each plant designed, for the operating years
+    memoized = 0
+    def cells_to_run():
+        for cell in cells:
+            keys.append(d_store.location_key(*cell_coordinates(weather_data, cell), design_years, design_class.target_production))
+            if resume and keys[-1] in stored_data:
+                continue
+            if operating:
+                cells_by_key[keys[-1]] = cell
+            yield cell
+
+    try:
+        # With warm starts, the nearest solved cell is looked up as each task is sent, so it sees every result so far
+        TASKS = ((driver.driver, (cell, design_class, design_years, aggregation_variable, aggregation_mode,
+                                  operating_class if operating else None, reuse_instance, None, warm_start,
+                                  cache.start(*cell_coordinates(weather_data, cell), design_class.target_production,
+                                              design_class.sensitivity_dictionary) if warm_start else None,
+                                  cache_directory))
+                 for cell in cells_to_run())
+        # Results come back as soon as they are ready, rather than in the order of the cells
+        for result in throttle.run(pool, driver.calculatestar, TASKS):
+            if not isinstance(result, str):
+                equipment_capacities = result.pop('Equipment capacities', None)
+                memoized += bool(result.get('Memoized'))
+                if warm_start:
+                    cache.add(result, design_class.target_production, design_class.sensitivity_dictionary)
+                stored_data.add_location(result, design_years, scale = design_class.target_production)
+                if equipment_capacities is not None:
+                    designed.append((stored_data.key, equipment_capacities))
+        if warm_start:
+            cache.print_summary()
+        if memoized:
+            print('{a} cells were taken from the result cache'.format(a = memoized))
+
+        OPERATING_TASKS = ((driver.operate, (cells_by_key[key], operating_class, equipment_capacities, operating_year,
+                                             aggregation_variable, aggregation_mode, reuse_instance))
+                           for key, equipment_capacities in designed for operating_year in operating_years)
+        for result in throttle.run(pool, driver.calculatestar, OPERATING_TASKS):
+            key = d_store.location_key(result['Latitude'], result['Longitude'], design_years, design_class.target_production)
+            stored_data.add_operating_year(result['Annual Production'],
+                                           'Production in {year}'.format(year = result['Operating year']), key = key)
+        stored_data.to_csv(output_file_name, keys)
+    finally:
+        if temporary_directory is not None:
+            shutil.rmtree(temporary_directory, ignore_errors = True)
+        if own_pool:
+            pool.close()
+            pool.join()
+            pool.clear()
+    return stored_data
+
+
+if __name__ == '__main__':
+    resume = '--resume' in sys.argv
+    arguments = [argument for argument in sys.argv[1:] if argument != '--resume']
+    aggregation_variable = CLI_AGGREGATION
+    if '--aggregation' in arguments:
+        position = arguments.index('--aggregation')
+        aggregation_variable = int(arguments[position + 1])
+        del arguments[position:position + 2]
+    weather_file = arguments[0]
+    output_file_name = arguments[1] if len(arguments) > 1 else os.path.splitext(os.path.basename(weather_file))[0] + '_sweep.csv'
+    start_time = time.time()
+    weather_data = xr.open_dataset(weather_file)
+    design_years = [int(weather_data.time.dt.year.values[0])]
+    sweep(weather_data, optimisation_designer.location_optimise_design(1E6), design_years, aggregation_variable,
+          output_file_name = output_file_name, resume = resume)
+    print('The sweep took {a:.0f} s; results are in {b}'.format(a = time.time() - start_time, b = output_file_name))
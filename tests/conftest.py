@@ -0,0 +1,26 @@
+"""Shared fixtures: the modules live in the root of the repository, and the tests design on WindWales.nc"""
+import os
+import sys
+import pytest
+import xarray as xr
+
+REPOSITORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPOSITORY)
+
+import p_location_class as location_class
+
+
+@pytest.fixture(scope = 'session')
+def weather_data():
+    """The single grid cell of WindWales.nc"""
+    with xr.open_dataset(os.path.join(REPOSITORY, 'WindWales.nc')) as data:
+        yield data.load()
+
+
+def location(weather_data, design_class, aggregation_variable, years = (2019,)):
+    """The profile of WindWales.nc for design_class, aggregated into blocks of aggregation_variable hours"""
+    return location_class.renewable_data(weather_data, design_class._renewables,
+                                         latitude = float(weather_data.latitude[0]),
+                                         longitude = float(weather_data.longitude[0]),
+                                         years_of_interest = list(years), aggregation_variable = aggregation_variable,
+                                         aggregation_mode = 'aggregate')
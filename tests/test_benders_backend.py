@@ -0,0 +1,34 @@
+"""The Benders backend must design the same plant as the matrix backend solving the whole year at once, whether its
+periods are solved in turn or on a pool"""
+import pytest
+
+import p_optimisation_designer as optimisation_designer
+from conftest import location
+
+CAPACITIES = ('Wind', 'Solar', 'Elec', 'HB+ASU', 'Battery', 'Hydrogen storage capacity', 'Battery storage capacity',
+              'FC Capacity')
+
+
+def design(weather_data, backend, benders_workers = None):
+    """Designs a 1 Mt/y plant on daily blocks of WindWales 2019 with backend, returning its results"""
+    design_class = optimisation_designer.location_optimise_design(1E6, backend = backend,
+                                                                  benders_workers = benders_workers)
+    design_class.specific_model_features(location(weather_data, design_class, 24), False)
+    design_class.create_data()
+    instance = design_class.create_instance()
+    design_class.solve_model(instance)
+    assert design_class.converged
+    return design_class.store_results(instance)
+
+
+@pytest.fixture(scope = 'module')
+def matrix_results(weather_data):
+    return design(weather_data, 'matrix')
+
+
+@pytest.mark.parametrize('benders_workers', [None, 2])
+def test_benders_matches_matrix(weather_data, matrix_results, benders_workers):
+    benders_results = design(weather_data, 'benders', benders_workers)
+    assert benders_results['LCOA'] == pytest.approx(matrix_results['LCOA'], abs = 0.01)
+    for capacity in CAPACITIES:
+        assert benders_results[capacity] == pytest.approx(matrix_results[capacity], rel = 1e-3, abs = 0.05), capacity
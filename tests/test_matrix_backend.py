@@ -0,0 +1,27 @@
+"""The matrix backend must design the same plant as the Pyomo model it replaces"""
+import pytest
+
+import p_optimisation_designer as optimisation_designer
+from conftest import location
+
+# LCOA (USD/t) of WindWales 2019 with the Pyomo model, by hours per timestep
+REFERENCE_LCOA = {24: 470.73, 6: 491.55}
+
+
+def design(weather_data, backend, aggregation_variable):
+    """Designs a 1 Mt/y plant with backend, returning its results"""
+    design_class = optimisation_designer.location_optimise_design(1E6, backend = backend)
+    design_class.specific_model_features(location(weather_data, design_class, aggregation_variable), False)
+    design_class.create_data()
+    instance = design_class.create_instance()
+    design_class.solve_model(instance)
+    assert design_class.converged
+    return design_class.store_results(instance)
+
+
+@pytest.mark.parametrize('aggregation_variable', sorted(REFERENCE_LCOA))
+def test_matrix_matches_pyomo(weather_data, aggregation_variable):
+    pyomo_results = design(weather_data, 'pyomo', aggregation_variable)
+    matrix_results = design(weather_data, 'matrix', aggregation_variable)
+    assert matrix_results['LCOA'] == pytest.approx(pyomo_results['LCOA'], abs = 0.01)
+    assert matrix_results['LCOA'] == pytest.approx(REFERENCE_LCOA[aggregation_variable], abs = 0.01)
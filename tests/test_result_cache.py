@@ -0,0 +1,48 @@
+"""Stored driver results must survive edits to code that only decides where results go, and no others"""
+import os
+import shutil
+import pytest
+
+import p_optimisation_designer as optimisation_designer
+import p_result_cache as result_cache
+from conftest import REPOSITORY, location
+
+
+@pytest.fixture
+def package(tmp_path, monkeypatch):
+    """A copy of the package's modules, which run_key hashes in place of the real ones"""
+    directory = tmp_path / 'package'
+    directory.mkdir()
+    for name in os.listdir(REPOSITORY):
+        if name.endswith('.py'):
+            shutil.copy(os.path.join(REPOSITORY, name), directory)
+    code_version = result_cache.code_version.__wrapped__ #without the lru_cache, so edits are seen
+    monkeypatch.setattr(result_cache, 'code_version', lambda: code_version(str(directory)))
+    return directory
+
+
+def edit(file_name, text):
+    with open(file_name, 'a') as file:
+        file.write(text)
+
+
+def run_key(weather_data):
+    design_class = optimisation_designer.location_optimise_design(1E6)
+    return result_cache.run_key(location(weather_data, design_class, 24), design_class, [2019], 24, 'aggregate')
+
+
+def test_editing_main_keeps_results(weather_data, package, tmp_path):
+    cache_directory = str(tmp_path / 'cache')
+    key = run_key(weather_data)
+    result_cache.store(cache_directory, key, {'LCOA': 470.73})
+    edit(package / '__main__.py', "\nstored_data = d_store.Result_store('Another_run.sqlite')\n")
+    edit(package / 'p_sweep.py', '\n#another output file\n')
+    assert run_key(weather_data) == key
+    assert result_cache.load(cache_directory, key) == {'LCOA': 470.73}
+
+
+@pytest.mark.parametrize('module', result_cache.SOLVE_MODULES)
+def test_editing_solve_modules_changes_key(weather_data, package, module):
+    key = run_key(weather_data)
+    edit(package / (module + '.py'), '\n#changed\n')
+    assert run_key(weather_data) != key
@@ -0,0 +1,139 @@
+"""store_results reads the solved model into arrays in one pass (extract_solution). On the same solved instance, its
+results must be those of the per-timestep extraction it replaced, reproduced here as per_timestep_results. Only the
+objective and capacities are checked against known values: the dispatch is degenerate, so which optimum the solver
+returns can change without anything being wrong"""
+import numpy as np
+import pyomo.environ as pm
+import pytest
+
+import p_constraints as cons
+import p_optimisation_designer as optimisation_designer
+from conftest import location
+
+# LCOA (USD/t) and capacities (MW, or MWh and t for storage) of the designs below
+REFERENCE = {'grid_off': {'LCOA': 470.73, 'Wind': 1650.54, 'Solar': 0, 'Elec': 1462.24, 'HB+ASU': 93.79,
+                          'Battery': 4.23, 'Hydrogen storage capacity': 255.39, 'Battery storage capacity': 99.43,
+                          'FC Capacity': 0},
+             'grid_on': {'LCOA': 443.71, 'Wind': 1470.0, 'Solar': 0, 'Elec': 1359.86, 'HB+ASU': 93.76, 'Battery': 0,
+                         'Hydrogen storage capacity': 59.73, 'Battery storage capacity': 0, 'FC Capacity': 0}}
+# Results only location_optimise_design.store_results adds, or that change from run to run or were added since
+IGNORED = ('Solar Capex', 'Wind Capex', 'LCOA', 'Transfer Efficiency', 'Solve time', 'Timestep start')
+
+
+def grid_price(days):
+    """A synthetic weekly cycle of daily grid prices (AUD/MWh summed over each day), cheap enough that the grid is used"""
+    return 24 * (40 + 30 * np.sin(2 * np.pi * np.arange(days) / 7))
+
+
+@pytest.fixture(scope = 'module', params = ['grid_off', 'grid_on'])
+def design(request, weather_data):
+    """A 1 Mt/y plant designed on daily blocks of WindWales 2019, with its solved instance"""
+    grid_on = request.param == 'grid_on'
+    design_class = optimisation_designer.location_optimise_design(1E6, grid_on = grid_on)
+    profile = location(weather_data, design_class, 24)
+    if grid_on:
+        profile.grid_on = True
+        profile.concat['Grid'] = grid_price(len(profile.concat))
+    design_class.specific_model_features(profile, False)
+    design_class.create_data()
+    instance = design_class.create_instance()
+    design_class.solve_model(instance)
+    assert design_class.converged
+    return request.param, design_class, instance
+
+
+def per_timestep_results(design_class, instance):
+    """The results optimiser.store_results gave by calling pm.value for each timestep, before extract_solution"""
+    results = {'Converged': True}
+    location = design_class.location
+    scaling_factor = design_class.scaling_factor
+    results['Latitude'] = location.latitude
+    results['Longitude'] = location.longitude
+    results['Aggregation_variable'] = location.aggregation_variable
+    results['Aggregation_mode'] = location.aggregation_mode
+    results['Variance retained'] = round(location.aggregation_report['Variance retained'], 4)
+    results['Duration curve error'] = round(location.aggregation_report['Duration curve error'], 4)
+    results['Production'] = design_class.target_production
+    results['Max weight'] = max(pm.value(instance.t_weights[t]) for t in instance.t.data())
+    results['Total time'] = sum(pm.value(instance.t_weights[t]) for t in instance.t.data())
+
+    for Renewable in instance.Renewables:
+        results[Renewable] = round(pm.value(instance.C_power[Renewable] * scaling_factor), 2)
+    for Component in instance.Components:
+        Capacity = pm.value(instance.C_components[Component])
+        LF = sum(pm.value(instance.pi[Component, t] + instance.beta[Component, t] + instance.gamma[Component, t])
+                 for t in instance.t.data())
+        if LF > 0 and Capacity > 0:
+            LF = round(LF / (results['Total time']*Capacity/100), 2)
+        else:
+            LF = 'N/A'
+        results[str(Component) + ' LF'] = LF
+        results[Component] = round(Capacity * scaling_factor, 2)
+    for StorageComponent in instance.StorageComponents:
+        results[str(StorageComponent) + ' storage capacity'] = round(
+            pm.value(instance.C_storage[StorageComponent]) * scaling_factor, 2)
+
+    Capacity = pm.value(instance.C_FC)
+    if Capacity > 0:
+        LF = sum(pm.value(instance.gamma[Component, t]) for Component in instance.Components for t in instance.t.data())
+        results['FC LF'] = round(LF / (results['Total time'] * Capacity / 100), 2)
+    else:
+        results['FC LF'] = 0
+    results['FC Capacity'] = round(Capacity * scaling_factor, 2)
+
+    results['Grid Active'] = pm.value(cons._grid_connection(instance))
+    if results['Grid Active']:
+        results['Grid Fraction'] = round(sum(pm.value(instance.eta_in[t]) for t in instance.t)*100/
+                                         sum(pm.value(instance.pi[Component, t])
+                                             for Component in instance.Components for t in instance.t), 2)
+    supplied = sum(pm.value(instance.power_supply[Renewable, t]) * pm.value(instance.C_power[Renewable])
+                   for Renewable in instance.Renewables for t in instance.t)
+    results['Curtailed'] = sum(pm.value(instance.curtailed[t]) for t in instance.t)/supplied if supplied > 0 else 0
+
+    results['Hydrogen Storage'] = np.array([round(pm.value(instance.storage_volume[('Hydrogen', t)]) * scaling_factor, 2)
+                                            for t in instance.t.data()], dtype=np.float32)
+    results['Battery Storage'] = np.array([round(pm.value(instance.storage_volume[('Battery', t)]) * scaling_factor, 2)
+                                           for t in instance.t.data()], dtype=np.float32)
+    results['Ammonia Production'] = np.array([round(pm.value(instance.pi[('HB+ASU', t)] + instance.beta[('HB+ASU', t)] +
+                                                             instance.gamma[('HB+ASU', t)]) /
+                                                    pm.value(instance.C_components['HB+ASU']), 3)
+                                              for t in instance.t.data()], dtype=np.float32)
+    results['eta_in'] = np.array([pm.value(cons._grid_in(instance, t) * scaling_factor) for t in instance.t.data()],
+                                 dtype=np.float32)
+    results['eta_out'] = np.array([pm.value(cons._grid_out(instance, t) * scaling_factor) for t in instance.t.data()],
+                                  dtype=np.float32)
+
+    power_cost = 0
+    power_revenue = 0
+    for t in instance.t:
+        if pm.value(instance.grid_power_cost[t]) < 0:
+            power_revenue -= pm.value(instance.grid_power_cost[t]/instance.t_weights[t]) * pm.value(cons._grid_in(instance, t))
+        else:
+            power_cost += pm.value(instance.grid_power_cost[t]/instance.t_weights[t]) * pm.value(cons._grid_in(instance, t))
+            power_revenue += pm.value(instance.grid_power_cost_no_TUOS[t]/instance.t_weights[t]) * pm.value(cons._grid_out(instance, t))
+    results['Power cost'] = power_cost*scaling_factor
+    results['Power revenue'] = power_revenue*scaling_factor
+    if power_revenue != 0 or power_cost != 0:
+        results['LCOE'] = power_cost*1E6/sum(pm.value(instance.eta_in[t]) for t in instance.t)
+    return results
+
+
+def test_store_results_matches_per_timestep_extraction(design):
+    _, design_class, instance = design
+    expected = per_timestep_results(design_class, instance)
+    results = {name: value for name, value in design_class.store_results(instance).items() if name not in IGNORED}
+    assert sorted(results) == sorted(expected)
+    for name, value in expected.items():
+        if isinstance(value, np.ndarray):
+            np.testing.assert_allclose(results[name], value, rtol = 1E-6, atol = 1E-6, err_msg = name)
+        elif isinstance(value, str):
+            assert results[name] == value, name
+        else:
+            assert results[name] == pytest.approx(value, rel = 1E-9, abs = 1E-12), name
+
+
+def test_objective_and_capacities(design):
+    layout, design_class, instance = design
+    results = design_class.store_results(instance)
+    for name, value in REFERENCE[layout].items():
+        assert results[name] == pytest.approx(value, rel = 1E-3, abs = 0.05), name